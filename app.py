@@ -1,7 +1,7 @@
-import os
 import logging
+import os
 
-from flask import Flask
+from flask import Flask, g, session
 from extensions import db
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy.orm import DeclarativeBase
@@ -9,25 +9,126 @@ from flask_login import LoginManager
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 
-# Configure logging
-logging.basicConfig(level=logging.DEBUG)
-
 class Base(DeclarativeBase):
     pass
 
 
-db = SQLAlchemy(model_class=Base)
+from services.sites import (  # noqa: E402
+    SiteRoutingSession, parse_sites, parse_site_databases, install_site_scoping, site_databases,
+)
+db = SQLAlchemy(model_class=Base, session_options={"class_": SiteRoutingSession})
 # create the app
 app = Flask(__name__)
 app.secret_key = os.environ.get("SESSION_SECRET", "dev-secret-key")
 app.wsgi_app = ProxyFix(app.wsgi_app, x_proto=1, x_host=1)  # needed for url_for to generate with https
 
+# logging (see services/structured_logging.py): records are written as JSON lines (LOG_FORMAT=text
+# for plain lines) by a background thread. LOG_LEVELS overrides single loggers, "name=LEVEL,..."
+from services.structured_logging import configure_logging, install_request_logging, parse_levels  # noqa: E402
+app.config["LOG_LEVEL"] = os.environ.get("LOG_LEVEL", "INFO")
+app.config["LOG_LEVELS"] = parse_levels(os.environ.get("LOG_LEVELS", ""))
+app.config["LOG_FORMAT"] = os.environ.get("LOG_FORMAT", "json")
+app.config["LOG_QUEUE_SIZE"] = int(os.environ.get("LOG_QUEUE_SIZE", "10000"))
+app.config["LOG_REQUESTS"] = os.environ.get("LOG_REQUESTS", "1") == "1"
+configure_logging(app.config["LOG_LEVEL"], app.config["LOG_LEVELS"], app.config["LOG_FORMAT"],
+                  queue_size=app.config["LOG_QUEUE_SIZE"])
+install_request_logging(app, app.config["LOG_REQUESTS"])
+
 # configure the database, relative to the app instance folder
-app.config["SQLALCHEMY_DATABASE_URI"] = "sqlite:///sigede.db"
+app.config["SQLALCHEMY_DATABASE_URI"] = os.environ.get("DATABASE_URL", "sqlite:///sigede.db")
+# monthly range partitioning of the high-volume tables, Postgres only (see services/partitions.py)
+app.config["PARTITION_TABLES"] = (
+    os.environ.get("PARTITION_TABLES") == "1"
+    and app.config["SQLALCHEMY_DATABASE_URI"].startswith("postgresql")
+)
+# how far back lab requests and external results are searched when matching them
+app.config["LAB_MATCH_WINDOW_DAYS"] = int(os.environ.get("LAB_MATCH_WINDOW_DAYS", "30"))
+# admission control for /external-lab-api (see services/admission_control.py); limits are per worker.
+# LAB_API_KEYS is "client-name:key:SITE+SITE,..."; a client may only send results for the sites listed
+# with its key (SITE_CODE if none are). With no keys, clients are identified by address, which behind
+# a reverse proxy is the proxy's, so all clients then share one rate limit
+from services.admission_control import parse_api_keys, parse_api_key_sites  # noqa: E402
+app.config["LAB_API_KEYS"] = parse_api_keys(os.environ.get("LAB_API_KEYS", ""))
+app.config["LAB_API_RATE"] = float(os.environ.get("LAB_API_RATE", "20"))
+app.config["LAB_API_BURST"] = float(os.environ.get("LAB_API_BURST", "50"))
+app.config["LAB_API_MAX_CONCURRENT"] = int(os.environ.get("LAB_API_MAX_CONCURRENT", "2"))
 app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
     "pool_recycle": 300,
     "pool_pre_ping": True,
 }
+# connections per worker process; gunicorn.conf.py sizes the pool to the worker's threads or
+# greenlets, and DB_MAX_OVERFLOW leaves room for the background writers
+if os.environ.get("DB_POOL_SIZE"):
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"].update(
+        pool_size=int(os.environ["DB_POOL_SIZE"]),
+        max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", "2")),
+    )
+# closed encounters are moved here by the archival job (see services/archive.py)
+app.config["SQLALCHEMY_BINDS"] = {
+    "archive": os.environ.get("ARCHIVE_DATABASE_URL", "sqlite:///sigede_archive.db"),
+}
+# facilities (see services/sites.py): SITES is "CODE:Name,..."; SITE_CODE is the site used
+# outside a logged-in request. SITE_DATABASES optionally gives a site its own database
+app.config["SITE_CODE"] = os.environ.get("SITE_CODE", "MAIN")
+app.config["SITES"] = parse_sites(os.environ.get("SITES", ""), app.config["SITE_CODE"])
+app.config["SQLALCHEMY_BINDS"].update(parse_site_databases(os.environ.get("SITE_DATABASES", "")))
+app.config["LAB_API_KEY_SITES"] = parse_api_key_sites(os.environ.get("LAB_API_KEYS", ""), app.config["SITE_CODE"])
+# LAB_FACILITY_SITES is "FACILITY=SITE,..." and sends HL7 results to the site of their sending facility
+# (MSH-4). Facilities named like a site go to it; with the setting, results from other facilities are
+# rejected, without it they go to SITE_CODE
+from services.hl7 import parse_facility_sites  # noqa: E402
+app.config["LAB_FACILITY_SITES"] = parse_facility_sites(os.environ.get("LAB_FACILITY_SITES", ""))
+# prefix of automatically allocated MRNs (see services/mci.py); defaults to the site code.
+# Nodes that register patients independently (edge installations) need a prefix of their own
+app.config["MRN_PREFIX"] = os.environ.get("MRN_PREFIX", "")
+app.config["ARCHIVE_AFTER_DAYS"] = int(os.environ.get("ARCHIVE_AFTER_DAYS", "365"))
+# edge/central synchronisation (see services/sync.py). Edge nodes set NODE_ID, SYNC_CENTRAL_URL
+# and SYNC_API_KEY; central lists "node-id:key,..." in SYNC_API_KEYS and should set CHANGE_LOG=1
+# so its own edits take part in conflict resolution
+app.config["NODE_ID"] = os.environ.get("NODE_ID", "central")
+app.config["SYNC_CENTRAL_URL"] = os.environ.get("SYNC_CENTRAL_URL", "")
+app.config["SYNC_API_KEY"] = os.environ.get("SYNC_API_KEY", "")
+app.config["SYNC_API_KEYS"] = parse_api_keys(os.environ.get("SYNC_API_KEYS", ""))
+app.config["CHANGE_LOG"] = os.environ.get("CHANGE_LOG") == "1" or bool(app.config["SYNC_CENTRAL_URL"])
+# clinical audit log (see services/audit.py), written behind by a background thread
+app.config["AUDIT_LOG"] = os.environ.get("AUDIT_LOG", "1") == "1"
+app.config["AUDIT_BUFFER_SIZE"] = int(os.environ.get("AUDIT_BUFFER_SIZE", "10000"))
+app.config["AUDIT_BATCH_SIZE"] = int(os.environ.get("AUDIT_BATCH_SIZE", "500"))
+app.config["AUDIT_FLUSH_INTERVAL"] = float(os.environ.get("AUDIT_FLUSH_INTERVAL", "0.5"))
+# template caching (see services/fragment_cache.py); an empty JINJA_CACHE_DIR disables the
+# bytecode cache and FRAGMENT_CACHE_SIZE=0 disables {% cache %}
+app.config["JINJA_CACHE_DIR"] = os.environ.get("JINJA_CACHE_DIR", os.path.join(app.instance_path, "jinja_cache"))
+app.config["FRAGMENT_CACHE_SIZE"] = int(os.environ.get("FRAGMENT_CACHE_SIZE", "5000"))
+# fingerprinted, precompressed bundles written by build_assets.py (see services/assets.py)
+app.config["ASSET_DIST_DIR"] = os.environ.get("ASSET_DIST_DIR", os.path.join(app.static_folder, "dist"))
+# vendor files that were never fetched are left out of pages (and logged) rather than loaded from a
+# CDN the hospital network may not reach; ASSET_CDN_FALLBACK=1 allows the CDN, e.g. in development
+app.config["ASSET_CDN_FALLBACK"] = os.environ.get("ASSET_CDN_FALLBACK") == "1"
+# label printing (see services/labels.py): a spool directory or tcp://host:port of a raw printer
+app.config["LABEL_PRINTER"] = os.environ.get("LABEL_PRINTER", os.path.join(app.instance_path, "label_spool"))
+app.config["LABEL_CACHE_SIZE"] = int(os.environ.get("LABEL_CACHE_SIZE", "2000"))
+# insurance eligibility checks (see services/eligibility.py); ELIGIBILITY_PAYERS is JSON keyed by
+# insurance type. ELIGIBILITY_WAIT is how long a request waits for a payer before answering 'pending'
+from services.eligibility import parse_payers  # noqa: E402
+app.config["ELIGIBILITY_PAYERS"] = parse_payers(os.environ.get("ELIGIBILITY_PAYERS", ""))
+app.config["ELIGIBILITY_WORKERS"] = int(os.environ.get("ELIGIBILITY_WORKERS", "8"))
+app.config["ELIGIBILITY_CACHE_TTL"] = float(os.environ.get("ELIGIBILITY_CACHE_TTL", "3600"))
+app.config["ELIGIBILITY_WAIT"] = float(os.environ.get("ELIGIBILITY_WAIT", "0.5"))
+# Full-text search over clinical notes: index objects are created at startup when missing
+app.config["SEARCH_INDEX"] = os.environ.get("SEARCH_INDEX", "1") == "1"
+# Downstream systems (billing, inpatient HIS, pharmacy) that receive clinical events through the
+# outbox, as JSON (see services/outbox.py); delivered events are kept OUTBOX_RETENTION_DAYS
+from services.outbox import parse_destinations  # noqa: E402
+app.config["OUTBOX_DESTINATIONS"] = parse_destinations(os.environ.get("OUTBOX_DESTINATIONS", ""))
+app.config["OUTBOX_RETENTION_DAYS"] = int(os.environ.get("OUTBOX_RETENTION_DAYS", "7"))
+# Allergy and drug-interaction reference (see services/interactions.py); each worker reloads it
+# within INTERACTION_RELOAD_INTERVAL seconds of the file changing
+app.config["INTERACTION_DATASET"] = os.environ.get(
+    "INTERACTION_DATASET", os.path.join(app.root_path, "reference", "drug_interactions.json")
+)
+app.config["INTERACTION_RELOAD_INTERVAL"] = float(os.environ.get("INTERACTION_RELOAD_INTERVAL", "30"))
+# The current roster is cached until the next shift boundary, and at most this many seconds
+app.config["ROSTER_CACHE_MAX_AGE"] = float(os.environ.get("ROSTER_CACHE_MAX_AGE", "300"))
 # initialize the app with the extension, flask-sqlalchemy >= 3.0.x
 db.init_app(app)
 
@@ -44,6 +145,11 @@ from routes.emergency import emergency_bp
 from routes.transfer import transfer_bp
 from routes.dashboard import dashboard_bp
 from routes.laboratory import laboratory_bp
+from routes.export import export_bp
+from routes.sync import sync_bp
+from routes.assets import assets_bp
+from routes.labels import labels_bp
+from routes.search import search_bp
 
 app.register_blueprint(auth_bp)
 app.register_blueprint(admin_bp)
@@ -51,13 +157,64 @@ app.register_blueprint(emergency_bp)
 app.register_blueprint(transfer_bp)
 app.register_blueprint(dashboard_bp)
 app.register_blueprint(laboratory_bp)
+app.register_blueprint(export_bp)
+app.register_blueprint(sync_bp)
+app.register_blueprint(assets_bp)
+app.register_blueprint(labels_bp)
+app.register_blueprint(search_bp)
 
 with app.app_context():
     # Import models here to ensure they're registered with SQLAlchemy
     import models  # noqa: F401
     db.create_all()
+    # create_all() never alters existing tables; add the columns and indexes of newer releases
+    from services.migrations import upgrade_schema
+    upgrade_schema(db.engine, app.config["SITE_CODE"])
+    if app.config["PARTITION_TABLES"]:
+        from services.partitions import ensure_partitions
+        try:
+            ensure_partitions()
+        except Exception:
+            # Missing partitions only send rows to the default partition; never refuse to start over them
+            db.session.rollback()
+            logging.exception("Could not ensure monthly partitions; run maintain_partitions.py")
+    for site_code, engine in site_databases().items():
+        db.metadata.create_all(engine)
+        upgrade_schema(engine, site_code)
+    if app.config["SEARCH_INDEX"]:
+        from services.search import install_search_index
+        for engine in [db.engine, *site_databases().values()]:
+            install_search_index(engine)
+    install_site_scoping(db.session, models.SITE_SCOPED_MODELS)
+    from services.lab_catalog import alias_map
+    alias_map.load()
+    from services.interactions import current_index
+    current_index()
+    from services.fragment_cache import install_template_caching
+    install_template_caching(app)
+    from services.assets import asset_urls
+    app.jinja_env.globals['asset_urls'] = asset_urls
+    if app.config["AUDIT_LOG"]:
+        from services.audit import install_audit_log
+        install_audit_log()
+    if app.config["CHANGE_LOG"]:
+        from services.sync import install_change_capture
+        install_change_capture()
+    if app.config["OUTBOX_DESTINATIONS"]:
+        from services.outbox import install_outbox
+        install_outbox()
 
 @login_manager.user_loader
 def load_user(user_id):
     from models import User
     return User.query.get(int(user_id))
+
+@app.before_request
+def set_site():
+    # Chosen at login; everything in the request is scoped to (and routed to) this site
+    site_code = session.get('site_code')
+    g.site_code = site_code if site_code in app.config["SITES"] else app.config["SITE_CODE"]
+
+@app.context_processor
+def inject_site():
+    return {'current_site_name': app.config["SITES"].get(g.get('site_code')), 'sites': app.config["SITES"]}
@@ -0,0 +1,20 @@
+import argparse
+
+from app import app
+from services.archive import archive_closed_encounters, DEFAULT_BATCH_SIZE
+
+def main():
+    """Move closed encounters older than the retention window into the archive database"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--days', type=int, help="Retention window in days (defaults to ARCHIVE_AFTER_DAYS)")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--pause', type=float, default=0.5, help="Seconds to sleep between batches")
+    parser.add_argument('--max-batches', type=int, help="Stop after this many batches per table")
+    args = parser.parse_args()
+
+    with app.app_context():
+        counts = archive_closed_encounters(args.days, args.batch_size, args.pause, args.max_batches)
+        print(f"Archived {counts['encounters']} encounters and {counts['external_results']} external results")
+
+if __name__ == "__main__":
+    main()
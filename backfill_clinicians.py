@@ -0,0 +1,22 @@
+import argparse
+
+from app import app
+from services.clinicians import backfill_clinician_ids
+
+def main():
+    """Link examinations, lab requests, prescriptions and dispositions recorded by clinician name to staff accounts"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--create-missing', action='store_true',
+                        help="Create a staff account (random password) for each name that matches no account")
+    args = parser.parse_args()
+
+    with app.app_context():
+        updated, unresolved = backfill_clinician_ids(create_missing=args.create_missing)
+        print(f"Linked {updated} rows to clinician accounts")
+        if unresolved:
+            print(f"{len(unresolved)} names match no account, or more than one:")
+            for name in unresolved:
+                print(f"  {name}")
+
+if __name__ == "__main__":
+    main()
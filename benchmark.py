@@ -0,0 +1,251 @@
+import argparse
+import http.client
+import importlib.util
+import logging
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from app import app, db
+from models import Patient
+from services.structured_logging import configure_logging, pipeline, request_logger
+
+# Logging setups compared by the logging benchmark
+LOGGING_MODES = {
+    'off': "WARNING level, no request records",
+    'sync': "DEBUG level, formatted and written on the request thread (the old basicConfig setup)",
+    'queued': "INFO level, JSON records written by the background listener",
+}
+
+class SlowStream:
+    """File wrapper whose writes block for `delay` seconds, like a stderr pipe to a busy log collector"""
+
+    def __init__(self, stream, delay):
+        self.stream = stream
+        self.delay = delay
+
+    def write(self, text):
+        time.sleep(self.delay)
+        return self.stream.write(text)
+
+    def flush(self):
+        self.stream.flush()
+
+def report(label, latencies, baseline=None):
+    latencies = sorted(latencies)
+    mean = sum(latencies) / len(latencies)
+    line = (f"{label:<8} mean={mean * 1e6:7.1f}us p50={latencies[len(latencies) // 2] * 1e6:7.1f}us "
+            f"p99={latencies[int(len(latencies) * 0.99)] * 1e6:7.1f}us")
+    if baseline is not None:
+        line += f" overhead={(mean - baseline) * 1e6:+.1f}us/request"
+    print(line)
+    return mean
+
+def use_logging_mode(mode, stream):
+    if mode == 'sync':
+        pipeline.stop()
+        root = logging.getLogger()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+        handler = logging.StreamHandler(stream)
+        handler.setFormatter(logging.Formatter(logging.BASIC_FORMAT))
+        root.addHandler(handler)
+        root.setLevel(logging.DEBUG)
+        request_logger.setLevel(logging.NOTSET)
+    else:
+        configure_logging('WARNING' if mode == 'off' else 'INFO', stream=stream)
+        request_logger.setLevel(logging.WARNING if mode == 'off' else logging.NOTSET)
+
+def benchmark_logging(args):
+    """Per-request cost of logging: a request that logs like the lab result import path"""
+    def logged_view():
+        for number in range(args.records):
+            logging.debug("Looking up lab request %s for MRN %s", number, 'MRN1000')
+            logging.info("Successfully imported external result %s to lab request %s", number, number)
+        return ''
+
+    app.add_url_rule('/benchmark/logging', 'benchmark_logging', logged_view)
+    client = app.test_client()
+    baseline = None
+    with tempfile.TemporaryFile('w') as output:
+        stream = SlowStream(output, args.write_delay / 1e6) if args.write_delay else output
+        for mode in args.modes:
+            use_logging_mode(mode, stream)
+            for _ in range(args.warmup):
+                client.get('/benchmark/logging')
+            latencies = []
+            for _ in range(args.requests):
+                started = time.perf_counter()
+                client.get('/benchmark/logging')
+                latencies.append(time.perf_counter() - started)
+            mean = report(mode, latencies, baseline)
+            if baseline is None:
+                baseline = mean
+            pipeline.stop()
+            if mode == 'queued' and pipeline.handler.dropped:
+                print(f"         {pipeline.handler.dropped} records dropped from the full queue")
+    configure_logging(app.config["LOG_LEVEL"], app.config["LOG_LEVELS"], app.config["LOG_FORMAT"],
+                      queue_size=app.config["LOG_QUEUE_SIZE"])
+
+def create_benchmark_app():
+    """The application plus a synthetic I/O-bound endpoint; served by gunicorn for the profile benchmark.
+
+    /benchmark/io waits BENCHMARK_IO_LATENCY seconds, like a remote call or a slow query, then runs
+    a small query. The login page stands in for an ordinary CPU-bound page.
+    """
+    latency = float(os.environ.get('BENCHMARK_IO_LATENCY', '0.05'))
+
+    def io_view():
+        time.sleep(latency)
+        return {'patients': db.session.query(Patient.id).limit(10).count()}
+
+    app.add_url_rule('/benchmark/io', 'benchmark_io', io_view)
+    return app
+
+def wait_until_serving(port, process, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"gunicorn exited with status {process.returncode}")
+        try:
+            connection = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            connection.request('GET', '/login')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            time.sleep(0.2)
+    raise RuntimeError(f"gunicorn did not start serving on port {port} within {timeout}s")
+
+def run_load(port, concurrency, duration, io_share):
+    """Closed-loop load: each client sends its next request when the previous one is answered"""
+    latencies = {'page': [], 'io': []}
+    errors = []
+    deadline = time.monotonic() + duration
+
+    def client():
+        connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        while time.monotonic() < deadline:
+            kind = 'io' if random.random() < io_share else 'page'
+            started = time.perf_counter()
+            try:
+                connection.request('GET', '/benchmark/io' if kind == 'io' else '/login')
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+                    continue
+            except (OSError, http.client.HTTPException) as e:
+                errors.append(type(e).__name__)
+                connection.close()
+                connection = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                continue
+            latencies[kind].append(time.perf_counter() - started)
+        connection.close()
+
+    clients = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    return latencies, errors, time.perf_counter() - started
+
+def benchmark_profiles(args):
+    """Throughput and tail latency of the gunicorn worker profiles under the same synthetic load"""
+    if importlib.util.find_spec('gunicorn') is None:
+        raise SystemExit("gunicorn is not installed")
+    for profile in args.profiles:
+        if profile == 'gevent' and importlib.util.find_spec('gevent') is None:
+            print(f"{profile:<8} skipped: gevent is not installed (pip install .[async])")
+            continue
+        env = dict(os.environ, GUNICORN_PROFILE=profile, GUNICORN_BIND=f"127.0.0.1:{args.port}",
+                   BENCHMARK_IO_LATENCY=str(args.io_latency), LOG_REQUESTS='0', LOG_LEVEL='WARNING')
+        server = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'benchmark:create_benchmark_app()'],
+            env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        try:
+            wait_until_serving(args.port, server)
+            run_load(args.port, args.concurrency, min(args.duration, 2), args.io_share)  # warm up
+            latencies, errors, elapsed = run_load(args.port, args.concurrency, args.duration, args.io_share)
+        finally:
+            server.terminate()
+            server.wait()
+
+        total = sum(len(values) for values in latencies.values())
+        line = f"{profile:<8} {total / elapsed:7.1f} req/s"
+        for kind, values in latencies.items():
+            if values:
+                values.sort()
+                line += (f"  {kind} p50={values[len(values) // 2] * 1000:6.1f}ms "
+                         f"p99={values[int(len(values) * 0.99)] * 1000:6.1f}ms")
+        if errors:
+            line += f"  {len(errors)} errors"
+        print(line)
+
+def benchmark_interactions(args):
+    """Time to check a new order against a medication list with the compiled interaction index"""
+    from services.interactions import InteractionChecker
+
+    index = InteractionChecker().load(app.config['INTERACTION_DATASET'])
+    drugs = sorted(index.concepts)
+    rng = random.Random(1)
+    orders = [rng.choice(drugs) for _ in range(args.checks)]
+    medication_lists = []
+    for _ in range(args.checks):
+        listed = rng.sample(drugs, args.medications)
+        medication_lists.append([(drug, drug) for drug in listed])
+    allergies = "penicillin (rash), sulfa, aspirin"
+
+    for _ in range(min(args.checks, 1000)):
+        index.check(orders[0], allergies, medication_lists[0])
+    latencies = []
+    warnings = 0
+    for order, medications in zip(orders, medication_lists):
+        started = time.perf_counter()
+        warnings += len(index.check(order, allergies, medications))
+        latencies.append(time.perf_counter() - started)
+    report(f"{args.medications} meds", latencies)
+    print(f"         {warnings / args.checks:.1f} warnings per check")
+
+def main():
+    """Benchmarks of request handling; each prints throughput or mean and tail latencies per configuration"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    logging_parser = subparsers.add_parser('logging', help=benchmark_logging.__doc__)
+    logging_parser.add_argument('--requests', type=int, default=2000)
+    logging_parser.add_argument('--warmup', type=int, default=200)
+    logging_parser.add_argument('--records', type=int, default=5, help="DEBUG and INFO record pairs logged per request")
+    logging_parser.add_argument('--write-delay', type=float, default=0,
+                                help="Microseconds each write of the log output blocks for")
+    logging_parser.add_argument('--modes', nargs='+', choices=list(LOGGING_MODES), default=list(LOGGING_MODES),
+                                help="; ".join(f"{mode}: {text}" for mode, text in LOGGING_MODES.items()))
+    logging_parser.set_defaults(run=benchmark_logging)
+
+    interactions_parser = subparsers.add_parser('interactions', help=benchmark_interactions.__doc__)
+    interactions_parser.add_argument('--checks', type=int, default=10000)
+    interactions_parser.add_argument('--medications', type=int, default=20, help="Length of the medication list")
+    interactions_parser.set_defaults(run=benchmark_interactions)
+
+    profiles_parser = subparsers.add_parser('profiles', help=benchmark_profiles.__doc__)
+    profiles_parser.add_argument('--profiles', nargs='+', choices=['sync', 'gthread', 'gevent'],
+                                 default=['sync', 'gthread', 'gevent'])
+    profiles_parser.add_argument('--concurrency', type=int, default=32, help="Simultaneous clients")
+    profiles_parser.add_argument('--duration', type=float, default=20, help="Seconds of load per profile")
+    profiles_parser.add_argument('--io-latency', type=float, default=0.05,
+                                 help="Seconds the synthetic I/O-bound endpoint waits")
+    profiles_parser.add_argument('--io-share', type=float, default=0.5,
+                                 help="Fraction of requests sent to the I/O-bound endpoint")
+    profiles_parser.add_argument('--port', type=int, default=5099)
+    profiles_parser.set_defaults(run=benchmark_profiles)
+
+    args = parser.parse_args()
+    args.run(args)
+
+if __name__ == "__main__":
+    main()
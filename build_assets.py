@@ -0,0 +1,26 @@
+import argparse
+import os
+
+from app import app
+from services.assets import build_assets, vendor_assets
+
+def main():
+    """Build fingerprinted, minified and precompressed static bundles into ASSET_DIST_DIR"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--vendor', action='store_true',
+                        help="first download third-party assets into static/vendor (needs internet access)")
+    parser.add_argument('--force', action='store_true', help="re-download vendor files that already exist")
+    args = parser.parse_args()
+
+    try:
+        if args.vendor:
+            print(f"Fetched {vendor_assets(app.static_folder, force=args.force)} vendor files")
+        manifest = build_assets(app.static_folder, app.config['ASSET_DIST_DIR'])
+    except RuntimeError as e:
+        parser.error(str(e))
+    for name, hashed in sorted(manifest.items()):
+        size = os.path.getsize(os.path.join(app.config['ASSET_DIST_DIR'], hashed))
+        print(f"{name} -> {hashed} ({size} bytes)")
+
+if __name__ == "__main__":
+    main()
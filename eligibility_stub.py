@@ -0,0 +1,60 @@
+import argparse
+import json
+import random
+import time
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class PayerHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections alive, as a real payer gateway would
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        time.sleep(self.server.latency)
+        if random.random() < self.server.failure_rate:
+            self._reply(503, {'message': 'Payer system busy'})
+            return
+
+        # Made-up rules: ids starting with X are unknown, ids ending in an odd digit have lapsed cover
+        member_id = str(payload.get('member_id', ''))
+        if not member_id or member_id.upper().startswith('X'):
+            self._reply(404, {'message': 'Member not found'})
+        elif member_id[-1].isdigit() and int(member_id[-1]) % 2:
+            self._reply(200, {'eligible': False, 'plan': 'Basic', 'coverage_end': (date.today() - timedelta(days=30)).isoformat(),
+                              'message': 'Coverage has lapsed'})
+        else:
+            self._reply(200, {'eligible': True, 'plan': 'Standard', 'coverage_end': (date.today() + timedelta(days=365)).isoformat(),
+                              'message': 'Active coverage'})
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+def main():
+    """Stub payer eligibility service for development and testing of services/eligibility.py"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=1.0, help="Seconds each check takes")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Fraction of checks answered with 503")
+    parser.add_argument('--quiet', action='store_true', help="Do not log each request")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), PayerHandler)
+    server.latency = args.latency
+    server.failure_rate = args.failure_rate
+    server.quiet = args.quiet
+    print(f"Stub payer listening on http://{args.host}:{args.port}/ (latency {args.latency}s)")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
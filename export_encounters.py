@@ -0,0 +1,23 @@
+import argparse
+from datetime import datetime
+
+from app import app
+from services.export import export_encounters, DEFAULT_CHUNK_SIZE
+
+def main():
+    """Export historical encounters to month-partitioned Parquet/Arrow files"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('output_dir', help="Directory for the partitioned export and its watermark")
+    parser.add_argument('--format', choices=['parquet', 'arrow'], default='parquet')
+    parser.add_argument('--until', help="Only export encounters registered before this date (YYYY-MM-DD)")
+    parser.add_argument('--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE)
+    args = parser.parse_args()
+
+    until = datetime.strptime(args.until, '%Y-%m-%d') if args.until else None
+
+    with app.app_context():
+        total = export_encounters(args.output_dir, args.format, until, args.chunk_size)
+        print(f"Exported {total} encounters to {args.output_dir}")
+
+if __name__ == "__main__":
+    main()
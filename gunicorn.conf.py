@@ -0,0 +1,101 @@
+"""Gunicorn deployment profiles; gunicorn reads this file from the working directory.
+
+    GUNICORN_PROFILE=gthread gunicorn main:app
+
+Every view is synchronous, so while a request waits on the database or a
+remote service it holds whatever runs it. The profiles differ in what
+that is:
+
+* sync: one request per process. This gives the most isolation and is
+  fine for CPU-bound pages, but a slow query takes a whole worker.
+* gthread (default): a few processes, each with a pool of threads.
+  Waiting threads release the GIL, so the other threads keep serving.
+* gevent: each request runs in a greenlet, and blocking calls (sockets,
+  sleeps and, with psycogreen, Postgres queries) yield to the other
+  greenlets. Hundreds of slow requests fit in one worker. This is for the
+  I/O-bound endpoints: lab result ingestion (/external-lab-api), streamed
+  exports (/export) and eligibility checks. Run it as a second instance
+  that the reverse proxy routes those paths to, and keep the clinical
+  pages on gthread. Needs the "async" extra (gevent, psycogreen).
+
+Sessions are safe under every profile. Flask-SQLAlchemy scopes them to
+the application context, which lives in a context variable, and each
+greenlet has its own. Background threads (audit writer, log listener,
+eligibility pool) are started lazily in each worker, so they are
+greenlets under gevent.
+
+Worker counts come from the CPU count. Connections are budgeted against
+the database: each worker's SQLAlchemy pool gets one connection per
+thread or greenlet that can use one, so requests never queue inside a
+worker for a connection that was never going to be there. All workers
+together stay within DB_MAX_CONNECTIONS. WEB_CONCURRENCY, GUNICORN_THREADS
+and GUNICORN_WORKER_CONNECTIONS override the computed values.
+benchmark.py profiles compares the profiles under the same load.
+"""
+import logging
+import multiprocessing
+import os
+
+PROFILES = ('sync', 'gthread', 'gevent')
+
+profile = os.environ.get('GUNICORN_PROFILE', 'gthread')
+if profile not in PROFILES:
+    raise ValueError(f"Unknown GUNICORN_PROFILE {profile!r}, expected one of {', '.join(PROFILES)}")
+
+cpus = multiprocessing.cpu_count()
+# Connections this instance may hold in total, across all of its workers
+db_connections = int(os.environ.get('DB_MAX_CONNECTIONS', '80'))
+
+
+def _env_int(name, default):
+    return int(os.environ.get(name) or default)
+
+
+bind = os.environ.get('GUNICORN_BIND', f"0.0.0.0:{os.environ.get('PORT', '5000')}")
+worker_class = profile
+# Recycle workers now and then so a slow leak cannot grow without bound; the jitter keeps
+# them from all restarting at once
+max_requests = 2000
+max_requests_jitter = 200
+graceful_timeout = 30
+# Behind a reverse proxy that reuses its upstream connections
+keepalive = 5
+
+if profile == 'sync':
+    # CPU-bound: a couple of processes per core keeps the cores busy while some wait
+    workers = _env_int('WEB_CONCURRENCY', 2 * cpus + 1)
+    timeout = 30
+    db_pool_size = 1
+elif profile == 'gthread':
+    workers = _env_int('WEB_CONCURRENCY', cpus + 1)
+    threads = _env_int('GUNICORN_THREADS', max(2, min(8, db_connections // workers)))
+    timeout = 60
+    db_pool_size = threads
+else:
+    # One process per core; concurrency comes from greenlets, bounded by the connection budget
+    workers = _env_int('WEB_CONCURRENCY', cpus)
+    worker_connections = _env_int('GUNICORN_WORKER_CONNECTIONS', 500)
+    timeout = 120
+    db_pool_size = max(2, min(worker_connections, db_connections // workers))
+
+# Read by app.py when the worker imports it
+os.environ.setdefault('DB_POOL_SIZE', str(db_pool_size))
+
+
+def on_starting(server):
+    server.log.info("Profile %s: %d workers, %s, database pool of %s per worker", profile, workers,
+                    f"{threads} threads each" if profile == 'gthread'
+                    else f"{worker_connections} connections each" if profile == 'gevent' else "1 request each",
+                    os.environ['DB_POOL_SIZE'])
+
+
+def post_fork(server, worker):
+    if profile != 'gevent':
+        return
+    # psycopg2 waits in C, which would block the whole event loop; psycogreen makes it yield
+    try:
+        from psycogreen.gevent import patch_psycopg
+    except ImportError:
+        logging.warning("psycogreen is not installed; Postgres queries will block all greenlets of a worker")
+        return
+    patch_psycopg()
@@ -0,0 +1,29 @@
+import argparse
+
+from flask import g
+
+from app import app, db
+from services.roster import parse_roster_csv, import_roster
+
+def main():
+    """Import a monthly staff roster (CSV: username,date,shift[,role]) as shifts of a site"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('csv_file', help="Roster CSV; shift is a code such as M, E or N, or HH:MM-HH:MM")
+    parser.add_argument('--site', help="Site the roster is for (default: SITE_CODE)")
+    parser.add_argument('--keep-existing', action='store_true',
+                        help="Add to the shifts already rostered on the roster's dates instead of replacing them")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.site:
+            if args.site not in app.config['SITES']:
+                parser.error(f"Unknown site: {args.site}")
+            g.site_code = args.site
+        with open(args.csv_file, newline='', encoding='utf-8-sig') as f:
+            rows = parse_roster_csv(f)
+        stored = import_roster(rows, replace=not args.keep_existing)
+        db.session.commit()
+        print(f"Imported {stored} shifts")
+
+if __name__ == "__main__":
+    main()
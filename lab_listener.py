@@ -0,0 +1,24 @@
+import argparse
+import asyncio
+import os
+
+from app import app
+from services.lab_listener import LabResultListener
+
+def main():
+    """Run the MLLP/HL7 listener that receives laboratory results from the LIS"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--host', default=os.environ.get('LAB_LISTENER_HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.environ.get('LAB_LISTENER_PORT', '2575')))
+    parser.add_argument('--batch-size', type=int, default=100, help="Maximum messages stored per transaction")
+    parser.add_argument('--batch-delay', type=float, default=0.05, help="Seconds to wait while filling a batch")
+    args = parser.parse_args()
+
+    listener = LabResultListener(app, args.host, args.port, args.batch_size, args.batch_delay)
+    try:
+        asyncio.run(listener.serve_forever())
+    except KeyboardInterrupt:
+        print(f"Stopped: {listener.stats}")
+
+if __name__ == "__main__":
+    main()
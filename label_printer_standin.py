@@ -0,0 +1,32 @@
+import argparse
+import os
+import socketserver
+from datetime import datetime
+
+class JobHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        data = self.rfile.read()
+        if not data:
+            return
+        extension = 'pdf' if data.startswith(b'%PDF') else 'zpl'
+        name = f"{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}.{extension}"
+        with open(os.path.join(self.server.output_dir, name), 'wb') as f:
+            f.write(data)
+        print(f"Received {len(data)} bytes from {self.client_address[0]} -> {name}")
+
+def main():
+    """Stand-in for a raw TCP (port 9100) label printer that saves every job it receives to a directory"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=9100)
+    parser.add_argument('--output-dir', default='printed_labels')
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    with socketserver.ThreadingTCPServer((args.host, args.port), JobHandler) as server:
+        server.output_dir = args.output_dir
+        print(f"Listening on {args.host}:{args.port}, saving jobs to {args.output_dir}")
+        server.serve_forever()
+
+if __name__ == "__main__":
+    main()
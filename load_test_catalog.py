@@ -0,0 +1,31 @@
+import argparse
+import csv
+
+from app import app, db
+from services.lab_catalog import add_test, alias_map, backfill_test_catalog_ids
+
+def main():
+    """Load lab tests and synonyms into the test catalog from a CSV file and link stored requests and results"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('csv_file', nargs='?',
+                        help="CSV with columns code,name,test_type,synonyms (synonyms separated by '|')")
+    parser.add_argument('--no-backfill', action='store_true',
+                        help="Do not resolve the catalog id of existing requests and results")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.csv_file:
+            loaded = 0
+            with open(args.csv_file, newline='') as f:
+                for row in csv.DictReader(f):
+                    synonyms = [synonym for synonym in (row.get('synonyms') or '').split('|') if synonym.strip()]
+                    add_test(row['code'].strip(), row['name'].strip(), row['test_type'].strip(), synonyms)
+                    loaded += 1
+            db.session.commit()
+            print(f"Loaded {loaded} tests")
+        print(f"Alias map holds {alias_map.load()} spellings")
+        if not args.no_backfill:
+            print(f"Linked {backfill_test_catalog_ids()} stored requests and results to the catalog")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import argparse
+
+from app import app
+from services.partitions import ensure_partitions
+
+def main():
+    """Create upcoming monthly partitions; schedule daily when PARTITION_TABLES=1"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--months-ahead', type=int, default=3)
+    parser.add_argument('--months-back', type=int, default=0)
+    parser.add_argument('--move-default-rows', action='store_true',
+                        help="Create months whose rows are in the default partition, moving the rows over "
+                             "(briefly locks the table)")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if not app.config["PARTITION_TABLES"]:
+            print("Partitioning is disabled (set PARTITION_TABLES=1 with a Postgres DATABASE_URL)")
+            return
+        created = ensure_partitions(args.months_ahead, args.months_back, move_default_rows=args.move_default_rows)
+        print(f"Ensured {created} monthly partitions")
+
+if __name__ == "__main__":
+    main()
@@ -1,11 +1,37 @@
+import uuid
 from datetime import datetime
-from app import db
+from app import app, db
+from services.sites import current_site_code
 from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 
+# When enabled, the high-volume tables are range partitioned by month on their
+# timestamp column. Postgres requires the partition key in the primary key, so
+# the table key becomes (id, timestamp) while the ORM keeps identifying rows by id.
+PARTITION_TABLES = app.config.get("PARTITION_TABLES", False)
+
+def partition_table_args(column_name, *unique_columns):
+    """__table_args__ for a table optionally partitioned by month on `column_name`.
+
+    Unique indexes on a partitioned table must include the partition key, so
+    each of `unique_columns` gets a (column, partition key) constraint instead.
+    """
+    if not PARTITION_TABLES:
+        return ()
+    constraints = tuple(db.UniqueConstraint(name, column_name) for name in unique_columns)
+    return constraints + ({'postgresql_partition_by': f'RANGE ({column_name})'},)
+
+def new_uid():
+    """Globally unique row id, so rows created on different nodes never collide"""
+    return str(uuid.uuid4())
+
+# Roles of staff accounts; examinations, orders and dispositions refer to these accounts by id
+ROLES = ('nurse', 'doctor', 'pharmacist', 'admin')
+
 class User(UserMixin, db.Model):
-    """User model representing nurses in the system"""
+    """User model representing clinical staff (nurses, doctors, pharmacists) in the system"""
     id = db.Column(db.Integer, primary_key=True)
+    site_code = db.Column(db.String(20), nullable=False, default=current_site_code, index=True)
     username = db.Column(db.String(64), unique=True, nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
@@ -22,6 +48,8 @@ class User(UserMixin, db.Model):
 class Patient(db.Model):
     """Patient model for storing patient information"""
     id = db.Column(db.Integer, primary_key=True)
+    uid = db.Column(db.String(36), unique=True, nullable=True, default=new_uid)
+    site_code = db.Column(db.String(20), nullable=False, default=current_site_code)
     medical_record_number = db.Column(db.String(20), unique=True, nullable=True)
     first_name = db.Column(db.String(50), nullable=False)
     last_name = db.Column(db.String(50), nullable=False)
@@ -36,6 +64,15 @@ class Patient(db.Model):
     emergency_contact_name = db.Column(db.String(100), nullable=True)
     emergency_contact_phone = db.Column(db.String(20), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)  # Also bumped by encounter writes
+    # Mass-casualty registration (see services/mci.py): unidentified placeholder patients
+    is_placeholder = db.Column(db.Boolean, nullable=False, default=False)
+    incident_code = db.Column(db.String(30), nullable=True, index=True)
+    merged_into_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=True)  # Placeholder merged into an existing record
+    
+    __table_args__ = (db.Index('ix_patient_site_created_at', 'site_code', 'created_at'),)
+    
+    merged_into = db.relationship('Patient', remote_side=[id])
     
     # Relationships
     triage = db.relationship('Triage', backref='patient', uselist=False)
@@ -47,20 +84,29 @@ class Patient(db.Model):
 
 class Triage(db.Model):
     """Triage categorization model"""
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    uid = db.Column(db.String(36), nullable=True, default=new_uid, unique=not PARTITION_TABLES, index=PARTITION_TABLES)
+    site_code = db.Column(db.String(20), nullable=False, default=current_site_code)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
     category = db.Column(db.String(10), nullable=False)  # 'red', 'yellow', 'green', 'black'
     reason = db.Column(db.String(200), nullable=False)
     vital_signs = db.Column(db.JSON, nullable=True)
     triaged_by = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    triaged_at = db.Column(db.DateTime, default=datetime.utcnow)
+    triaged_at = db.Column(db.DateTime, default=datetime.utcnow, primary_key=PARTITION_TABLES)
     
     # Relationship to User who performed triage
     nurse = db.relationship('User', backref='triages')
+    
+    __table_args__ = (
+        db.Index('ix_triage_site_triaged_at', 'site_code', 'triaged_at'),
+    ) + partition_table_args('triaged_at', 'uid')
+    __mapper_args__ = {'primary_key': [id]}
 
 class NurseAssessment(db.Model):
     """Initial nursing assessment model"""
     id = db.Column(db.Integer, primary_key=True)
+    uid = db.Column(db.String(36), unique=True, nullable=True, default=new_uid)
+    site_code = db.Column(db.String(20), nullable=False, default=current_site_code)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
     chief_complaint = db.Column(db.String(200), nullable=False)
     history = db.Column(db.Text, nullable=True)
@@ -73,30 +119,57 @@ class NurseAssessment(db.Model):
     
     # Relationship to User who performed assessment
     nurse = db.relationship('User', backref='assessments')
+    
+    __table_args__ = (db.Index('ix_nurse_assessment_site_patient', 'site_code', 'patient_id'),)
 
 class DoctorExamination(db.Model):
     """Doctor examination and diagnosis model"""
     id = db.Column(db.Integer, primary_key=True)
+    uid = db.Column(db.String(36), unique=True, nullable=True, default=new_uid)
+    site_code = db.Column(db.String(20), nullable=False, default=current_site_code)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
     subjective = db.Column(db.Text, nullable=True)  # Patient's reported symptoms
     objective = db.Column(db.Text, nullable=True)  # Observed findings
     assessment = db.Column(db.Text, nullable=False)  # Diagnosis
     plan = db.Column(db.Text, nullable=False)  # Treatment plan
     doctor_name = db.Column(db.String(100), nullable=False)
+    doctor_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)  # Examining clinician; doctor_name is kept for display
     requires_lab_tests = db.Column(db.Boolean, default=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (db.Index('ix_doctor_examination_site_patient', 'site_code', 'patient_id'),)
+
+class TestCatalog(db.Model):
+    """Canonical laboratory and radiology tests (see services/lab_catalog.py)"""
+    id = db.Column(db.Integer, primary_key=True)
+    code = db.Column(db.String(30), unique=True, nullable=False)
+    name = db.Column(db.String(100), nullable=False)
+    test_type = db.Column(db.String(50), nullable=False)  # 'laboratory' or 'radiology'
+    is_active = db.Column(db.Boolean, default=True)
+    
+    synonyms = db.relationship('TestSynonym', backref='test', cascade='all, delete-orphan')
+
+class TestSynonym(db.Model):
+    """Alternative spelling of a catalog test, stored normalized"""
+    id = db.Column(db.Integer, primary_key=True)
+    test_catalog_id = db.Column(db.Integer, db.ForeignKey('test_catalog.id'), nullable=False, index=True)
+    alias = db.Column(db.String(100), unique=True, nullable=False)
 
 class LabRequest(db.Model):
     """Laboratory and radiology request model"""
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    uid = db.Column(db.String(36), nullable=True, default=new_uid, unique=not PARTITION_TABLES, index=PARTITION_TABLES)
+    site_code = db.Column(db.String(20), nullable=False, default=current_site_code)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
     test_type = db.Column(db.String(50), nullable=False)  # 'laboratory' or 'radiology'
     test_name = db.Column(db.String(100), nullable=False)
+    test_catalog_id = db.Column(db.Integer, db.ForeignKey('test_catalog.id'), nullable=True)  # Resolved from test_name
     priority = db.Column(db.String(20), nullable=False, default='routine')  # 'stat', 'urgent', 'routine'
     clinical_info = db.Column(db.Text, nullable=True)
     requested_by = db.Column(db.String(100), nullable=False)
-    requested_at = db.Column(db.DateTime, default=datetime.utcnow)
+    requested_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
+    requested_at = db.Column(db.DateTime, default=datetime.utcnow, primary_key=PARTITION_TABLES)
     
     # Results
     is_completed = db.Column(db.Boolean, default=False)
@@ -107,10 +180,19 @@ class LabRequest(db.Model):
     # For automatic integration
     external_system_id = db.Column(db.String(100), nullable=True)
     is_auto_imported = db.Column(db.Boolean, default=False)
+    
+    __table_args__ = (
+        db.Index('ix_lab_request_site_completed_requested_at', 'site_code', 'is_completed', 'requested_at'),
+        # Matching an incoming result: the patient's open requests for one catalog test, oldest first
+        db.Index('ix_lab_request_patient_test_open', 'patient_id', 'test_catalog_id', 'is_completed', 'requested_at'),
+    ) + partition_table_args('requested_at', 'uid')
+    __mapper_args__ = {'primary_key': [id]}
 
 class Prescription(db.Model):
     """Medication prescription model"""
-    id = db.Column(db.Integer, primary_key=True)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    uid = db.Column(db.String(36), nullable=True, default=new_uid, unique=not PARTITION_TABLES, index=PARTITION_TABLES)
+    site_code = db.Column(db.String(20), nullable=False, default=current_site_code)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
     medication_name = db.Column(db.String(100), nullable=False)
     dosage = db.Column(db.String(50), nullable=False)
@@ -118,15 +200,27 @@ class Prescription(db.Model):
     frequency = db.Column(db.String(50), nullable=False)
     duration = db.Column(db.String(50), nullable=True)
     special_instructions = db.Column(db.Text, nullable=True)
+    acknowledged_warnings = db.Column(db.Text, nullable=True)  # Allergy/interaction warnings the prescriber overrode
     prescribed_by = db.Column(db.String(100), nullable=False)
-    prescribed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    prescribed_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
+    prescribed_at = db.Column(db.DateTime, default=datetime.utcnow, primary_key=PARTITION_TABLES)
     is_dispensed = db.Column(db.Boolean, default=False)
     dispensed_at = db.Column(db.DateTime, nullable=True)
     dispensed_by = db.Column(db.String(100), nullable=True)
+    dispensed_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
+    version = db.Column(db.Integer, nullable=False, default=1)  # Optimistic concurrency for dispensing
+    
+    __table_args__ = (
+        # Serves the department-wide undispensed queue
+        db.Index('ix_prescription_site_dispensed_prescribed_at', 'site_code', 'is_dispensed', 'prescribed_at'),
+    ) + partition_table_args('prescribed_at', 'uid')
+    __mapper_args__ = {'primary_key': [id], 'version_id_col': version}
 
 class Disposition(db.Model):
     """Patient disposition/transfer model"""
     id = db.Column(db.Integer, primary_key=True)
+    uid = db.Column(db.String(36), unique=True, nullable=True, default=new_uid)
+    site_code = db.Column(db.String(20), nullable=False, default=current_site_code)
     patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
     disposition_type = db.Column(db.String(20), nullable=False)  # 'discharge', 'outpatient', 'inpatient', 'deceased'
     
@@ -141,6 +235,7 @@ class Disposition(db.Model):
     # For inpatient transfer
     destination_ward = db.Column(db.String(50), nullable=True)
     bed_number = db.Column(db.String(20), nullable=True)
+    bed_id = db.Column(db.Integer, db.ForeignKey('bed.id'), nullable=True)
     is_bed_available = db.Column(db.Boolean, nullable=True)
     waiting_list_position = db.Column(db.Integer, nullable=True)
     
@@ -150,19 +245,200 @@ class Disposition(db.Model):
     
     # Common fields
     authorized_by = db.Column(db.String(100), nullable=False)
+    authorized_by_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=True, index=True)
     disposition_time = db.Column(db.DateTime, default=datetime.utcnow)
     notes = db.Column(db.Text, nullable=True)
     is_completed = db.Column(db.Boolean, default=False)
     completed_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (db.Index('ix_disposition_site_disposition_time', 'site_code', 'disposition_time'),)
+
+class Ward(db.Model):
+    """Inpatient ward with a maintained occupancy counter"""
+    id = db.Column(db.Integer, primary_key=True)
+    site_code = db.Column(db.String(20), nullable=False, default=current_site_code)
+    name = db.Column(db.String(50), nullable=False)
+    code = db.Column(db.String(10), nullable=False)  # Prefix for bed labels, e.g. 'ICU'
+    total_beds = db.Column(db.Integer, nullable=False, default=0)
+    occupied_beds = db.Column(db.Integer, nullable=False, default=0)  # Updated with every bed assignment/release
+    waiting_count = db.Column(db.Integer, nullable=False, default=0)  # Patients waiting in the admission queue
+    queue_sequence = db.Column(db.Integer, nullable=False, default=0)  # Last arrival number handed out in the queue
+    
+    beds = db.relationship('Bed', backref='ward', order_by='Bed.label')
+    
+    __table_args__ = (
+        db.UniqueConstraint('site_code', 'name'),
+        db.UniqueConstraint('site_code', 'code'),
+    )
+
+class Bed(db.Model):
+    """Single inpatient bed; only assigned through services.beds"""
+    id = db.Column(db.Integer, primary_key=True)
+    ward_id = db.Column(db.Integer, db.ForeignKey('ward.id'), nullable=False, index=True)
+    label = db.Column(db.String(20), nullable=False)  # e.g. 'ICU-03'
+    is_occupied = db.Column(db.Boolean, nullable=False, default=False)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=True)
+    occupied_at = db.Column(db.DateTime, nullable=True)
+    
+    __table_args__ = (db.UniqueConstraint('ward_id', 'label'),)
+
+class AdmissionQueueEntry(db.Model):
+    """Patient waiting for a bed in a ward, maintained by services.beds"""
+    id = db.Column(db.Integer, primary_key=True)
+    ward_id = db.Column(db.Integer, db.ForeignKey('ward.id'), nullable=False)
+    disposition_id = db.Column(db.Integer, db.ForeignKey('disposition.id'), nullable=False, index=True)
+    patient_id = db.Column(db.Integer, db.ForeignKey('patient.id'), nullable=False)
+    priority = db.Column(db.Integer, nullable=False, default=5)  # 1 = highest clinical priority, 10 = lowest
+    sequence = db.Column(db.Integer, nullable=False)  # Arrival order within the ward, breaks priority ties
+    status = db.Column(db.String(20), nullable=False, default='waiting')  # 'waiting', 'offered', 'cancelled'
+    offered_bed_id = db.Column(db.Integer, db.ForeignKey('bed.id'), nullable=True)
+    enqueued_at = db.Column(db.DateTime, default=datetime.utcnow)
+    resolved_at = db.Column(db.DateTime, nullable=True)
+    
+    ward = db.relationship('Ward', backref='queue_entries')
+    patient = db.relationship('Patient')
+    
+    # The head of a ward's queue is the first entry of this index
+    __table_args__ = (db.Index('ix_admission_queue_head', 'ward_id', 'status', 'priority', 'sequence'),)
 
 class ExternalLabResult(db.Model):
     """Model for storing external lab system results for automatic integration"""
-    id = db.Column(db.Integer, primary_key=True)
-    external_system_id = db.Column(db.String(100), nullable=False, unique=True)
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    site_code = db.Column(db.String(20), nullable=False, default=current_site_code)
+    external_system_id = db.Column(db.String(100), nullable=False, unique=not PARTITION_TABLES, index=PARTITION_TABLES)
     patient_mrn = db.Column(db.String(20), nullable=False)
     test_type = db.Column(db.String(50), nullable=False)  # 'laboratory' or 'radiology'
     test_name = db.Column(db.String(100), nullable=False)
+    test_catalog_id = db.Column(db.Integer, db.ForeignKey('test_catalog.id'), nullable=True)  # Resolved from test_name
     result = db.Column(db.Text, nullable=False)
-    result_date = db.Column(db.DateTime, default=datetime.utcnow)
+    result_date = db.Column(db.DateTime, default=datetime.utcnow, primary_key=PARTITION_TABLES)
     is_imported = db.Column(db.Boolean, default=False)
     lab_request_id = db.Column(db.Integer, nullable=True)  # Will be filled when imported
+    
+    __table_args__ = (
+        db.Index('ix_external_lab_result_site_imported_result_date', 'site_code', 'is_imported', 'result_date'),
+        db.Index('ix_external_lab_result_mrn_test_pending', 'patient_mrn', 'test_catalog_id', 'is_imported'),
+    ) + partition_table_args('result_date', 'external_system_id')
+    __mapper_args__ = {'primary_key': [id]}
+
+class ArchivedEncounter(db.Model):
+    """Closed encounter moved out of the hot tables, stored in the archive database"""
+    __bind_key__ = 'archive'
+    patient_id = db.Column(db.Integer, primary_key=True)  # Original Patient.id
+    medical_record_number = db.Column(db.String(20), nullable=True, index=True)
+    completed_at = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    payload = db.Column(db.JSON, nullable=False)  # Rows of every encounter table, keyed by table name
+
+class ArchivedExternalLabResult(db.Model):
+    """Matched external lab result moved out of the hot table, stored in the archive database"""
+    __bind_key__ = 'archive'
+    id = db.Column(db.Integer, primary_key=True)  # Original ExternalLabResult.id
+    external_system_id = db.Column(db.String(100), nullable=False, unique=True)
+    patient_mrn = db.Column(db.String(20), nullable=False, index=True)
+    lab_request_id = db.Column(db.Integer, nullable=True)
+    result_date = db.Column(db.DateTime, nullable=True)
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+    payload = db.Column(db.JSON, nullable=False)
+
+class MrnSequence(db.Model):
+    """Next medical record number to hand out for each MRN prefix"""
+    prefix = db.Column(db.String(10), primary_key=True)
+    next_value = db.Column(db.Integer, nullable=False)
+
+class ChangeLog(db.Model):
+    """Append-only log of changes to encounter rows, shipped from edge nodes to the central database"""
+    id = db.Column(db.Integer, primary_key=True)
+    change_id = db.Column(db.String(36), unique=True, nullable=False, default=new_uid)
+    node_id = db.Column(db.String(50), nullable=False)  # Node where the change was made
+    table_name = db.Column(db.String(50), nullable=False)
+    row_uid = db.Column(db.String(36), nullable=False)
+    operation = db.Column(db.String(10), nullable=False)  # 'upsert' or 'delete'
+    changed_at = db.Column(db.DateTime, default=datetime.utcnow)
+    version = db.Column(db.String(120), nullable=False)  # Sortable (changed_at, node_id, change_id)
+    synced_at = db.Column(db.DateTime, nullable=True)  # Edge: acknowledged by central; central: received
+    status = db.Column(db.String(20), nullable=True)  # Central: 'applied', 'superseded' or 'rejected'; edge: 'rejected' by central
+    error = db.Column(db.Text, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_change_log_row', 'table_name', 'row_uid'),
+        db.Index('ix_change_log_unsynced', 'synced_at', 'id'),
+    )
+
+class OutboxEvent(db.Model):
+    """Event for a downstream system, written in the same transaction as the clinical change it reports"""
+    id = db.Column(db.Integer, primary_key=True)
+    event_id = db.Column(db.String(36), unique=True, nullable=False, default=new_uid)  # Lets receivers drop redeliveries
+    destination = db.Column(db.String(50), nullable=False)  # Name in OUTBOX_DESTINATIONS
+    event_type = db.Column(db.String(50), nullable=False)  # e.g. 'disposition.completed'
+    payload = db.Column(db.JSON, nullable=False)  # The event exactly as delivered
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=True)  # Set while backing off after a failed delivery
+    last_error = db.Column(db.Text, nullable=True)
+    delivered_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        db.Index('ix_outbox_event_pending', 'destination', 'delivered_at', 'id'),
+        db.Index('ix_outbox_event_delivered_at', 'delivered_at'),
+    )
+
+class AuditEntry(db.Model):
+    """Append-only record of a clinical write: who changed which row, with before and after values"""
+    id = db.Column(db.Integer, primary_key=True)
+    occurred_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    site_code = db.Column(db.String(20), nullable=True)
+    user_id = db.Column(db.Integer, nullable=True)  # No foreign key: users may be removed, their audit trail may not
+    actor = db.Column(db.String(64), nullable=False)  # Username, or 'system' for scripts and background jobs
+    table_name = db.Column(db.String(50), nullable=False)
+    row_id = db.Column(db.Integer, nullable=True)
+    action = db.Column(db.String(10), nullable=False)  # 'insert', 'update' or 'delete'
+    changes = db.Column(db.JSON, nullable=False)  # {column: [before, after]}
+
+    __table_args__ = (
+        db.Index('ix_audit_entry_row', 'table_name', 'row_id'),
+        db.Index('ix_audit_entry_occurred_at', 'occurred_at'),
+    )
+
+# Rows in the audit log can be added but never changed or removed
+AUDIT_APPEND_ONLY_DDL = [
+    ('postgresql', "CREATE RULE audit_entry_no_update AS ON UPDATE TO audit_entry DO INSTEAD NOTHING"),
+    ('postgresql', "CREATE RULE audit_entry_no_delete AS ON DELETE TO audit_entry DO INSTEAD NOTHING"),
+    ('sqlite', "CREATE TRIGGER audit_entry_no_update BEFORE UPDATE ON audit_entry "
+               "BEGIN SELECT RAISE(ABORT, 'audit_entry is append-only'); END"),
+    ('sqlite', "CREATE TRIGGER audit_entry_no_delete BEFORE DELETE ON audit_entry "
+               "BEGIN SELECT RAISE(ABORT, 'audit_entry is append-only'); END"),
+]
+for dialect, statement in AUDIT_APPEND_ONLY_DDL:
+    db.event.listen(AuditEntry.__table__, 'after_create', db.DDL(statement).execute_if(dialect=dialect))
+
+class Shift(db.Model):
+    """One rostered shift of a staff member, on duty from starts_at until (not including) ends_at"""
+    id = db.Column(db.Integer, primary_key=True)
+    site_code = db.Column(db.String(20), nullable=False, default=current_site_code)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    role = db.Column(db.String(20), nullable=False)  # Role on this shift, e.g. 'nurse' or 'doctor'
+    starts_at = db.Column(db.DateTime, nullable=False)
+    ends_at = db.Column(db.DateTime, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    user = db.relationship('User', backref='shifts')
+    
+    __table_args__ = (
+        db.CheckConstraint('ends_at > starts_at', name='ck_shift_interval'),
+        # Sorted by start: "on duty at T" scans the shifts starting within the longest shift before T
+        db.Index('ix_shift_site_starts_at', 'site_code', 'starts_at', 'ends_at'),
+    )
+
+# Postgres answers "on duty at T" from a GiST index on the shift's time range
+SHIFT_INTERVAL_DDL = [
+    ('postgresql', "CREATE INDEX ix_shift_period ON shift USING gist (tsrange(starts_at, ends_at))"),
+]
+for dialect, statement in SHIFT_INTERVAL_DDL:
+    db.event.listen(Shift.__table__, 'after_create', db.DDL(statement).execute_if(dialect=dialect))
+
+# Models whose queries are restricted to the request's site (see services/sites.py)
+SITE_SCOPED_MODELS = [
+    User, Patient, Triage, NurseAssessment, DoctorExamination, LabRequest, Prescription, Disposition,
+    Ward, ExternalLabResult, Shift,
+]
@@ -0,0 +1,52 @@
+import argparse
+import logging
+import time
+
+from app import app, db
+from services.outbox import OutboxRelay, outbox_metrics, purge_delivered
+
+def main():
+    """Deliver outbox events to the downstream systems in OUTBOX_DESTINATIONS"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--once', action='store_true', help="Deliver until the outbox is drained, then exit")
+    parser.add_argument('--interval', type=float, default=1.0, help="Seconds to wait when there is nothing to deliver")
+    parser.add_argument('--report-interval', type=float, default=60,
+                        help="Seconds between throughput and backlog reports in the log")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if not app.config['OUTBOX_DESTINATIONS']:
+            parser.error("OUTBOX_DESTINATIONS is not set")
+        relay = OutboxRelay(app.config['OUTBOX_DESTINATIONS'])
+        last_report = time.monotonic()
+        delivered_at_report = 0
+
+        while True:
+            try:
+                delivered = relay.run_once()
+            except Exception as e:
+                db.session.rollback()
+                logging.error("Outbox relay round failed: %s", e)
+                delivered = 0
+                if args.once:
+                    raise SystemExit(1)
+
+            if time.monotonic() - last_report >= args.report_interval:
+                rate = (relay.stats['delivered'] - delivered_at_report) / (time.monotonic() - last_report)
+                backlog = {name: m['pending'] for name, m in outbox_metrics().items()}
+                removed = purge_delivered(app.config['OUTBOX_RETENTION_DAYS'])
+                logging.info("Outbox: %.1f events/s, backlog %s, purged %d delivered events", rate, backlog, removed)
+                last_report = time.monotonic()
+                delivered_at_report = relay.stats['delivered']
+
+            if args.once and not delivered:
+                break
+            if not delivered:
+                time.sleep(args.interval)
+
+        if args.once:
+            print(f"Delivered {relay.stats['delivered']} events in {relay.stats['batches']} batches, "
+                  f"{relay.stats['failures']} failed deliveries")
+
+if __name__ == "__main__":
+    main()
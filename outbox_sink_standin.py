@@ -0,0 +1,59 @@
+import argparse
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class SinkHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps the relay's connection alive between batches
+    protocol_version = 'HTTP/1.1'
+
+    def _reply(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        payload = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        if random.random() < self.server.failure_rate:
+            self._reply(503, {'error': 'Receiver busy'})
+            return
+
+        events = payload.get('events', [])
+        with self.server.lock, open(self.server.output, 'a', encoding='utf-8') as f:
+            for event in events:
+                # Redelivered events are expected; receivers de-duplicate on event_id
+                if event.get('event_id') in self.server.seen:
+                    continue
+                self.server.seen.add(event.get('event_id'))
+                f.write(json.dumps(event) + '\n')
+        self._reply(200, {'accepted': len(events)})
+
+    def log_message(self, format, *args):
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+def main():
+    """Stand-in downstream receiver for outbox events, for development and testing of outbox_relay.py"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--output', default='outbox_events.jsonl', help="File the received events are appended to")
+    parser.add_argument('--failure-rate', type=float, default=0.0, help="Fraction of batches answered with 503")
+    parser.add_argument('--quiet', action='store_true', help="Do not log each request")
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer((args.host, args.port), SinkHandler)
+    server.output = args.output
+    server.failure_rate = args.failure_rate
+    server.quiet = args.quiet
+    server.lock = threading.Lock()
+    server.seen = set()
+    print(f"Outbox receiver listening on http://{args.host}:{args.port}/, writing to {args.output}")
+    server.serve_forever()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,16 @@
+import argparse
+
+from app import app
+from services.fragment_cache import compile_templates
+
+def main():
+    """Compile every template into the Jinja bytecode cache (JINJA_CACHE_DIR) ahead of worker start"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.parse_args()
+
+    if not app.config['JINJA_CACHE_DIR']:
+        parser.error("JINJA_CACHE_DIR is empty, so there is no bytecode cache to fill")
+    print(f"Compiled {compile_templates(app)} templates into {app.config['JINJA_CACHE_DIR']}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,24 @@
+import argparse
+
+from app import app, db
+from services.search import install_search_index, rebuild_search_index
+from services.sites import site_databases
+
+def main():
+    """Create the clinical search index if missing and re-index every note and result in batches"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--batch-size', type=int, default=10000, help="Rows re-indexed per transaction")
+    args = parser.parse_args()
+
+    def progress(source, done, total):
+        print(f"  {source}: {done}/{total}")
+
+    with app.app_context():
+        for engine in [db.engine, *site_databases().values()]:
+            print(f"Indexing {engine.url.render_as_string(hide_password=True)}")
+            install_search_index(engine)
+            batches = rebuild_search_index(engine, args.batch_size, progress)
+            print(f"Re-indexed in {batches} batches")
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,18 @@
 from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
+from sqlalchemy import func
 from app import db
 from models import Patient
+from services.archive import get_patient_or_404
+from services.eligibility import check_eligibility, checker as eligibility_checker
+from services.mci import (
+    TRIAGE_CATEGORIES, new_incident_code, register_casualties, incident_patients,
+    identify_placeholder, merge_placeholder,
+)
+from services.outbox import outbox_metrics
+from services.roster import SHIFT_PATTERNS, current_roster, parse_roster_csv, import_roster, roster_cache
 from datetime import datetime
+import io
 
 admin_bp = Blueprint('admin', __name__, url_prefix='/admin')
 
@@ -46,7 +56,7 @@ def patient_registration():
 @admin_bp.route('/insurance-verification/<int:patient_id>', methods=['GET', 'POST'])
 @login_required
 def insurance_verification(patient_id):
-    patient = Patient.query.get_or_404(patient_id)
+    patient = get_patient_or_404(patient_id)
     
     if request.method == 'POST':
         try:
@@ -54,6 +64,8 @@ def insurance_verification(patient_id):
             patient.insurance_number = request.form.get('insurance_number')
             
             db.session.commit()
+            # Start the payer check now, so its answer is cached by the time anyone looks
+            check_eligibility(patient.insurance_type, patient.insurance_number, wait=0)
             flash('Insurance information saved successfully!', 'success')
             return redirect(url_for('admin.print_id_band', patient_id=patient.id))
             
@@ -63,10 +75,27 @@ def insurance_verification(patient_id):
     
     return render_template('admin/insurance_verification.html', patient=patient)
 
+@admin_bp.route('/eligibility', methods=['GET'])
+@login_required
+def eligibility():
+    """Eligibility of an insurance number; 'pending' until the payer answers, so the page polls"""
+    return jsonify(check_eligibility(request.args.get('insurance_type'), request.args.get('insurance_number')))
+
+@admin_bp.route('/eligibility/metrics', methods=['GET'])
+@login_required
+def eligibility_metrics():
+    return jsonify(eligibility_checker.snapshot())
+
+@admin_bp.route('/outbox/metrics', methods=['GET'])
+@login_required
+def outbox_metrics_view():
+    """Per-destination backlog and delivery throughput of the event outbox"""
+    return jsonify(outbox_metrics())
+
 @admin_bp.route('/print-id-band/<int:patient_id>', methods=['GET'])
 @login_required
 def print_id_band(patient_id):
-    patient = Patient.query.get_or_404(patient_id)
+    patient = get_patient_or_404(patient_id)
     return render_template('admin/print_id_band.html', patient=patient)
 
 @admin_bp.route('/generate-mrn', methods=['POST'])
@@ -77,3 +106,119 @@ def generate_mrn():
     timestamp = datetime.now().strftime('%Y%m%d%H%M')
     mrn = f"MRN-{timestamp}"
     return jsonify({'mrn': mrn})
+
+@admin_bp.route('/mci', methods=['GET', 'POST'])
+@login_required
+def mci_registration():
+    """Mass-casualty mode: register a batch of unidentified casualties at once"""
+    if request.method == 'POST':
+        incident_code = request.form.get('incident_code', '').strip() or new_incident_code()
+        
+        try:
+            counts = {category: int(request.form.get(f'count_{category}') or 0) for category in TRIAGE_CATEGORIES}
+            if any(count < 0 for count in counts.values()):
+                raise ValueError("Casualty counts cannot be negative")
+            
+            patients = register_casualties(incident_code, counts, request.form.get('arrival_mode', 'ambulance'), current_user.id)
+            db.session.commit()
+            
+            flash(f'{len(patients)} casualties registered for {incident_code}', 'success')
+            return redirect(url_for('admin.mci_bands', incident_code=incident_code))
+            
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error registering casualties: {str(e)}', 'danger')
+    
+    # Recent incidents, with how many of their casualties are still unidentified
+    incidents = db.session.query(
+        Patient.incident_code,
+        func.count(Patient.id),
+        func.sum(db.case((Patient.is_placeholder, 1), else_=0)),
+        func.max(Patient.created_at)
+    ).filter(
+        Patient.incident_code != None,
+        Patient.merged_into_id == None
+    ).group_by(Patient.incident_code).order_by(func.max(Patient.created_at).desc()).limit(10).all()
+    
+    return render_template('admin/mci_registration.html',
+                          incident_code=new_incident_code(),
+                          categories=TRIAGE_CATEGORIES,
+                          incidents=incidents)
+
+@admin_bp.route('/mci/<incident_code>/bands', methods=['GET'])
+@login_required
+def mci_bands(incident_code):
+    """ID bands for every casualty of an incident, printed as one batch"""
+    patients = incident_patients(incident_code)
+    if not patients:
+        flash(f'No casualties registered for {incident_code}', 'warning')
+        return redirect(url_for('admin.mci_registration'))
+    return render_template('admin/mci_bands.html', incident_code=incident_code, patients=patients)
+
+@admin_bp.route('/mci/identify/<int:patient_id>', methods=['GET', 'POST'])
+@login_required
+def mci_identify(patient_id):
+    """Attach a casualty's real identity, or merge them into their existing record"""
+    patient = get_patient_or_404(patient_id)
+    if not patient.is_placeholder or patient.merged_into_id:
+        flash('Patient has already been identified', 'info')
+        return redirect(url_for('admin.print_id_band', patient_id=patient.id))
+    
+    if request.method == 'POST':
+        try:
+            if request.form.get('action') == 'merge':
+                mrn = request.form.get('existing_mrn', '').strip()
+                target = Patient.query.filter_by(medical_record_number=mrn).first()
+                if target is None:
+                    raise ValueError(f"No patient with MRN {mrn}")
+                merge_placeholder(patient, target)
+                db.session.commit()
+                
+                flash(f'Casualty merged into the record of {target.first_name} {target.last_name}', 'success')
+            else:
+                identify_placeholder(
+                    patient,
+                    first_name=request.form.get('first_name'),
+                    last_name=request.form.get('last_name'),
+                    date_of_birth=datetime.strptime(request.form.get('date_of_birth'), '%Y-%m-%d').date(),
+                    gender=request.form.get('gender'),
+                    address=request.form.get('address'),
+                    phone_number=request.form.get('phone_number'),
+                    emergency_contact_name=request.form.get('emergency_contact_name'),
+                    emergency_contact_phone=request.form.get('emergency_contact_phone'),
+                    insurance_type=request.form.get('insurance_type'),
+                    insurance_number=request.form.get('insurance_number')
+                )
+                db.session.commit()
+                
+                flash('Patient identified successfully!', 'success')
+            return redirect(url_for('admin.mci_bands', incident_code=patient.incident_code))
+            
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error identifying patient: {str(e)}', 'danger')
+    
+    return render_template('admin/mci_identify.html', patient=patient)
+
+@admin_bp.route('/roster', methods=['GET', 'POST'])
+@login_required
+def roster():
+    """Staff on duty now, and upload of a monthly roster"""
+    if request.method == 'POST':
+        roster_file = request.files.get('roster_file')
+        if not roster_file or not roster_file.filename:
+            flash('Choose a roster CSV file to upload', 'warning')
+            return redirect(url_for('admin.roster'))
+        
+        try:
+            rows = parse_roster_csv(io.TextIOWrapper(roster_file.stream, encoding='utf-8-sig'))
+            stored = import_roster(rows, replace='replace' in request.form)
+            db.session.commit()
+            roster_cache.invalidate()
+            flash(f'Roster imported: {stored} shifts', 'success')
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error importing roster: {str(e)}', 'danger')
+        return redirect(url_for('admin.roster'))
+    
+    return render_template('admin/roster.html', on_duty=current_roster(), shift_patterns=SHIFT_PATTERNS)
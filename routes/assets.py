@@ -0,0 +1,31 @@
+from flask import Blueprint, current_app, request, send_from_directory
+import mimetypes
+import os
+from services.assets import CACHE_CONTROL
+
+assets_bp = Blueprint('assets', __name__, url_prefix='/assets')
+
+# Precompressed variants written by build_assets.py, in order of preference
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+@assets_bp.route('/<path:filename>')
+def asset(filename):
+    """Serve a fingerprinted build file, precompressed if the browser accepts it"""
+    directory = current_app.config['ASSET_DIST_DIR']
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+    response = None
+    for encoding, suffix in ENCODINGS:
+        if request.accept_encodings[encoding] > 0 and os.path.isfile(os.path.join(directory, filename + suffix)):
+            response = send_from_directory(
+                directory, filename + suffix, mimetype=mimetype, download_name=os.path.basename(filename)
+            )
+            response.headers['Content-Encoding'] = encoding
+            break
+    if response is None:
+        response = send_from_directory(directory, filename, mimetype=mimetype)
+
+    # File names change with their content, so a cached copy never goes stale
+    response.headers['Cache-Control'] = CACHE_CONTROL
+    response.vary.add('Accept-Encoding')
+    return response
@@ -1,4 +1,4 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, session, g, current_app
 from flask_login import login_user, logout_user, login_required, current_user
 from werkzeug.security import check_password_hash
 from app import db
@@ -22,6 +22,12 @@ def login():
     if request.method == 'POST':
         username = request.form.get('username')
         password = request.form.get('password')
+        site_code = request.form.get('site_code', g.site_code)
+        if site_code not in current_app.config['SITES']:
+            flash('Please choose a valid site', 'danger')
+            return render_template('login.html')
+        # Users belong to a site; look them up (and in a sharded setup, in the database) of that site
+        g.site_code = site_code
         
         if not username or not password:
             flash('Please enter both username and password', 'danger')
@@ -30,6 +36,7 @@ def login():
         user = User.query.filter_by(username=username).first()
         
         if user and user.check_password(password):
+            session['site_code'] = site_code
             login_user(user)
             next_page = request.args.get('next')
             if next_page:
@@ -4,6 +4,8 @@ from sqlalchemy import func, cast, Date
 from datetime import datetime, timedelta
 from models import Patient, Triage, NurseAssessment, DoctorExamination, User
 from app import db
+from services.clinicians import doctor_workload
+from services.roster import current_roster
 
 dashboard_bp = Blueprint('dashboard', __name__)
 
@@ -88,20 +90,12 @@ def dashboard():
         triage_colors_list.append(triage_colors.get(record.category, '#6c757d'))
     
     # --- ON-CALL STAFF ---
-    # In a real implementation, this would come from a schedule database
-    # For demo purposes, we'll use the existing users
-    nurses = User.query.filter_by(role='nurse').all()
+    # Nurses rostered on duty now, from the roster snapshot kept until the next shift change
+    nurses = current_roster(role='nurse')
     
     # --- DOCTOR DETAILS ---
-    # Get doctors who have examined patients
-    doctors = db.session.query(
-        DoctorExamination.doctor_name,
-        func.count(DoctorExamination.id).label('patient_count')
-    ).group_by(
-        DoctorExamination.doctor_name
-    ).order_by(
-        func.count(DoctorExamination.id).desc()
-    ).limit(10).all()
+    # Get doctors who have examined patients, counted on the indexed doctor_id
+    doctors = doctor_workload(limit=10)
     
     # Calculate total patients
     total_patients_today = sum(patients_per_hour_complete)
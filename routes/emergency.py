@@ -1,17 +1,31 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app, jsonify, abort
 from flask_login import login_required, current_user
 from app import db
-from models import Patient, Triage, NurseAssessment, DoctorExamination, LabRequest, Prescription, ExternalLabResult
-from datetime import datetime
+from models import Patient, Triage, NurseAssessment, DoctorExamination, LabRequest, Prescription, ExternalLabResult, TestCatalog
+from services.archive import get_patient_or_404, archived_chart as load_archived_chart, restore_encounter, ENCOUNTER_MODELS
+from services.sync import record_changes
+from services.audit import audit_bulk_update
+from services.outbox import record_bulk_events
+from services.lab_catalog import resolve_test
+from services.clinicians import clinicians, selected_clinician
+from services.interactions import check_prescription
+from sqlalchemy import case, update
+from datetime import datetime, timedelta
 import json
 
 emergency_bp = Blueprint('emergency', __name__, url_prefix='/emergency')
 
+# Most urgent first; untriaged patients sort after every triage category
+TRIAGE_PRIORITY = {'red': 0, 'yellow': 1, 'green': 2, 'black': 3}
+# Badge classes of allergy/interaction warning severities
+SEVERITY_BADGES = {'contraindicated': 'bg-danger', 'major': 'bg-danger', 'moderate': 'bg-warning text-dark',
+                   'minor': 'bg-secondary', 'info': 'bg-info text-dark'}
+
 @emergency_bp.route('/patients', methods=['GET'])
 @login_required
 def patient_list():
     # Get patients who have been registered but not yet triaged
-    new_patients = db.session.query(Patient).outerjoin(Triage).filter(Triage.id == None).all()
+    new_patients = db.session.query(Patient).outerjoin(Triage).filter(Triage.id == None, Patient.merged_into_id == None).all()
     
     # Get patients who have been triaged
     triaged_patients = db.session.query(Patient).join(Triage).all()
@@ -23,7 +37,7 @@ def patient_list():
 @emergency_bp.route('/triage/<int:patient_id>', methods=['GET', 'POST'])
 @login_required
 def triage(patient_id):
-    patient = Patient.query.get_or_404(patient_id)
+    patient = get_patient_or_404(patient_id)
     
     # Check if patient already has triage information
     existing_triage = Triage.query.filter_by(patient_id=patient_id).first()
@@ -66,7 +80,7 @@ def triage(patient_id):
 @emergency_bp.route('/nurse-assessment/<int:patient_id>', methods=['GET', 'POST'])
 @login_required
 def nurse_assessment(patient_id):
-    patient = Patient.query.get_or_404(patient_id)
+    patient = get_patient_or_404(patient_id)
     triage = Triage.query.filter_by(patient_id=patient_id).first_or_404()
     
     # Check if patient already has a nurse assessment
@@ -124,7 +138,7 @@ def nurse_assessment(patient_id):
 @emergency_bp.route('/doctor-examination/<int:patient_id>', methods=['GET', 'POST'])
 @login_required
 def doctor_examination(patient_id):
-    patient = Patient.query.get_or_404(patient_id)
+    patient = get_patient_or_404(patient_id)
     triage = Triage.query.filter_by(patient_id=patient_id).first_or_404()
     nurse_assessment = NurseAssessment.query.filter_by(patient_id=patient_id).first_or_404()
     
@@ -134,6 +148,7 @@ def doctor_examination(patient_id):
     if request.method == 'POST':
         try:
             requires_lab = 'requires_lab_tests' in request.form
+            doctor = selected_clinician(request.form.get('doctor_id', type=int))
             
             if existing_examination:
                 # Update existing examination
@@ -141,7 +156,8 @@ def doctor_examination(patient_id):
                 existing_examination.objective = request.form.get('objective')
                 existing_examination.assessment = request.form.get('assessment')
                 existing_examination.plan = request.form.get('plan')
-                existing_examination.doctor_name = request.form.get('doctor_name')
+                existing_examination.doctor_id = doctor.id
+                existing_examination.doctor_name = doctor.full_name
                 existing_examination.requires_lab_tests = requires_lab
             else:
                 # Create new examination
@@ -151,7 +167,8 @@ def doctor_examination(patient_id):
                     objective=request.form.get('objective'),
                     assessment=request.form.get('assessment'),
                     plan=request.form.get('plan'),
-                    doctor_name=request.form.get('doctor_name'),
+                    doctor_id=doctor.id,
+                    doctor_name=doctor.full_name,
                     requires_lab_tests=requires_lab
                 )
                 db.session.add(examination)
@@ -173,34 +190,41 @@ def doctor_examination(patient_id):
                           patient=patient, 
                           triage=triage, 
                           nurse_assessment=nurse_assessment,
-                          examination=existing_examination)
+                          examination=existing_examination,
+                          clinicians=clinicians())
 
 @emergency_bp.route('/lab-request/<int:patient_id>', methods=['GET', 'POST'])
 @login_required
 def lab_request(patient_id):
-    patient = Patient.query.get_or_404(patient_id)
+    patient = get_patient_or_404(patient_id)
     
     # Get existing lab requests
     existing_requests = LabRequest.query.filter_by(patient_id=patient_id).all()
     
     # Check if there are pending external lab results for this patient
     pending_external_results = None
+    match_window = timedelta(days=current_app.config['LAB_MATCH_WINDOW_DAYS'])
     if patient.medical_record_number:
         pending_external_results = ExternalLabResult.query.filter_by(
             patient_mrn=patient.medical_record_number,
             is_imported=False
+        ).filter(
+            ExternalLabResult.result_date >= datetime.utcnow() - match_window
         ).all()
     
     if request.method == 'POST':
         try:
             # Create new lab request
+            requester = selected_clinician(request.form.get('requested_by_id', type=int))
             lab_request = LabRequest(
                 patient_id=patient_id,
                 test_type=request.form.get('test_type'),
                 test_name=request.form.get('test_name'),
+                test_catalog_id=resolve_test(request.form.get('test_name')),
                 priority=request.form.get('priority'),
                 clinical_info=request.form.get('clinical_info'),
-                requested_by=request.form.get('requested_by')
+                requested_by=requester.full_name,
+                requested_by_id=requester.id
             )
             
             db.session.add(lab_request)
@@ -210,10 +234,19 @@ def lab_request(patient_id):
             if patient.medical_record_number and lab_request.test_type and lab_request.test_name:
                 matching_external = ExternalLabResult.query.filter_by(
                     patient_mrn=patient.medical_record_number,
-                    test_type=lab_request.test_type,
-                    test_name=lab_request.test_name,
                     is_imported=False
-                ).first()
+                ).filter(
+                    ExternalLabResult.result_date >= lab_request.requested_at - match_window
+                )
+                # Catalogued tests match on the catalog id, whatever the spelling on either side
+                if lab_request.test_catalog_id is not None:
+                    matching_external = matching_external.filter_by(test_catalog_id=lab_request.test_catalog_id)
+                else:
+                    matching_external = matching_external.filter_by(
+                        test_type=lab_request.test_type,
+                        test_name=lab_request.test_name
+                    )
+                matching_external = matching_external.order_by(ExternalLabResult.result_date).first()
                 
                 if matching_external:
                     # Auto-import the matching result
@@ -242,16 +275,21 @@ def lab_request(patient_id):
             db.session.rollback()
             flash(f'Error saving lab request: {str(e)}', 'danger')
     
+    # Catalog names offered as suggestions, so most requests use a known spelling
+    catalog_tests = TestCatalog.query.filter_by(is_active=True).order_by(TestCatalog.name).all()
+    
     return render_template('emergency/lab_request.html', 
                           patient=patient, 
                           lab_requests=existing_requests,
-                          pending_external_results=pending_external_results)
+                          pending_external_results=pending_external_results,
+                          catalog_tests=catalog_tests,
+                          clinicians=clinicians())
 
 @emergency_bp.route('/lab-results/<int:request_id>', methods=['GET', 'POST'])
 @login_required
 def lab_results(request_id):
     lab_request = LabRequest.query.get_or_404(request_id)
-    patient = Patient.query.get_or_404(lab_request.patient_id)
+    patient = get_patient_or_404(lab_request.patient_id)
     
     if request.method == 'POST':
         try:
@@ -284,7 +322,7 @@ def lab_results(request_id):
 @emergency_bp.route('/nursing-care/<int:patient_id>', methods=['GET'])
 @login_required
 def nursing_care(patient_id):
-    patient = Patient.query.get_or_404(patient_id)
+    patient = get_patient_or_404(patient_id)
     triage = Triage.query.filter_by(patient_id=patient_id).first_or_404()
     nurse_assessment = NurseAssessment.query.filter_by(patient_id=patient_id).first_or_404()
     doctor_examination = DoctorExamination.query.filter_by(patient_id=patient_id).first_or_404()
@@ -297,17 +335,65 @@ def nursing_care(patient_id):
                           doctor_examination=doctor_examination,
                           lab_requests=lab_requests)
 
+def _chart_fields(row):
+    """(label, value) of the filled-in columns of an archived row"""
+    return [(column.key.replace('_', ' ').capitalize(), getattr(row, column.key))
+            for column in row.__table__.columns
+            if column.key != 'id' and not column.key.endswith('_id') and getattr(row, column.key) not in (None, '')]
+
+@emergency_bp.route('/archived/<int:patient_id>', methods=['GET'])
+@login_required
+def archived_chart(patient_id):
+    """Read-only chart of an archived encounter, rendered from the archive copy"""
+    if db.session.get(Patient, patient_id):
+        return redirect(url_for('transfer.disposition', patient_id=patient_id))
+    chart = load_archived_chart(patient_id)
+    if chart is None:
+        abort(404)
+    archived, rows = chart
+    sections = [(model.__tablename__.replace('_', ' ').title(), [_chart_fields(row) for row in rows[model]])
+                for model in ENCOUNTER_MODELS if rows[model]]
+    return render_template('emergency/archived_chart.html', archived=archived, patient=rows[Patient][0],
+                          sections=sections)
+
+@emergency_bp.route('/archived/<int:patient_id>/restore', methods=['POST'])
+@login_required
+def restore_archived(patient_id):
+    """Bring an archived encounter back into the active tables so it can be charted on again"""
+    try:
+        patient = restore_encounter(patient_id)
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error restoring archived encounter: {str(e)}', 'danger')
+        return redirect(url_for('emergency.archived_chart', patient_id=patient_id))
+    if patient is None:
+        flash('Archived encounter not found', 'warning')
+        return redirect(url_for('emergency.patient_list'))
+    flash('Archived encounter restored', 'success')
+    return redirect(url_for('transfer.disposition', patient_id=patient_id))
+
 @emergency_bp.route('/pharmacy/<int:patient_id>', methods=['GET', 'POST'])
 @login_required
 def pharmacy(patient_id):
-    patient = Patient.query.get_or_404(patient_id)
+    patient = get_patient_or_404(patient_id)
     
     # Get existing prescriptions
     prescriptions = Prescription.query.filter_by(patient_id=patient_id).all()
     
     if request.method == 'POST':
         try:
+            # Allergy and interaction warnings must be acknowledged, as shown, before the order is saved
+            warnings = check_prescription(patient_id, request.form.get('medication_name'))
+            to_acknowledge = [warning for warning in warnings if warning.severity != 'info']
+            acknowledged = set(request.form.getlist('acknowledged_warning')) if request.form.get('acknowledge_warnings') else set()
+            if any(warning.message not in acknowledged for warning in to_acknowledge):
+                flash('Review the allergy and interaction warnings before saving this prescription', 'warning')
+                return render_template('emergency/pharmacy.html', patient=patient, prescriptions=prescriptions,
+                                      clinicians=clinicians(), warnings=warnings, form=request.form,
+                                      severity_badges=SEVERITY_BADGES)
+            
             # Create new prescription
+            prescriber = selected_clinician(request.form.get('prescribed_by_id', type=int))
             prescription = Prescription(
                 patient_id=patient_id,
                 medication_name=request.form.get('medication_name'),
@@ -316,20 +402,37 @@ def pharmacy(patient_id):
                 frequency=request.form.get('frequency'),
                 duration=request.form.get('duration'),
                 special_instructions=request.form.get('special_instructions'),
-                prescribed_by=request.form.get('prescribed_by')
+                acknowledged_warnings='\n'.join(
+                    f"[{warning.severity}] {warning.message}" for warning in to_acknowledge
+                ) or None,
+                prescribed_by=prescriber.full_name,
+                prescribed_by_id=prescriber.id
             )
             
             db.session.add(prescription)
             db.session.commit()
             
             flash('Prescription saved successfully!', 'success')
+            for warning in warnings:
+                if warning.severity == 'info':
+                    flash(warning.message, 'info')
             return redirect(url_for('emergency.pharmacy', patient_id=patient_id))
             
         except Exception as e:
             db.session.rollback()
             flash(f'Error saving prescription: {str(e)}', 'danger')
     
-    return render_template('emergency/pharmacy.html', patient=patient, prescriptions=prescriptions)
+    return render_template('emergency/pharmacy.html', patient=patient, prescriptions=prescriptions,
+                          clinicians=clinicians(), severity_badges=SEVERITY_BADGES)
+
+@emergency_bp.route('/pharmacy/<int:patient_id>/check', methods=['GET'])
+@login_required
+def check_medication(patient_id):
+    """Allergy and interaction warnings for a medication, checked as the prescriber types"""
+    get_patient_or_404(patient_id)
+    medication_name = request.args.get('medication_name', '').strip()
+    warnings = check_prescription(patient_id, medication_name) if medication_name else []
+    return jsonify({'warnings': [warning._asdict() for warning in warnings]})
 
 @emergency_bp.route('/dispense-medication/<int:prescription_id>', methods=['POST'])
 @login_required
@@ -339,7 +442,8 @@ def dispense_medication(prescription_id):
     try:
         prescription.is_dispensed = True
         prescription.dispensed_at = datetime.utcnow()
-        prescription.dispensed_by = request.form.get('dispensed_by')
+        prescription.dispensed_by = current_user.full_name
+        prescription.dispensed_by_id = current_user.id
         
         db.session.commit()
         
@@ -349,3 +453,80 @@ def dispense_medication(prescription_id):
         flash(f'Error dispensing medication: {str(e)}', 'danger')
     
     return redirect(url_for('emergency.pharmacy', patient_id=prescription.patient_id))
+
+
+@emergency_bp.route('/pharmacy-queue', methods=['GET'])
+@login_required
+def pharmacy_queue():
+    """Department-wide queue of undispensed prescriptions, most urgent and oldest first"""
+    limit = request.args.get('limit', 200, type=int)
+    priority = case(TRIAGE_PRIORITY, value=Triage.category, else_=len(TRIAGE_PRIORITY))
+    
+    queue = db.session.query(Prescription, Patient, Triage.category).join(
+        Patient, Patient.id == Prescription.patient_id
+    ).outerjoin(
+        Triage, Triage.patient_id == Patient.id
+    ).filter(
+        Prescription.is_dispensed == False  # noqa: E712
+    ).order_by(
+        priority, Prescription.prescribed_at
+    ).limit(limit).all()
+    
+    return render_template('emergency/pharmacy_queue.html', queue=queue, limit=limit)
+
+@emergency_bp.route('/pharmacy-queue/dispense', methods=['POST'])
+@login_required
+def dispense_batch():
+    """Dispense many prescriptions in one transaction.
+    
+    Each row is only updated if its version still matches the one shown in the
+    queue, so an order changed or dispensed by someone else is skipped rather
+    than dispensed twice.
+    """
+    prescription_ids = request.form.getlist('prescription_ids', type=int)
+    if not prescription_ids:
+        flash('Select at least one prescription to dispense', 'warning')
+        return redirect(url_for('emergency.pharmacy_queue'))
+    
+    dispensed_by = current_user.full_name
+    dispensed_at = datetime.utcnow()
+    dispensed_ids = []
+    
+    try:
+        for prescription_id in prescription_ids:
+            result = db.session.execute(
+                update(Prescription).where(
+                    Prescription.id == prescription_id,
+                    Prescription.version == request.form.get(f'version-{prescription_id}', type=int),
+                    Prescription.is_dispensed == False  # noqa: E712
+                ).values(
+                    is_dispensed=True,
+                    dispensed_at=dispensed_at,
+                    dispensed_by=dispensed_by,
+                    dispensed_by_id=current_user.id,
+                    version=Prescription.version + 1
+                ).execution_options(synchronize_session=False)
+            )
+            if result.rowcount:
+                dispensed_ids.append(prescription_id)
+        
+        record_changes(Prescription, dispensed_ids)
+        record_bulk_events(Prescription, dispensed_ids, 'prescription.dispensed')
+        audit_bulk_update(Prescription, dispensed_ids, {
+            'is_dispensed': (False, True),
+            'dispensed_at': (None, dispensed_at),
+            'dispensed_by': (None, dispensed_by),
+            'dispensed_by_id': (None, current_user.id),
+        })
+        db.session.commit()
+        
+        dispensed = len(dispensed_ids)
+        skipped = len(prescription_ids) - dispensed
+        flash(f'{dispensed} medication(s) marked as dispensed!', 'success')
+        if skipped:
+            flash(f'{skipped} prescription(s) were changed by someone else and were skipped', 'warning')
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error dispensing medications: {str(e)}', 'danger')
+    
+    return redirect(url_for('emergency.pharmacy_queue'))
@@ -0,0 +1,100 @@
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from flask_login import login_required
+from datetime import datetime, timedelta
+from services.export import (
+    stream_encounters_ipc, _require_pyarrow, iter_flat_export, gzip_stream, FLAT_FORMATS,
+    registrations_query, REGISTRATION_COLUMNS,
+    pending_results_query, PENDING_RESULT_COLUMNS,
+    dispensing_log_query, DISPENSING_LOG_COLUMNS,
+)
+
+export_bp = Blueprint('export', __name__, url_prefix='/export')
+
+@export_bp.route('/encounters.arrow', methods=['GET'])
+@login_required
+def encounters_arrow():
+    """Stream one month of denormalized encounters as an Arrow IPC stream"""
+    month = request.args.get('month', datetime.utcnow().strftime('%Y-%m'))
+    try:
+        datetime.strptime(month, '%Y-%m')
+    except ValueError:
+        return jsonify({"error": "month must be formatted as YYYY-MM"}), 400
+
+    try:
+        _require_pyarrow()
+    except RuntimeError as e:
+        return jsonify({"error": str(e)}), 501
+
+    return Response(
+        stream_with_context(stream_encounters_ipc(month)),
+        mimetype='application/vnd.apache.arrow.stream',
+        headers={'Content-Disposition': f'attachment; filename=encounters-{month}.arrow'}
+    )
+
+def _date_range():
+    """Read the `from`/`to` query parameters (YYYY-MM-DD, `to` inclusive), defaulting to today"""
+    today = datetime.utcnow().strftime('%Y-%m-%d')
+    start = datetime.strptime(request.args.get('from', today), '%Y-%m-%d')
+    end = datetime.strptime(request.args.get('to', request.args.get('from', today)), '%Y-%m-%d')
+    return start, end + timedelta(days=1)
+
+def _flat_response(query, columns, file_format, name):
+    if file_format not in FLAT_FORMATS:
+        return jsonify({"error": f"Unsupported export format: {file_format}"}), 404
+
+    body = iter_flat_export(query, columns, file_format)
+    headers = {'Content-Disposition': f'attachment; filename={name}.{file_format}'}
+    # accept_encodings gives 0 for encodings the client refuses (gzip;q=0) or does not list
+    if request.args.get('gzip') == '1' or request.accept_encodings['gzip'] > 0:
+        body = gzip_stream(body)
+        headers['Content-Encoding'] = 'gzip'
+        headers['Vary'] = 'Accept-Encoding'
+
+    return Response(stream_with_context(body), mimetype=FLAT_FORMATS[file_format], headers=headers)
+
+@export_bp.route('/registrations.<file_format>', methods=['GET'])
+@login_required
+def registrations(file_format):
+    """Stream registered patients, by default today's registrations"""
+    try:
+        start, end = _date_range()
+    except ValueError:
+        return jsonify({"error": "Dates must be formatted as YYYY-MM-DD"}), 400
+
+    query = registrations_query(start, end, request.args.get('arrival_mode'))
+    return _flat_response(query, REGISTRATION_COLUMNS, file_format, 'registrations')
+
+@export_bp.route('/pending-results.<file_format>', methods=['GET'])
+@login_required
+def pending_results(file_format):
+    """Stream external lab results that have not been matched to a lab request"""
+    try:
+        start, end = _date_range() if 'from' in request.args else (None, None)
+    except ValueError:
+        return jsonify({"error": "Dates must be formatted as YYYY-MM-DD"}), 400
+
+    query = pending_results_query(
+        test_type=request.args.get('test_type'),
+        patient_mrn=request.args.get('patient_mrn'),
+        start=start,
+        end=end
+    )
+    return _flat_response(query, PENDING_RESULT_COLUMNS, file_format, 'pending-results')
+
+@export_bp.route('/dispensing-log.<file_format>', methods=['GET'])
+@login_required
+def dispensing_log(file_format):
+    """Stream prescriptions and their dispensing status for a date range"""
+    try:
+        start, end = _date_range()
+    except ValueError:
+        return jsonify({"error": "Dates must be formatted as YYYY-MM-DD"}), 400
+
+    dispensed = request.args.get('dispensed')
+    query = dispensing_log_query(
+        start,
+        end,
+        patient_id=request.args.get('patient_id', type=int),
+        dispensed={'yes': True, 'no': False}.get(dispensed)
+    )
+    return _flat_response(query, DISPENSING_LOG_COLUMNS, file_format, 'dispensing-log')
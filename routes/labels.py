@@ -0,0 +1,41 @@
+from flask import Blueprint, Response, abort, flash, redirect, request, url_for
+from flask_login import login_required
+import logging
+from services.labels import FORMATS, LABEL_SIZES, render_labels, send_to_printer
+
+labels_bp = Blueprint('labels', __name__, url_prefix='/labels')
+
+def _requested_ids():
+    """Row ids from repeated id parameters (query string or form)"""
+    return [int(value) for value in request.values.getlist('id') if value.isdigit()]
+
+@labels_bp.route('/<kind>.<fmt>', methods=['GET'])
+@login_required
+def download(kind, fmt):
+    """Rendered labels for previewing or printing from the browser"""
+    if kind not in LABEL_SIZES or fmt not in FORMATS:
+        abort(404)
+    try:
+        document, _ = render_labels(kind, _requested_ids(), fmt)
+    except ValueError:
+        abort(404)
+    return Response(document, mimetype=FORMATS[fmt],
+                    headers={'Content-Disposition': f'inline; filename={kind}-labels.{fmt}'})
+
+@labels_bp.route('/<kind>/print', methods=['POST'])
+@login_required
+def print_labels(kind):
+    """Send a batch of labels to the label printer"""
+    fmt = request.form.get('format', 'zpl')
+    if kind not in LABEL_SIZES or fmt not in FORMATS:
+        abort(404)
+    
+    try:
+        document, count = render_labels(kind, _requested_ids(), fmt)
+        destination = send_to_printer(document, fmt, f"{kind}-{count}")
+        logging.info("Sent %d %s labels to %s", count, kind, destination)
+        flash(f'{count} {kind} label(s) sent to the label printer', 'success')
+    except Exception as e:
+        flash(f'Error printing labels: {str(e)}', 'danger')
+    
+    return redirect(request.referrer or url_for('emergency.patient_list'))
@@ -1,12 +1,16 @@
-from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash
+from flask import Blueprint, request, jsonify, render_template, redirect, url_for, flash, current_app, g
 from flask_login import login_required, current_user
 from models import db, Patient, LabRequest, ExternalLabResult
-from datetime import datetime
+from sqlalchemy.exc import IntegrityError
+from services.admission_control import lab_api_admission
+from services.lab_catalog import resolve_test
+from datetime import datetime, timedelta
 import logging
 
 laboratory_bp = Blueprint('laboratory', __name__)
 
 @laboratory_bp.route('/external-lab-api/results', methods=['POST'])
+@lab_api_admission.admit
 def receive_external_results():
     """API endpoint to receive results from external laboratory or radiology systems"""
     try:
@@ -18,10 +22,21 @@ def receive_external_results():
             if field not in data:
                 return jsonify({"error": f"Missing required field: {field}"}), 400
         
-        # Check if result already exists to avoid duplicates
+        # Results belong to the site named in the payload, which must be one of the API key's sites.
+        # Without one, they go to the key's only site, or to this installation's site
+        allowed_sites = current_app.config['LAB_API_KEY_SITES'].get(g.api_client)
+        default_site = next(iter(allowed_sites)) if allowed_sites and len(allowed_sites) == 1 else current_app.config['SITE_CODE']
+        site_code = data.get('site_code', default_site)
+        if site_code not in current_app.config['SITES']:
+            return jsonify({"error": f"Unknown site: {site_code}"}), 400
+        if current_app.config['LAB_API_KEYS'] and site_code not in allowed_sites:
+            return jsonify({"error": f"This API key may not send results for site {site_code}"}), 403
+        g.site_code = site_code
+        
+        # Check if result already exists to avoid duplicates; external ids are unique across sites
         existing_result = ExternalLabResult.query.filter_by(
             external_system_id=data['external_id']
-        ).first()
+        ).execution_options(all_sites=True).first()
         
         if existing_result:
             return jsonify({"error": "Result with this external ID already exists"}), 409
@@ -32,12 +47,18 @@ def receive_external_results():
             patient_mrn=data['patient_mrn'],
             test_type=data['test_type'],
             test_name=data['test_name'],
+            test_catalog_id=resolve_test(data.get('test_code'), data['test_name']),
             result=data['result'],
             result_date=datetime.strptime(data.get('result_date', datetime.now().isoformat()), '%Y-%m-%dT%H:%M:%S.%f') if 'result_date' in data else datetime.now()
         )
         
         db.session.add(new_result)
-        db.session.commit()
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # The same result was stored concurrently by another request
+            db.session.rollback()
+            return jsonify({"error": "Result with this external ID already exists"}), 409
         
         # Try to match with a pending lab request
         process_external_result(new_result.id)
@@ -45,10 +66,16 @@ def receive_external_results():
         return jsonify({"message": "Lab result received successfully", "id": new_result.id}), 201
     
     except Exception as e:
-        logging.error(f"Error processing external lab result: {str(e)}")
+        logging.exception("Error processing external lab result: %s", e)
         db.session.rollback()
         return jsonify({"error": f"Internal server error: {str(e)}"}), 500
 
+@laboratory_bp.route('/external-lab-api/metrics', methods=['GET'])
+@login_required
+def external_api_metrics():
+    """Admission control counters for the external lab API in this worker"""
+    return jsonify(lab_api_admission.snapshot())
+
 @laboratory_bp.route('/laboratory/pending-results')
 @login_required
 def pending_results():
@@ -85,58 +112,77 @@ def manual_import(result_id):
         flash('Lab result successfully imported', 'success')
         
     except Exception as e:
-        logging.error(f"Error manually importing result: {str(e)}")
+        logging.exception("Error manually importing result %s: %s", result_id, e)
         db.session.rollback()
         flash(f'Error importing result: {str(e)}', 'danger')
         
     return redirect(url_for('laboratory.pending_results'))
 
+def match_external_result(external_result):
+    """Match an external result with the oldest pending lab request, without committing.
+    
+    Returns the matched LabRequest, or None when there is nothing to match. Used
+    by process_external_result and by the MLLP listener, which commits in batches.
+    """
+    # Find the patient by MRN
+    patient = Patient.query.filter_by(medical_record_number=external_result.patient_mrn).first()
+    if not patient:
+        logging.warning("Patient with MRN %s not found for external result", external_result.patient_mrn)
+        return None
+    if patient.merged_into is not None:
+        # MRN of a mass-casualty placeholder since merged into the patient's existing record
+        patient = patient.merged_into
+    
+    # Find the oldest matching lab request; the requested_at bound lets
+    # Postgres prune partitions outside the matching window
+    window_start = external_result.result_date - timedelta(days=current_app.config['LAB_MATCH_WINDOW_DAYS'])
+    query = LabRequest.query.filter_by(
+        patient_id=patient.id,
+        is_completed=False
+    ).filter(
+        LabRequest.requested_at >= window_start
+    )
+    # Catalogued tests match on the catalog id (ix_lab_request_patient_test_open), whatever the spelling
+    if external_result.test_catalog_id is not None:
+        query = query.filter_by(test_catalog_id=external_result.test_catalog_id)
+    else:
+        query = query.filter_by(test_type=external_result.test_type, test_name=external_result.test_name)
+    matched_request = query.order_by(LabRequest.requested_at).first()
+    
+    if not matched_request:
+        logging.info("No matching lab requests found for external result %s", external_result.external_system_id)
+        return None
+    
+    # Update the lab request with the external result
+    matched_request.result = external_result.result
+    matched_request.is_completed = True
+    matched_request.completed_at = datetime.now()
+    matched_request.result_added_by = "Auto-import"
+    matched_request.is_auto_imported = True
+    matched_request.external_system_id = external_result.external_system_id
+    
+    # Mark the external result as imported
+    external_result.is_imported = True
+    external_result.lab_request_id = matched_request.id
+    return matched_request
+
 def process_external_result(result_id):
     """Process a newly received external lab result and try to match it with a pending lab request"""
     try:
         external_result = ExternalLabResult.query.get(result_id)
         if not external_result:
-            logging.error(f"External result with ID {result_id} not found")
+            logging.error("External result with ID %s not found", result_id)
             return False
         
-        # Find the patient by MRN
-        patient = Patient.query.filter_by(medical_record_number=external_result.patient_mrn).first()
-        if not patient:
-            logging.warning(f"Patient with MRN {external_result.patient_mrn} not found for external result")
+        matched_request = match_external_result(external_result)
+        if not matched_request:
             return False
         
-        # Find matching lab requests
-        matching_requests = LabRequest.query.filter_by(
-            patient_id=patient.id,
-            test_type=external_result.test_type,
-            test_name=external_result.test_name,
-            is_completed=False
-        ).all()
-        
-        if not matching_requests:
-            logging.info(f"No matching lab requests found for external result {result_id}")
-            return False
-        
-        # Get the oldest matching request
-        matched_request = sorted(matching_requests, key=lambda x: x.requested_at)[0]
-        
-        # Update the lab request with the external result
-        matched_request.result = external_result.result
-        matched_request.is_completed = True
-        matched_request.completed_at = datetime.now()
-        matched_request.result_added_by = "Auto-import"
-        matched_request.is_auto_imported = True
-        matched_request.external_system_id = external_result.external_system_id
-        
-        # Mark the external result as imported
-        external_result.is_imported = True
-        external_result.lab_request_id = matched_request.id
-        
         db.session.commit()
-        logging.info(f"Successfully imported external result {result_id} to lab request {matched_request.id}")
+        logging.info("Successfully imported external result %s to lab request %s", result_id, matched_request.id)
         return True
         
     except Exception as e:
-        logging.error(f"Error processing external result {result_id}: {str(e)}")
+        logging.exception("Error processing external result %s: %s", result_id, e)
         db.session.rollback()
-        return False
\ No newline at end of file
+        return False
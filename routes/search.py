@@ -0,0 +1,72 @@
+from flask import Blueprint, render_template, request, flash
+from flask_login import login_required
+from sqlalchemy.exc import DBAPIError
+from app import db
+from services.search import SOURCES, search_notes, highlight, hit_context
+from datetime import datetime, timedelta
+import logging
+
+search_bp = Blueprint('search', __name__, url_prefix='/search')
+
+PER_PAGE = 20
+
+# Pages that show each kind of hit
+HIT_ENDPOINTS = {
+    'examination': ('emergency.doctor_examination', 'patient_id'),
+    'assessment': ('emergency.nurse_assessment', 'patient_id'),
+    'lab_result': ('emergency.lab_results', 'request_id'),
+}
+
+def _date_arg(name):
+    value = request.args.get(name, '').strip()
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except ValueError:
+        flash(f'Invalid date: {value}', 'warning')
+        return None
+
+@search_bp.route('', methods=['GET'])
+@login_required
+def clinical_search():
+    """Ranked full-text search over examinations, nursing assessments and lab results"""
+    query = request.args.get('q', '').strip()
+    page = request.args.get('page', 1, type=int)
+    triage = request.args.get('triage') or None
+    sources = request.args.getlist('source') or list(SOURCES)
+    date_from = _date_arg('from')
+    date_to = _date_arg('to')
+    
+    hits, has_next = [], False
+    if query:
+        try:
+            hits, has_next = search_notes(
+                query,
+                date_from=date_from,
+                # The "to" date is inclusive on the form
+                date_to=date_to + timedelta(days=1) if date_to else None,
+                triage=triage,
+                sources=sources,
+                page=page,
+                per_page=PER_PAGE
+            )
+        except DBAPIError as e:
+            db.session.rollback()
+            # Neither the query nor the database message (which can quote it) is logged: it can name patients
+            logging.warning("Clinical search failed: %s", type(e.orig).__name__)
+            flash('The search could not be run; check the search terms', 'danger')
+    
+    patients, triage_categories = hit_context(hits)
+    return render_template('search/results.html',
+                          query=query,
+                          hits=hits,
+                          has_next=has_next,
+                          page=page,
+                          triage=triage,
+                          selected_sources=sources,
+                          sources=SOURCES,
+                          patients=patients,
+                          triage_categories=triage_categories,
+                          hit_endpoints=HIT_ENDPOINTS,
+                          highlight=highlight)
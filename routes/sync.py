@@ -0,0 +1,54 @@
+from flask import Blueprint, Response, current_app, g, request, jsonify
+import gzip
+import json
+from services.sync import apply_changes, reference_data
+
+sync_bp = Blueprint('sync', __name__, url_prefix='/sync')
+
+@sync_bp.before_request
+def all_sites():
+    # Edge nodes ship and fetch rows of whichever site they serve
+    g.site_code = None
+
+def _authenticated_node():
+    """Node name for the request's API key, if it matches the X-Node-Id it claims"""
+    node_id = current_app.config['SYNC_API_KEYS'].get(request.headers.get('X-API-Key', ''))
+    if node_id is None or node_id != request.headers.get('X-Node-Id'):
+        return None
+    return node_id
+
+@sync_bp.route('/push', methods=['POST'])
+def push():
+    """Receive a batch of changes from an edge node"""
+    node_id = _authenticated_node()
+    if node_id is None:
+        return jsonify({"error": "Unknown node or invalid API key"}), 401
+
+    try:
+        body = request.get_data()
+        if request.headers.get('Content-Encoding') == 'gzip':
+            body = gzip.decompress(body)
+        changes = json.loads(body)['changes']
+    except (OSError, ValueError, KeyError, TypeError):
+        return jsonify({"error": "Body must be a (gzip-compressed) JSON object with a changes list"}), 400
+
+    if any(change.get('node_id') != node_id for change in changes):
+        return jsonify({"error": "Changes must originate from the authenticated node"}), 400
+
+    try:
+        return jsonify(apply_changes(node_id, changes))
+    except Exception as e:
+        return jsonify({"error": f"Error applying changes: {str(e)}"}), 500
+
+@sync_bp.route('/reference', methods=['GET'])
+def reference():
+    """Reference data for edge nodes (user accounts)"""
+    if _authenticated_node() is None:
+        return jsonify({"error": "Unknown node or invalid API key"}), 401
+
+    body = json.dumps(reference_data()).encode('utf-8')
+    headers = {'Vary': 'Accept-Encoding'}
+    if request.accept_encodings['gzip'] > 0:
+        body = gzip.compress(body)
+        headers['Content-Encoding'] = 'gzip'
+    return Response(body, mimetype='application/json', headers=headers)
@@ -1,15 +1,24 @@
-from flask import Blueprint, render_template, redirect, url_for, flash, request
+from flask import Blueprint, render_template, redirect, url_for, flash, request, jsonify
 from flask_login import login_required, current_user
 from app import db
-from models import Patient, Triage, NurseAssessment, DoctorExamination, LabRequest, Prescription, Disposition
+from models import Patient, Triage, NurseAssessment, DoctorExamination, LabRequest, Prescription, Disposition, Ward, Bed
+from services.archive import get_patient_or_404
+from services.beds import (
+    ward_occupancy, ward_beds, assign_bed, release_bed,
+    enqueue, cancel_queue_entries, waiting_entry, queue_position, ward_queue, withdraw_from_admission,
+)
+from services.clinicians import clinicians, selected_clinician
 from datetime import datetime
 
 transfer_bp = Blueprint('transfer', __name__, url_prefix='/transfer')
 
+# Suggested admission queue priority (1 = highest) for each triage category
+TRIAGE_QUEUE_PRIORITY = {'red': 1, 'yellow': 3, 'green': 5}
+
 @transfer_bp.route('/disposition/<int:patient_id>', methods=['GET', 'POST'])
 @login_required
 def disposition(patient_id):
-    patient = Patient.query.get_or_404(patient_id)
+    patient = get_patient_or_404(patient_id)
     
     # Check if all required assessments are completed
     doctor_exam = DoctorExamination.query.filter_by(patient_id=patient_id).first()
@@ -24,17 +33,23 @@ def disposition(patient_id):
         disposition_type = request.form.get('disposition_type')
         
         try:
+            authorizer = selected_clinician(request.form.get('authorized_by_id', type=int))
             if existing_disposition:
+                if existing_disposition.disposition_type == 'inpatient' and disposition_type != 'inpatient':
+                    # The patient no longer needs the bed or their place in the ward queue
+                    withdraw_from_admission(existing_disposition)
                 # Update existing disposition
                 existing_disposition.disposition_type = disposition_type
-                existing_disposition.authorized_by = request.form.get('authorized_by')
+                existing_disposition.authorized_by = authorizer.full_name
+                existing_disposition.authorized_by_id = authorizer.id
                 existing_disposition.notes = request.form.get('notes')
             else:
                 # Create new disposition
                 disposition = Disposition(
                     patient_id=patient_id,
                     disposition_type=disposition_type,
-                    authorized_by=request.form.get('authorized_by'),
+                    authorized_by=authorizer.full_name,
+                    authorized_by_id=authorizer.id,
                     notes=request.form.get('notes')
                 )
                 db.session.add(disposition)
@@ -57,12 +72,13 @@ def disposition(patient_id):
     
     return render_template('transfer/disposition.html', 
                           patient=patient,
-                          disposition=existing_disposition)
+                          disposition=existing_disposition,
+                          clinicians=clinicians())
 
 @transfer_bp.route('/discharge-planning/<int:patient_id>', methods=['GET', 'POST'])
 @login_required
 def discharge_planning(patient_id):
-    patient = Patient.query.get_or_404(patient_id)
+    patient = get_patient_or_404(patient_id)
     disposition = Disposition.query.filter_by(patient_id=patient_id).first_or_404()
     
     # Verify it's a discharge disposition
@@ -93,7 +109,7 @@ def discharge_planning(patient_id):
 @transfer_bp.route('/outpatient-referral/<int:patient_id>', methods=['GET', 'POST'])
 @login_required
 def outpatient_referral(patient_id):
-    patient = Patient.query.get_or_404(patient_id)
+    patient = get_patient_or_404(patient_id)
     disposition = Disposition.query.filter_by(patient_id=patient_id).first_or_404()
     
     # Verify it's an outpatient disposition
@@ -128,7 +144,7 @@ def outpatient_referral(patient_id):
 @transfer_bp.route('/inpatient-transfer/<int:patient_id>', methods=['GET', 'POST'])
 @login_required
 def inpatient_transfer(patient_id):
-    patient = Patient.query.get_or_404(patient_id)
+    patient = get_patient_or_404(patient_id)
     disposition = Disposition.query.filter_by(patient_id=patient_id).first_or_404()
     
     # Verify it's an inpatient disposition
@@ -138,14 +154,38 @@ def inpatient_transfer(patient_id):
     
     if request.method == 'POST':
         try:
-            disposition.destination_ward = request.form.get('destination_ward')
-            disposition.bed_number = request.form.get('bed_number')
+            ward = Ward.query.get_or_404(request.form.get('ward_id', type=int))
+            disposition.destination_ward = ward.name
             bed_available = request.form.get('is_bed_available') == 'yes'
-            disposition.is_bed_available = bed_available
             
-            if not bed_available:
-                disposition.waiting_list_position = request.form.get('waiting_list_position')
+            if bed_available:
+                bed = Bed.query.filter_by(id=request.form.get('bed_id', type=int), ward_id=ward.id).first()
+                if not bed:
+                    flash('Please select a bed in the destination ward', 'warning')
+                    return redirect(url_for('transfer.inpatient_transfer', patient_id=patient_id))
+                
+                if disposition.bed_id != bed.id:
+                    # Claim the new bed first so a lost race leaves the old assignment intact
+                    if not assign_bed(bed.id, patient_id):
+                        db.session.rollback()
+                        flash(f'Bed {bed.label} was just taken by another transfer, please choose another bed', 'warning')
+                        return redirect(url_for('transfer.inpatient_transfer', patient_id=patient_id))
+                    if disposition.bed_id:
+                        release_bed(disposition.bed_id, patient_id)
+                    disposition.bed_id = bed.id
+                    disposition.bed_number = bed.label
+                cancel_queue_entries(disposition.id)
+            else:
+                if disposition.bed_id:
+                    # A bed held from an earlier choice or a queue offer goes back to its ward
+                    withdraw_from_admission(disposition)
+                # Positions are kept by the ward's admission queue, ordered by priority
+                priority = min(max(request.form.get('waiting_list_priority', 5, type=int), 1), 10)
+                entry = waiting_entry(disposition.id)
+                if not entry or entry.ward_id != ward.id or entry.priority != priority:
+                    enqueue(disposition, ward.id, priority)
             
+            disposition.is_bed_available = bed_available
             disposition.is_completed = bed_available  # Only complete if bed is available
             
             if bed_available:
@@ -163,14 +203,68 @@ def inpatient_transfer(patient_id):
             db.session.rollback()
             flash(f'Error saving inpatient transfer: {str(e)}', 'danger')
     
+    queue_entry = waiting_entry(disposition.id)
+    
     return render_template('transfer/inpatient_transfer.html', 
                           patient=patient,
-                          disposition=disposition)
+                          disposition=disposition,
+                          wards=ward_occupancy(),
+                          queue_entry=queue_entry,
+                          queue_position=queue_position(queue_entry) if queue_entry else None,
+                          default_priority=TRIAGE_QUEUE_PRIORITY.get(patient.triage.category if patient.triage else None, 5))
+
+@transfer_bp.route('/api/wards', methods=['GET'])
+@login_required
+def ward_occupancy_api():
+    """Per-ward bed availability from the maintained occupancy counters"""
+    return jsonify(ward_occupancy())
+
+@transfer_bp.route('/api/wards/<int:ward_id>/beds', methods=['GET'])
+@login_required
+def ward_beds_api(ward_id):
+    Ward.query.get_or_404(ward_id)
+    return jsonify(ward_beds(ward_id))
+
+@transfer_bp.route('/api/wards/<int:ward_id>/queue', methods=['GET'])
+@login_required
+def ward_queue_api(ward_id):
+    """Patients waiting for a bed in a ward, in the order beds will be offered"""
+    ward = Ward.query.get_or_404(ward_id)
+    entries = ward_queue(ward_id, limit=request.args.get('limit', 50, type=int))
+    return jsonify({
+        'ward': ward.name,
+        'waiting_count': ward.waiting_count,
+        'queue': [{
+            'position': position,
+            'patient_id': entry.patient_id,
+            'patient_name': f"{entry.patient.first_name} {entry.patient.last_name}",
+            'priority': entry.priority,
+            'enqueued_at': entry.enqueued_at.isoformat(),
+        } for position, entry in enumerate(entries, start=1)]
+    })
+
+@transfer_bp.route('/beds/<int:bed_id>/release', methods=['POST'])
+@login_required
+def release_bed_route(bed_id):
+    """Mark a bed as free again, e.g. when the ward discharges its patient.
+    
+    With a patient_id parameter the bed is only released while that patient
+    holds it. The bed is offered to the head of the ward's admission queue right away.
+    """
+    Bed.query.get_or_404(bed_id)
+    try:
+        if release_bed(bed_id, request.values.get('patient_id', type=int)):
+            db.session.commit()
+            return jsonify({"message": "Bed released"})
+        return jsonify({"error": "Bed is not occupied by this patient"}), 409
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
 
 @transfer_bp.route('/mortality/<int:patient_id>', methods=['GET', 'POST'])
 @login_required
 def mortality(patient_id):
-    patient = Patient.query.get_or_404(patient_id)
+    patient = get_patient_or_404(patient_id)
     disposition = Disposition.query.filter_by(patient_id=patient_id).first_or_404()
     
     # Verify it's a mortality disposition
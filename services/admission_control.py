@@ -0,0 +1,198 @@
+"""Admission control for machine-to-machine ingestion endpoints.
+
+Every request to an ingestion endpoint must pass three gates before the
+view runs:
+
+1. authentication with an API key (X-API-Key), when keys are configured;
+2. a per-client token bucket (rate per second plus burst);
+3. a non-blocking slot from a bounded concurrency pool, so ingestion can
+   only ever occupy a fixed number of request threads in a worker.
+
+Requests that fail the second or third gate are shed immediately with 429
+and a Retry-After header instead of queueing behind clinician traffic.
+State is per worker process, so limits apply per gunicorn worker.
+
+Without API keys (development), clients are told apart by request.remote_addr.
+ProxyFix only trusts X-Forwarded-Proto and -Host, so behind a reverse proxy
+this is the proxy's address, and all clients share one bucket. Configure keys
+for anything but a single directly connected client. Buckets idle long enough
+to have refilled are dropped, since a fresh bucket is identical, and at most
+MAX_TRACKED_CLIENTS are kept, least recently used first out.
+"""
+import math
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+
+from flask import current_app, g, jsonify, request
+
+
+# Clients with a bucket and their own metrics; beyond this, buckets are evicted least recently used
+# first and metrics of new clients are counted under 'other'
+MAX_TRACKED_CLIENTS = 10000
+# Seconds between sweeps for idle buckets
+SWEEP_INTERVAL = 60
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def is_full(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+    def take(self):
+        """Take one token; returns seconds to wait before retrying, or 0 if allowed"""
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+
+class AdmissionController:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.buckets = OrderedDict()
+        self.swept = time.monotonic()
+        self.slots = None
+        self.max_concurrent = 0
+        self.in_flight = 0
+        self.metrics = {
+            'accepted': 0,
+            'unauthorized': 0,
+            'shed_rate_limited': 0,
+            'shed_concurrency': 0,
+            'by_client': {},
+        }
+
+    def _configure(self, config):
+        if self.slots is None:
+            with self.lock:
+                if self.slots is None:
+                    self.max_concurrent = config['LAB_API_MAX_CONCURRENT']
+                    self.slots = threading.BoundedSemaphore(self.max_concurrent)
+
+    def _bucket(self, client, config):
+        with self.lock:
+            now = time.monotonic()
+            if now - self.swept >= SWEEP_INTERVAL:
+                self._sweep(now)
+            bucket = self.buckets.get(client)
+            if bucket is None:
+                bucket = self.buckets[client] = TokenBucket(config['LAB_API_RATE'], config['LAB_API_BURST'])
+                while len(self.buckets) > MAX_TRACKED_CLIENTS:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(client)
+            return bucket
+
+    def _sweep(self, now):
+        """Drop buckets that have refilled completely; called with the lock held"""
+        self.swept = now
+        for client in [client for client, bucket in self.buckets.items() if bucket.is_full(now)]:
+            del self.buckets[client]
+
+    def _count(self, client, outcome):
+        with self.lock:
+            self.metrics[outcome] += 1
+            by_client = self.metrics['by_client']
+            if client not in by_client and len(by_client) >= MAX_TRACKED_CLIENTS:
+                client = 'other'
+            per_client = by_client.setdefault(client, {})
+            per_client[outcome] = per_client.get(outcome, 0) + 1
+
+    def snapshot(self):
+        with self.lock:
+            return {
+                **self.metrics,
+                'by_client': {client: dict(counts) for client, counts in self.metrics['by_client'].items()},
+                'in_flight': self.in_flight,
+                'max_concurrent': self.max_concurrent,
+            }
+
+    def identify_client(self, config):
+        """Client name for the request's API key; None if keys are configured and it is missing or wrong"""
+        api_keys = config['LAB_API_KEYS']
+        if not api_keys:
+            # No keys configured (development): limit per remote address instead, which is the
+            # proxy's address behind a reverse proxy
+            return f"addr:{request.remote_addr}"
+        return api_keys.get(request.headers.get('X-API-Key', ''))
+
+    def admit(self, view):
+        """Decorator applying authentication, rate limiting and the concurrency pool to a view"""
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            config = current_app.config
+            self._configure(config)
+
+            client = self.identify_client(config)
+            if client is None:
+                self._count('unknown', 'unauthorized')
+                return jsonify({"error": "Missing or invalid API key"}), 401
+
+            retry_after = self._bucket(client, config).take()
+            if retry_after:
+                self._count(client, 'shed_rate_limited')
+                return _too_many_requests("Rate limit exceeded for this API client", retry_after)
+
+            if not self.slots.acquire(blocking=False):
+                self._count(client, 'shed_concurrency')
+                return _too_many_requests("Ingestion capacity is full, retry shortly", 1)
+
+            # The view checks what this client may do, e.g. which sites it may write to
+            g.api_client = client
+            self._count(client, 'accepted')
+            with self.lock:
+                self.in_flight += 1
+            try:
+                return view(*args, **kwargs)
+            finally:
+                with self.lock:
+                    self.in_flight -= 1
+                self.slots.release()
+        return wrapper
+
+
+def _too_many_requests(message, retry_after):
+    response = jsonify({"error": message})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def parse_api_keys(value):
+    """Parse 'name:key,name:key' into {key: name}; a third field (see parse_api_key_sites) is ignored"""
+    api_keys = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, key = item.partition(':')
+        key = key.partition(':')[0]
+        if key:
+            api_keys[key] = name
+    return api_keys
+
+
+def parse_api_key_sites(value, default_site):
+    """Parse the sites of 'name:key:SITE+SITE,...' into {name: frozenset of site codes}.
+
+    A client listed without sites may only write to `default_site`.
+    """
+    sites = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        name, _, rest = item.partition(':')
+        key, _, site_list = rest.partition(':')
+        if key:
+            sites[name] = frozenset(filter(None, (site.strip() for site in site_list.split('+')))) or frozenset({default_site})
+    return sites
+
+
+lab_api_admission = AdmissionController()
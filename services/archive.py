@@ -0,0 +1,236 @@
+"""Retention and archival of closed encounters.
+
+Encounters whose Disposition was completed before the retention window,
+and external lab results that were matched to a request before it, are
+moved from the hot tables into the archive database (the 'archive' bind)
+in small batches. Each batch is copied to the archive and committed before
+the hot rows are deleted, and archive writes are merges, so a job that is
+interrupted can simply be run again. Admission queue entries of the
+encounter are archived with it, since they refer to its disposition.
+Patients that a merged placeholder points to (merged_into_id), or that
+still hold a bed, are kept in the hot tables.
+
+Chart lookups go through get_patient_or_404(). Viewing an archived
+encounter never writes: the lookup sends the browser to a read-only chart
+rendered from the archive payload. Staff who need to chart on it again
+restore it with an explicit POST, which copies the rows back into the hot
+tables and then deletes the archive copy. Like archiving, restoring can be
+repeated: a restore that finds the patient already back in the hot tables,
+because of a concurrent restore or one interrupted between its two commits,
+only removes the leftover archive copy.
+"""
+import logging
+import time
+from datetime import date, datetime, timedelta
+
+from flask import abort, current_app, redirect, url_for
+from sqlalchemy.exc import IntegrityError
+
+from app import db
+from models import (
+    Patient, Triage, NurseAssessment, DoctorExamination, LabRequest, Prescription, Disposition,
+    ExternalLabResult, ArchivedEncounter, ArchivedExternalLabResult, Bed, AdmissionQueueEntry,
+)
+
+DEFAULT_BATCH_SIZE = 200
+
+# Child tables of an encounter, in the order they are restored
+ENCOUNTER_MODELS = [Triage, NurseAssessment, DoctorExamination, LabRequest, Prescription, Disposition]
+# Also archived and restored with the encounter, but not shown on the chart. They refer to
+# its Disposition, so they are restored after it and deleted before it
+ARCHIVED_MODELS = ENCOUNTER_MODELS + [AdmissionQueueEntry]
+
+
+def _encode(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _row_to_dict(row):
+    return {column.key: _encode(getattr(row, column.key)) for column in row.__table__.columns}
+
+
+def _dict_to_row(model, data):
+    values = {}
+    for column in model.__table__.columns:
+        value = data.get(column.key)
+        if value is None and column.default is not None:
+            # Column added after the row was archived; let its default fill it in
+            continue
+        if value is not None and isinstance(column.type, db.DateTime):
+            value = datetime.fromisoformat(value)
+        elif value is not None and isinstance(column.type, db.Date):
+            value = date.fromisoformat(value)
+        values[column.key] = value
+    return model(**values)
+
+
+def retention_cutoff(days=None):
+    if days is None:
+        days = current_app.config.get('ARCHIVE_AFTER_DAYS', 365)
+    return datetime.utcnow() - timedelta(days=days)
+
+
+def _archive_encounter_batch(cutoff, batch_size):
+    merged = db.aliased(Patient)
+    patients = db.session.query(Patient).join(
+        Disposition, Disposition.patient_id == Patient.id
+    ).filter(
+        Disposition.is_completed == True,  # noqa: E712
+        Disposition.completed_at < cutoff,
+        # Patients still holding an inpatient bed stay in the hot tables
+        ~db.session.query(Bed.id).filter(Bed.patient_id == Patient.id).exists(),
+        # So do records that merged placeholders point to (Patient.merged_into_id)
+        ~db.session.query(merged.id).filter(merged.merged_into_id == Patient.id).exists()
+    ).order_by(Patient.id).limit(batch_size).all()
+    if not patients:
+        return 0
+
+    patient_ids = [patient.id for patient in patients]
+    payloads = {patient.id: {Patient.__tablename__: [_row_to_dict(patient)]} for patient in patients}
+    completed_at = {}
+    for model in ARCHIVED_MODELS:
+        for row in model.query.filter(model.patient_id.in_(patient_ids)):
+            payloads[row.patient_id].setdefault(model.__tablename__, []).append(_row_to_dict(row))
+            if model is Disposition:
+                completed_at[row.patient_id] = row.completed_at
+
+    # Copy first; merge keeps a rerun after a crash idempotent
+    for patient in patients:
+        db.session.merge(ArchivedEncounter(
+            patient_id=patient.id,
+            medical_record_number=patient.medical_record_number,
+            completed_at=completed_at.get(patient.id),
+            payload=payloads[patient.id]
+        ))
+    db.session.commit()
+
+    for model in reversed(ARCHIVED_MODELS):
+        model.query.filter(model.patient_id.in_(patient_ids)).delete(synchronize_session=False)
+    Patient.query.filter(Patient.id.in_(patient_ids)).delete(synchronize_session=False)
+    db.session.commit()
+    db.session.expunge_all()
+    return len(patient_ids)
+
+
+def _archive_external_result_batch(cutoff, batch_size):
+    results = ExternalLabResult.query.filter(
+        ExternalLabResult.is_imported == True,  # noqa: E712
+        ExternalLabResult.result_date < cutoff
+    ).order_by(ExternalLabResult.id).limit(batch_size).all()
+    if not results:
+        return 0
+
+    for result in results:
+        db.session.merge(ArchivedExternalLabResult(
+            id=result.id,
+            external_system_id=result.external_system_id,
+            patient_mrn=result.patient_mrn,
+            lab_request_id=result.lab_request_id,
+            result_date=result.result_date,
+            payload=_row_to_dict(result)
+        ))
+    db.session.commit()
+
+    result_ids = [result.id for result in results]
+    ExternalLabResult.query.filter(ExternalLabResult.id.in_(result_ids)).delete(synchronize_session=False)
+    db.session.commit()
+    db.session.expunge_all()
+    return len(result_ids)
+
+
+def _run_batches(batch_fn, cutoff, batch_size, pause, max_batches):
+    total = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        moved = batch_fn(cutoff, batch_size)
+        if not moved:
+            break
+        total += moved
+        batches += 1
+        if pause:
+            # Throttle so the job never monopolizes the primary during clinical hours
+            time.sleep(pause)
+    return total
+
+
+def archive_closed_encounters(days=None, batch_size=DEFAULT_BATCH_SIZE, pause=0.5, max_batches=None):
+    """Move closed encounters and matched external results older than the retention window.
+
+    Returns a dict with the number of encounters and external results archived.
+    """
+    cutoff = retention_cutoff(days)
+    encounters = _run_batches(_archive_encounter_batch, cutoff, batch_size, pause, max_batches)
+    external_results = _run_batches(_archive_external_result_batch, cutoff, batch_size, pause, max_batches)
+    logging.info("Archived %d encounters and %d external results closed before %s",
+                 encounters, external_results, cutoff)
+    return {'encounters': encounters, 'external_results': external_results}
+
+
+def archived_chart(patient_id):
+    """Read-only view of an archived encounter: (ArchivedEncounter, {model: [rows]}) or None.
+
+    The rows are transient model instances built from the payload; they are never added
+    to the session.
+    """
+    archived = db.session.get(ArchivedEncounter, patient_id)
+    if not archived:
+        return None
+    payload = archived.payload
+    rows = {Patient: [_dict_to_row(Patient, data) for data in payload[Patient.__tablename__]]}
+    for model in ENCOUNTER_MODELS:
+        rows[model] = [_dict_to_row(model, data) for data in payload.get(model.__tablename__, [])]
+    return archived, rows
+
+
+def _discard_archive_copy(patient_id):
+    db.session.query(ArchivedEncounter).filter(
+        ArchivedEncounter.patient_id == patient_id
+    ).delete(synchronize_session=False)
+    db.session.commit()
+
+
+def restore_encounter(patient_id):
+    """Move an archived encounter back into the hot tables, returning the Patient or None"""
+    patient = db.session.get(Patient, patient_id)
+    if patient is not None:
+        # Already restored; an earlier restore may have stopped before removing the archive copy
+        _discard_archive_copy(patient_id)
+        return patient
+
+    archived = db.session.get(ArchivedEncounter, patient_id)
+    if not archived:
+        return None
+
+    payload = archived.payload
+    db.session.add(_dict_to_row(Patient, payload[Patient.__tablename__][0]))
+    for model in ARCHIVED_MODELS:
+        for data in payload.get(model.__tablename__, []):
+            db.session.add(_dict_to_row(model, data))
+    try:
+        # The hot rows are committed before the archive copy is removed, so a crash in between
+        # leaves the encounter in both places rather than in neither
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent restore inserted the same rows first
+        db.session.rollback()
+        patient = db.session.get(Patient, patient_id)
+        if patient is None:
+            raise
+        _discard_archive_copy(patient_id)
+        return patient
+
+    _discard_archive_copy(patient_id)
+    logging.info("Restored archived encounter for patient %d", patient_id)
+    return db.session.get(Patient, patient_id)
+
+
+def get_patient_or_404(patient_id):
+    """Chart lookup; archived patients are sent to their read-only archived chart"""
+    patient = db.session.get(Patient, patient_id)
+    if patient is not None:
+        return patient
+    if db.session.query(ArchivedEncounter.patient_id).filter(ArchivedEncounter.patient_id == patient_id).first():
+        abort(redirect(url_for('emergency.archived_chart', patient_id=patient_id)))
+    abort(404)
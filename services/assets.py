@@ -0,0 +1,236 @@
+"""Self-hosted, fingerprinted and precompressed static assets.
+
+Third-party assets (Bootstrap, Font Awesome, Chart.js) are vendored into
+static/vendor by `build_assets.py --vendor` on a machine with internet
+access and committed, so the hospital network never needs a CDN.
+`build_assets.py` then writes static/dist, and refuses to build while a
+vendor file is missing:
+
+* bundles (BUNDLES) are concatenated and minified, with rcssmin/rjsmin
+  when the 'assets' extra is installed;
+* every output file is named after its content hash, e.g. app.3f2a9c1e0b7d.css,
+  and url() references inside CSS, such as Font Awesome's webfonts, are
+  rewritten to the hashed files;
+* text assets get .gz siblings, and .br siblings when brotli is installed;
+* manifest.json maps logical names to hashed files.
+
+At runtime asset_urls() resolves a bundle through the manifest. The
+/assets/ route serves the best precompressed variant the browser accepts,
+with immutable far-future caching, which the hashed names make safe.
+Without a build, asset_urls() falls back to the individual source files.
+A vendor file that was never fetched is not silently replaced by its CDN
+copy: it is left out of the page and logged as an error, unless
+ASSET_CDN_FALLBACK is set.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import os
+import posixpath
+import re
+import shutil
+import urllib.request
+
+from flask import current_app, url_for
+
+FONT_AWESOME = 'https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.4.0'
+
+# Static path -> upstream URL
+VENDOR_ASSETS = {
+    'vendor/bootstrap/bootstrap-agent-dark-theme.min.css':
+        'https://cdn.replit.com/agent/bootstrap-agent-dark-theme.min.css',
+    'vendor/bootstrap/bootstrap.bundle.min.js':
+        'https://cdn.jsdelivr.net/npm/bootstrap@5.3.0/dist/js/bootstrap.bundle.min.js',
+    'vendor/fontawesome/css/all.min.css': f'{FONT_AWESOME}/css/all.min.css',
+    'vendor/chart.js/chart.umd.js': 'https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.js',
+}
+for _font in ('fa-solid-900', 'fa-regular-400', 'fa-brands-400', 'fa-v4compatibility'):
+    for _extension in ('woff2', 'ttf'):
+        VENDOR_ASSETS[f'vendor/fontawesome/webfonts/{_font}.{_extension}'] = f'{FONT_AWESOME}/webfonts/{_font}.{_extension}'
+
+# Bundle name -> static paths, in load order
+BUNDLES = {
+    'app.css': [
+        'vendor/bootstrap/bootstrap-agent-dark-theme.min.css',
+        'vendor/fontawesome/css/all.min.css',
+        'css/custom.css',
+    ],
+    'app.js': [
+        'vendor/bootstrap/bootstrap.bundle.min.js',
+        'js/main.js',
+        'js/print.js',
+    ],
+    'bed_selector.js': ['js/bed_selector.js'],
+    'chart.js': ['vendor/chart.js/chart.umd.js'],
+}
+
+COMPRESSIBLE = ('.css', '.js', '.svg', '.ttf', '.json', '.map')
+CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+_CSS_URL = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+_CSS_COMMENT = re.compile(r'/\*(?!!).*?\*/', re.S)
+
+_manifest = {'mtime': None, 'entries': {}}
+_reported_missing = set()
+
+
+# --- Build ---
+
+def vendor_assets(static_dir, force=False):
+    """Download third-party assets into static/vendor; returns the number fetched.
+
+    Raises RuntimeError naming the file that could not be downloaded.
+    """
+    fetched = 0
+    for path, url in VENDOR_ASSETS.items():
+        target = os.path.join(static_dir, path)
+        if os.path.exists(target) and not force:
+            continue
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            with urllib.request.urlopen(url, timeout=60) as response:
+                data = response.read()
+        except OSError as e:
+            raise RuntimeError(f"Could not download {url} for {path}: {e}") from e
+        with open(target, 'wb') as f:
+            f.write(data)
+        fetched += 1
+        logging.info("Vendored %s -> %s", url, path)
+    return fetched
+
+
+def _minify_css(text):
+    try:
+        import rcssmin
+        return rcssmin.cssmin(text)
+    except ImportError:
+        # Conservative fallback: drop comments (keeping /*! licences) and indentation
+        text = _CSS_COMMENT.sub('', text)
+        return '\n'.join(line.strip() for line in text.splitlines() if line.strip())
+
+
+def _minify_js(text):
+    try:
+        import rjsmin
+        return rjsmin.jsmin(text)
+    except ImportError:
+        return text
+
+
+def _hashed_name(path, data):
+    root, extension = posixpath.splitext(path)
+    return f"{root}.{hashlib.sha256(data).hexdigest()[:12]}{extension}"
+
+
+class _Builder:
+    def __init__(self, static_dir, dist_dir):
+        self.static_dir = static_dir
+        self.dist_dir = dist_dir
+        self.manifest = {}
+
+    def emit(self, name, data):
+        """Write `data` under its hashed name (plus compressed variants); returns that name"""
+        hashed = _hashed_name(name, data)
+        target = os.path.join(self.dist_dir, hashed)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(target, 'wb') as f:
+            f.write(data)
+        if hashed.endswith(COMPRESSIBLE):
+            with open(target + '.gz', 'wb') as f:
+                f.write(gzip.compress(data, compresslevel=9, mtime=0))
+            try:
+                import brotli
+                with open(target + '.br', 'wb') as f:
+                    f.write(brotli.compress(data))
+            except ImportError:
+                pass
+        self.manifest[name] = hashed
+        return hashed
+
+    def emit_file(self, path):
+        if path not in self.manifest:
+            with open(os.path.join(self.static_dir, path), 'rb') as f:
+                self.emit(path, f.read())
+        return self.manifest[path]
+
+    def rewrite_css_urls(self, css, source_path):
+        """Point relative url()s at hashed copies, relative to the bundle in the dist root"""
+        def replace(match):
+            url = match.group(2).strip()
+            if url.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+                return match.group(0)
+            path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+            resolved = posixpath.normpath(posixpath.join(posixpath.dirname(source_path), path))
+            if not os.path.isfile(os.path.join(self.static_dir, resolved)):
+                logging.warning("%s references missing file %s", source_path, resolved)
+                return match.group(0)
+            return f"url({self.emit_file(resolved)}{suffix})"
+        return _CSS_URL.sub(replace, css)
+
+    def build_bundle(self, name, sources):
+        parts = []
+        for source in sources:
+            with open(os.path.join(self.static_dir, source), encoding='utf-8') as f:
+                text = f.read()
+            already_minified = '.min.' in source
+            if name.endswith('.css'):
+                text = self.rewrite_css_urls(text, source)
+                parts.append(text if already_minified else _minify_css(text))
+            else:
+                parts.append(text if already_minified else _minify_js(text))
+        separator = '\n' if name.endswith('.css') else ';\n'
+        return self.emit(name, separator.join(parts).encode('utf-8'))
+
+
+def build_assets(static_dir, dist_dir, bundles=None):
+    """Build every bundle into dist_dir and write its manifest; returns the manifest"""
+    bundles = bundles or BUNDLES
+    missing = [source for sources in bundles.values() for source in sources
+               if not os.path.isfile(os.path.join(static_dir, source))]
+    if missing:
+        raise RuntimeError(f"Missing asset sources (run with --vendor on a machine with internet access "
+                           f"and commit static/vendor): {', '.join(missing)}")
+
+    shutil.rmtree(dist_dir, ignore_errors=True)
+    builder = _Builder(static_dir, dist_dir)
+    for name, sources in bundles.items():
+        builder.build_bundle(name, sources)
+    with open(os.path.join(dist_dir, 'manifest.json'), 'w') as f:
+        json.dump(builder.manifest, f, indent=2, sort_keys=True)
+    return builder.manifest
+
+
+# --- Runtime ---
+
+def _load_manifest():
+    path = os.path.join(current_app.config['ASSET_DIST_DIR'], 'manifest.json')
+    try:
+        mtime = os.path.getmtime(path)
+    except OSError:
+        return {}
+    # Re-read after a rebuild without needing a restart
+    if mtime != _manifest['mtime']:
+        with open(path) as f:
+            _manifest['entries'] = json.load(f)
+        _manifest['mtime'] = mtime
+    return _manifest['entries']
+
+
+def asset_urls(name):
+    """URLs to include for a bundle: the built file, or its sources when not built"""
+    hashed = _load_manifest().get(name)
+    if hashed:
+        return [url_for('assets.asset', filename=hashed)]
+
+    urls = []
+    for source in BUNDLES[name]:
+        if os.path.isfile(os.path.join(current_app.static_folder, source)):
+            urls.append(url_for('static', filename=source))
+        elif source in VENDOR_ASSETS and current_app.config['ASSET_CDN_FALLBACK']:
+            urls.append(VENDOR_ASSETS[source])
+        elif source not in _reported_missing:
+            _reported_missing.add(source)
+            logging.error("Static asset %s is missing and left out of pages; run build_assets.py --vendor "
+                          "and commit static/vendor, or set ASSET_CDN_FALLBACK=1", source)
+    return urls
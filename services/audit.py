@@ -0,0 +1,261 @@
+"""Append-only clinical audit log with write-behind batching.
+
+Session events record every insert, update and delete of a clinical model.
+Each record holds the user, the row, and before/after values of the changed
+columns. Records are collected per transaction, and per savepoint inside
+it, and only handed on when the outermost transaction commits. Work that
+is rolled back, including work rolled back to a savepoint
+(session.begin_nested()), is never audited.
+
+On commit the records go into a bounded in-process buffer. A background
+thread drains the buffer and writes it with one multi-row INSERT per batch,
+so a request pays for building a few dicts instead of a database round
+trip. If the writer falls so far behind that the buffer is full, the rest
+of the commit's records are written inline in one batch rather than
+dropped. The buffer is flushed at interpreter exit; scripts can also call
+flush_audit_log() explicitly.
+"""
+import atexit
+import logging
+import os
+import queue
+import threading
+from collections import defaultdict
+from datetime import date, datetime
+
+from flask import current_app, has_request_context
+from flask_login import current_user
+from sqlalchemy import event, inspect
+
+from app import db
+from services.sites import current_site_code
+from models import (
+    Patient, Triage, NurseAssessment, DoctorExamination, LabRequest, Prescription, Disposition, AuditEntry,
+)
+
+AUDITED_MODELS = (Patient, Triage, NurseAssessment, DoctorExamination, LabRequest, Prescription, Disposition)
+
+
+class AuditWriter:
+    def __init__(self, buffer_size=10000, batch_size=500, flush_interval=0.5):
+        self.queue = queue.Queue(maxsize=buffer_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.thread = None
+        self.pid = None
+        self.stats = {'written': 0, 'batches': 0, 'inline': 0, 'errors': 0}
+
+    def _ensure_started(self):
+        # Threads do not survive fork, so a forked worker starts its own writer
+        if self.thread is not None and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.thread is None or self.pid != os.getpid():
+                self.queue = queue.Queue(maxsize=self.queue.maxsize)
+                self.stopping.clear()
+                self.pid = os.getpid()
+                self.thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+                self.thread.start()
+
+    def put(self, engine, records):
+        self._ensure_started()
+        for position, record in enumerate(records):
+            try:
+                self.queue.put_nowait((engine, record))
+            except queue.Full:
+                # Never wait on the request thread; what does not fit is written here, in one batch
+                remaining = records[position:]
+                self.stats['inline'] += len(remaining)
+                self._write([(engine, record) for record in remaining])
+                return
+
+    def _run(self):
+        while not (self.stopping.is_set() and self.queue.empty()):
+            try:
+                batch = [self.queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                continue
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write(batch)
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _write(self, batch):
+        by_engine = defaultdict(list)
+        for engine, record in batch:
+            by_engine[engine].append(record)
+        for engine, records in by_engine.items():
+            try:
+                with engine.begin() as connection:
+                    connection.execute(AuditEntry.__table__.insert(), records)
+                self.stats['written'] += len(records)
+                self.stats['batches'] += 1
+            except Exception as e:
+                # Record payloads hold patient data, so only which rows were affected is logged
+                self.stats['errors'] += 1
+                logging.error("Error writing %d audit records (%s): %s", len(records),
+                              ', '.join(f"{record['table_name']}#{record['row_id']}" for record in records), e)
+
+    def flush(self):
+        """Block until everything buffered so far has been written"""
+        if self.thread is not None and self.pid == os.getpid():
+            self.queue.join()
+
+    def shutdown(self, timeout=30):
+        if self.thread is None or self.pid != os.getpid():
+            return
+        self.stopping.set()
+        self.thread.join(timeout)
+        self.thread = None
+
+
+writer = AuditWriter()
+
+
+def flush_audit_log():
+    writer.flush()
+
+
+atexit.register(writer.shutdown)
+
+
+def _encode(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _actor():
+    if has_request_context() and current_user and current_user.is_authenticated:
+        return current_user.id, current_user.username
+    return None, 'system'
+
+
+def _record(obj, action, changes):
+    user_id, actor = _actor()
+    return {
+        'occurred_at': datetime.utcnow(),
+        'site_code': getattr(obj, 'site_code', None),
+        'user_id': user_id,
+        'actor': actor,
+        'table_name': obj.__tablename__,
+        'row_id': obj.id,
+        'action': action,
+        'changes': changes,
+    }
+
+
+def _column_changes(obj):
+    """{column: [before, after]} for the columns changed on a dirty object"""
+    state = inspect(obj)
+    changes = {}
+    for attribute in state.mapper.column_attrs:
+        history = state.attrs[attribute.key].history
+        if history.added or history.deleted:
+            before = history.deleted[0] if history.deleted else None
+            after = history.added[0] if history.added else None
+            if before != after:
+                changes[attribute.key] = [_encode(before), _encode(after)]
+    return changes
+
+
+def _column_values(obj):
+    return {attribute.key: _encode(getattr(obj, attribute.key)) for attribute in inspect(obj).mapper.column_attrs}
+
+
+def _pending(session):
+    """Records of the innermost open savepoint, or of the transaction outside any savepoint"""
+    scopes = session.info.setdefault('audit_records', {})
+    return scopes.setdefault(session.get_nested_transaction(), [])
+
+
+def _enclosing_savepoint(transaction):
+    parent = transaction.parent
+    while parent is not None and not parent.nested:
+        parent = parent.parent
+    return parent
+
+
+def _collect(session, flush_context):
+    records = _pending(session)
+    for obj in session.new:
+        if isinstance(obj, AUDITED_MODELS):
+            records.append(_record(obj, 'insert', {
+                key: [None, value] for key, value in _column_values(obj).items() if value is not None
+            }))
+    for obj in session.dirty:
+        if isinstance(obj, AUDITED_MODELS):
+            changes = _column_changes(obj)
+            if changes:
+                records.append(_record(obj, 'update', changes))
+    for obj in session.deleted:
+        if isinstance(obj, AUDITED_MODELS):
+            records.append(_record(obj, 'delete', {
+                key: [value, None] for key, value in _column_values(obj).items() if value is not None
+            }))
+
+
+def _on_commit(session):
+    scopes = session.info.get('audit_records')
+    if not scopes:
+        return
+    savepoint = session.get_nested_transaction()
+    if savepoint is not None:
+        # A released savepoint's records now belong to whatever encloses it
+        records = scopes.pop(savepoint, None)
+        if records:
+            scopes.setdefault(_enclosing_savepoint(savepoint), []).extend(records)
+        return
+    session.info.pop('audit_records')
+    records = [record for scope_records in scopes.values() for record in scope_records]
+    if records:
+        writer.put(session.get_bind(mapper=inspect(AuditEntry)), records)
+
+
+def _on_rollback(session, previous_transaction):
+    if previous_transaction.nested:
+        # Only the savepoint's own records are rolled back; savepoints inside it were popped already
+        session.info.get('audit_records', {}).pop(previous_transaction, None)
+    else:
+        session.info.pop('audit_records', None)
+
+
+def audit_bulk_update(model, ids, changes):
+    """Audit rows changed with a bulk UPDATE, which session events do not see.
+
+    `changes` is {column: [before, after]}, as known from the statement's WHERE and SET.
+    """
+    if not current_app.config.get('AUDIT_LOG') or not ids:
+        return
+    user_id, actor = _actor()
+    records = _pending(db.session)
+    for row_id in ids:
+        records.append({
+            'occurred_at': datetime.utcnow(),
+            'site_code': current_site_code(),
+            'user_id': user_id,
+            'actor': actor,
+            'table_name': model.__tablename__,
+            'row_id': row_id,
+            'action': 'update',
+            'changes': {key: [_encode(before), _encode(after)] for key, (before, after) in changes.items()},
+        })
+
+
+def install_audit_log():
+    config = current_app.config
+    writer.queue = queue.Queue(maxsize=config['AUDIT_BUFFER_SIZE'])
+    writer.batch_size = config['AUDIT_BATCH_SIZE']
+    writer.flush_interval = config['AUDIT_FLUSH_INTERVAL']
+    event.listen(db.session, 'after_flush', _collect)
+    event.listen(db.session, 'after_commit', _on_commit)
+    # Unlike after_rollback, after_soft_rollback says which transaction or savepoint was rolled back
+    event.listen(db.session, 'after_soft_rollback', _on_rollback)
@@ -0,0 +1,288 @@
+"""Inpatient bed inventory and per-ward admission queues.
+
+Ward.occupied_beds is a counter maintained in the same transaction as every
+bed assignment and release, so occupancy summaries read one small row per
+ward instead of counting beds. Assignment is a conditional UPDATE that only
+succeeds while the bed is still free, which makes it safe for two transfers
+racing for the same bed on both SQLite and Postgres. None of these functions
+commit; the caller commits them together with its own changes.
+
+Patients who cannot get a bed wait in their ward's admission queue, ordered
+by clinical priority and then arrival. Arrival numbers come from the ward's
+queue_sequence, incremented under the ward row lock, and Ward.waiting_count
+is maintained like occupied_beds. When a bed is released it is offered to
+the head of that ward's queue straight away.
+"""
+import time
+from datetime import datetime
+
+from sqlalchemy import update
+
+from app import db
+from models import Ward, Bed, Disposition, AdmissionQueueEntry
+from services.sites import current_site_code
+
+# Occupancy summaries are polled by every open transfer screen; a short
+# per-process cache absorbs the polling without noticeably stale counts.
+# Keyed by site, since each site only sees its own wards
+OCCUPANCY_CACHE_SECONDS = 2.0
+_occupancy_cache = {}
+
+
+def invalidate_occupancy_cache():
+    _occupancy_cache.clear()
+
+
+def ward_occupancy():
+    """Per-ward bed counts, read from the maintained counters"""
+    now = time.monotonic()
+    site_code = current_site_code()
+    cached = _occupancy_cache.get(site_code)
+    if cached is not None and now < cached['expires']:
+        return cached['data']
+
+    data = [{
+        'id': ward.id,
+        'name': ward.name,
+        'code': ward.code,
+        'total_beds': ward.total_beds,
+        'occupied_beds': ward.occupied_beds,
+        'available_beds': ward.total_beds - ward.occupied_beds,
+        'waiting_count': ward.waiting_count,
+    } for ward in Ward.query.order_by(Ward.name)]
+
+    _occupancy_cache[site_code] = {'expires': now + OCCUPANCY_CACHE_SECONDS, 'data': data}
+    return data
+
+
+def ward_beds(ward_id):
+    return [{
+        'id': bed.id,
+        'label': bed.label,
+        'occupied': bed.is_occupied,
+    } for bed in Bed.query.filter_by(ward_id=ward_id).order_by(Bed.label)]
+
+
+def assign_bed(bed_id, patient_id):
+    """Claim a free bed for a patient; returns False if someone else got it first"""
+    result = db.session.execute(
+        update(Bed).where(
+            Bed.id == bed_id,
+            Bed.is_occupied == False  # noqa: E712
+        ).values(
+            is_occupied=True,
+            patient_id=patient_id,
+            occupied_at=datetime.utcnow()
+        ).execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return False
+
+    ward_id = db.session.query(Bed.ward_id).filter(Bed.id == bed_id).scalar()
+    db.session.execute(
+        update(Ward).where(Ward.id == ward_id).values(
+            occupied_beds=Ward.occupied_beds + 1
+        ).execution_options(synchronize_session=False)
+    )
+    invalidate_occupancy_cache()
+    return True
+
+
+def release_bed(bed_id, patient_id=None):
+    """Free an occupied bed; returns False if it was already free.
+
+    With `patient_id`, the bed is only freed while that patient still holds it,
+    so a stale reference can never free a bed that has since gone to the next
+    patient. The disposition that held the bed no longer refers to it.
+    """
+    holder = [Bed.id == bed_id, Bed.is_occupied == True]  # noqa: E712
+    if patient_id is not None:
+        holder.append(Bed.patient_id == patient_id)
+    result = db.session.execute(
+        update(Bed).where(*holder).values(
+            is_occupied=False,
+            patient_id=None,
+            occupied_at=None
+        ).execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        return False
+
+    holding = [Disposition.bed_id == bed_id]
+    if patient_id is not None:
+        holding.append(Disposition.patient_id == patient_id)
+    db.session.execute(update(Disposition).where(*holding).values(bed_id=None, bed_number=None))
+
+    ward_id = db.session.query(Bed.ward_id).filter(Bed.id == bed_id).scalar()
+    db.session.execute(
+        update(Ward).where(Ward.id == ward_id).values(
+            occupied_beds=Ward.occupied_beds - 1
+        ).execution_options(synchronize_session=False)
+    )
+    invalidate_occupancy_cache()
+    offer_bed_to_queue(ward_id, bed_id)
+    return True
+
+
+def withdraw_from_admission(disposition):
+    """Take a disposition out of its ward queue and give back any bed it holds.
+
+    The queue entries are cancelled first, so the freed bed is offered to the
+    next patient in line rather than back to this one.
+    """
+    cancel_queue_entries(disposition.id)
+    if disposition.bed_id:
+        release_bed(disposition.bed_id, disposition.patient_id)
+        disposition.bed_id = None
+        disposition.bed_number = None
+    disposition.is_bed_available = False
+
+
+def create_ward(name, code, bed_count):
+    """Create a ward with `bed_count` free beds labelled CODE-01, CODE-02, ..."""
+    ward = Ward(name=name, code=code, total_beds=bed_count, occupied_beds=0)
+    db.session.add(ward)
+    db.session.flush()
+    db.session.add_all([
+        Bed(ward_id=ward.id, label=f"{code}-{number:02d}", is_occupied=False)
+        for number in range(1, bed_count + 1)
+    ])
+    invalidate_occupancy_cache()
+    return ward
+
+
+# --- Admission queue ---
+
+def _change_waiting_count(ward_id, delta):
+    db.session.execute(
+        update(Ward).where(Ward.id == ward_id).values(
+            waiting_count=Ward.waiting_count + delta
+        ).execution_options(synchronize_session=False)
+    )
+    invalidate_occupancy_cache()
+
+
+def _queue_order():
+    return AdmissionQueueEntry.priority, AdmissionQueueEntry.sequence
+
+
+def queue_head(ward_id):
+    """Next patient in line for a ward (an index seek, not a scan)"""
+    return AdmissionQueueEntry.query.filter_by(
+        ward_id=ward_id, status='waiting'
+    ).order_by(*_queue_order()).first()
+
+
+def ward_queue(ward_id, limit=50):
+    return AdmissionQueueEntry.query.filter_by(
+        ward_id=ward_id, status='waiting'
+    ).order_by(*_queue_order()).limit(limit).all()
+
+
+def queue_position(entry):
+    """1-based place of a waiting entry in its ward's queue"""
+    ahead = AdmissionQueueEntry.query.filter(
+        AdmissionQueueEntry.ward_id == entry.ward_id,
+        AdmissionQueueEntry.status == 'waiting',
+        db.or_(
+            AdmissionQueueEntry.priority < entry.priority,
+            db.and_(AdmissionQueueEntry.priority == entry.priority,
+                    AdmissionQueueEntry.sequence < entry.sequence)
+        )
+    ).count()
+    return ahead + 1
+
+
+def waiting_entry(disposition_id):
+    return AdmissionQueueEntry.query.filter_by(disposition_id=disposition_id, status='waiting').first()
+
+
+def cancel_queue_entries(disposition_id):
+    """Take a disposition out of any queue it is waiting in"""
+    for entry in AdmissionQueueEntry.query.filter_by(disposition_id=disposition_id, status='waiting'):
+        result = db.session.execute(
+            update(AdmissionQueueEntry).where(
+                AdmissionQueueEntry.id == entry.id,
+                AdmissionQueueEntry.status == 'waiting'
+            ).values(
+                status='cancelled',
+                resolved_at=datetime.utcnow()
+            ).execution_options(synchronize_session=False)
+        )
+        if result.rowcount == 1:
+            _change_waiting_count(entry.ward_id, -1)
+
+
+def enqueue(disposition, ward_id, priority):
+    """Put a disposition in a ward's admission queue, replacing any earlier entry"""
+    cancel_queue_entries(disposition.id)
+
+    # Incrementing the sequence locks the ward row until commit, so concurrent
+    # enqueues for the same ward are serialized and never share a number
+    db.session.execute(
+        update(Ward).where(Ward.id == ward_id).values(
+            queue_sequence=Ward.queue_sequence + 1,
+            waiting_count=Ward.waiting_count + 1
+        ).execution_options(synchronize_session=False)
+    )
+    sequence = db.session.query(Ward.queue_sequence).filter(Ward.id == ward_id).scalar()
+    invalidate_occupancy_cache()
+
+    entry = AdmissionQueueEntry(
+        ward_id=ward_id,
+        disposition_id=disposition.id,
+        patient_id=disposition.patient_id,
+        priority=priority,
+        sequence=sequence,
+        status='waiting'
+    )
+    db.session.add(entry)
+    db.session.flush()
+    return entry
+
+
+def offer_bed_to_queue(ward_id, bed_id):
+    """Reserve a just-released bed for the head of the ward's queue.
+
+    The bed is assigned to the patient and recorded on their disposition;
+    the transfer is completed by staff from the inpatient transfer page.
+    """
+    entry = queue_head(ward_id)
+    while entry:
+        claimed = db.session.execute(
+            update(AdmissionQueueEntry).where(
+                AdmissionQueueEntry.id == entry.id,
+                AdmissionQueueEntry.status == 'waiting'
+            ).values(
+                status='offered',
+                offered_bed_id=bed_id,
+                resolved_at=datetime.utcnow()
+            ).execution_options(synchronize_session=False)
+        )
+        if claimed.rowcount == 1:
+            break
+        # Someone else dequeued this entry concurrently; try the next one
+        entry = queue_head(ward_id)
+
+    if not entry:
+        return None
+
+    if not assign_bed(bed_id, entry.patient_id):
+        # The bed was taken in the meantime; the patient keeps their place in the queue
+        db.session.execute(
+            update(AdmissionQueueEntry).where(AdmissionQueueEntry.id == entry.id).values(
+                status='waiting',
+                offered_bed_id=None,
+                resolved_at=None
+            ).execution_options(synchronize_session=False)
+        )
+        return None
+    _change_waiting_count(ward_id, -1)
+
+    bed = db.session.get(Bed, bed_id)
+    disposition = db.session.get(Disposition, entry.disposition_id)
+    disposition.destination_ward = bed.ward.name
+    disposition.bed_id = bed.id
+    disposition.bed_number = bed.label
+    disposition.is_bed_available = True
+    return entry
@@ -0,0 +1,158 @@
+"""Clinician identity on examinations, orders and dispositions.
+
+Who examined a patient, requested a test, prescribed or dispensed a drug,
+or authorised a disposition used to be stored only as typed names. Names
+like "Dr. Sari", "dr sari" and "Sari" then split one clinician's counts,
+and workload statistics grouped on an unindexed varchar. Each of these
+rows now also stores the User id of the clinician (doctor_id,
+requested_by_id, prescribed_by_id, dispensed_by_id, authorized_by_id).
+Forms choose the clinician from the staff list, and the name column keeps
+the display name at the time of writing. Statistics group on the indexed
+integer column.
+
+Rows written before the id columns existed are resolved by
+backfill_clinician_ids(), which runs when the columns are added to an
+existing database (services/migrations.py) and from backfill_clinicians.py. Names are normalized
+(titles such as "Dr." and credentials such as "MD" removed, case and
+punctuation ignored) and matched against the full names and usernames of
+staff accounts. Names that match no account, or more than one, are left
+unresolved and reported. With create_missing=True they get a staff account
+with the column's role and a random password, to be taken over by the
+clinician through a password reset.
+"""
+import re
+import secrets
+
+from flask_login import current_user
+
+from app import db
+from models import User, DoctorExamination, LabRequest, Prescription, Disposition
+
+# (model, name column, id column, role for accounts created by the backfill)
+CLINICIAN_COLUMNS = [
+    (DoctorExamination, 'doctor_name', 'doctor_id', 'doctor'),
+    (LabRequest, 'requested_by', 'requested_by_id', 'doctor'),
+    (Prescription, 'prescribed_by', 'prescribed_by_id', 'doctor'),
+    (Prescription, 'dispensed_by', 'dispensed_by_id', 'pharmacist'),
+    (Disposition, 'authorized_by', 'authorized_by_id', 'doctor'),
+]
+
+TITLES = {'dr', 'doctor', 'prof', 'professor', 'ns', 'nurse', 'apt', 'mr', 'mrs', 'ms'}
+CREDENTIALS = {'md', 'do', 'rn', 'np', 'pa', 'phd', 'pharmd', 'mbbs', 'sp', 'spb', 'spem', 'sppd', 'spa', 'spog'}
+
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize_clinician_name(name):
+    words = _NON_WORD.sub(' ', name or '').casefold().split()
+    while words and words[0] in TITLES:
+        words.pop(0)
+    while words and words[-1] in CREDENTIALS:
+        words.pop()
+    return ' '.join(words)
+
+
+def clinicians():
+    """Staff accounts to choose from on clinical forms"""
+    return User.query.order_by(User.full_name).all()
+
+
+def selected_clinician(user_id):
+    """The staff account chosen on a form, or the signed-in user when none was chosen"""
+    clinician = db.session.get(User, user_id) if user_id else None
+    return clinician or current_user
+
+
+class ClinicianNames:
+    """Normalized full names and usernames of staff accounts, mapped to their ids"""
+
+    def __init__(self):
+        self.ids = {}
+        self.ambiguous = set()
+        for user in User.query.execution_options(all_sites=True):
+            for name in {normalize_clinician_name(user.full_name), normalize_clinician_name(user.username)}:
+                self.add(name, user.id)
+
+    def add(self, name, user_id):
+        if not name or name in self.ambiguous:
+            return
+        if self.ids.setdefault(name, user_id) != user_id:
+            # Two accounts share the name; guessing would credit the wrong clinician
+            del self.ids[name]
+            self.ambiguous.add(name)
+
+    def resolve(self, name):
+        return self.ids.get(normalize_clinician_name(name))
+
+
+def create_clinician(full_name, role):
+    """Staff account for a clinician known only by name; the caller commits"""
+    base = normalize_clinician_name(full_name).replace(' ', '.') or 'clinician'
+    username = base
+    suffix = 1
+    while User.query.filter_by(username=username).execution_options(all_sites=True).first() is not None:
+        suffix += 1
+        username = f"{base}{suffix}"
+    user = User(
+        username=username,
+        email=f"{username}@clinicians.invalid",
+        full_name=full_name.strip(),
+        role=role
+    )
+    user.set_password(secrets.token_urlsafe(32))
+    db.session.add(user)
+    db.session.flush()
+    return user
+
+
+def backfill_clinician_ids(create_missing=False):
+    """Resolve the clinician id of rows that only have a name; returns (rows updated, unresolved names)"""
+    names = ClinicianNames()
+    updated = 0
+    unresolved = set()
+    for model, name_column, id_column, role in CLINICIAN_COLUMNS:
+        name_attribute = getattr(model, name_column)
+        id_attribute = getattr(model, id_column)
+        pending = db.session.query(name_attribute).filter(
+            id_attribute.is_(None), name_attribute.isnot(None)
+        ).distinct().execution_options(all_sites=True).all()
+
+        # Group the spellings of each clinician, so each gets one UPDATE
+        spellings = {}
+        for (name,) in pending:
+            user_id = names.resolve(name)
+            if user_id is None and create_missing and normalize_clinician_name(name) not in names.ambiguous:
+                user_id = create_clinician(name, role).id
+                names.add(normalize_clinician_name(name), user_id)
+            if user_id is None:
+                unresolved.add(name)
+                continue
+            spellings.setdefault(user_id, []).append(name)
+
+        for user_id, variants in spellings.items():
+            updated += model.query.filter(
+                id_attribute.is_(None), name_attribute.in_(variants)
+            ).execution_options(all_sites=True).update({id_column: user_id}, synchronize_session=False)
+        db.session.commit()
+    return updated, sorted(unresolved)
+
+
+def doctor_workload(limit=10):
+    """Examinations per doctor, busiest first, as rows of (doctor_id, doctor_name, patient_count)"""
+    counts = db.session.query(
+        DoctorExamination.doctor_id,
+        db.func.count(DoctorExamination.id).label('patient_count')
+    ).filter(
+        DoctorExamination.doctor_id.isnot(None)
+    ).group_by(
+        DoctorExamination.doctor_id
+    ).subquery()
+    return db.session.query(
+        counts.c.doctor_id,
+        User.full_name.label('doctor_name'),
+        counts.c.patient_count
+    ).join(
+        User, User.id == counts.c.doctor_id
+    ).order_by(
+        counts.c.patient_count.desc(), User.full_name
+    ).limit(limit).all()
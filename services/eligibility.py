@@ -0,0 +1,305 @@
+"""Insurance eligibility checks against remote payer services.
+
+Payer checks are slow remote calls, so they never run on a request thread:
+
+* checks run on a small thread pool (ELIGIBILITY_WORKERS). The same
+  insurance number is never in flight twice; a second caller shares the
+  first caller's future;
+* each payer has a pool of keep-alive HTTP connections, so a check costs
+  one round trip rather than a new TCP (and TLS) handshake;
+* each payer has its own timeout and circuit breaker. After
+  `failure_threshold` consecutive failures, the payer is skipped for
+  `reset_after` seconds. Checks then answer 'unavailable' at once instead of
+  tying up threads on a service that is down. One trial check afterwards
+  decides whether it is back;
+* answers are kept in a TTL cache keyed by payer and insurance number
+  (ELIGIBILITY_CACHE_TTL). Revisits and repeated page loads cost nothing.
+
+Views call check_eligibility(), which waits briefly (ELIGIBILITY_WAIT) and
+otherwise reports 'pending'. The browser polls until the answer is cached.
+
+Payers are configured in ELIGIBILITY_PAYERS as a JSON object keyed by
+insurance type:
+
+    {"National Health Insurance": {"url": "http://payer:8089/eligibility",
+                                   "timeout": 3, "failure_threshold": 5, "reset_after": 30}}
+
+A payer receives POST {"member_id": ..., "service_date": "YYYY-MM-DD"}. It
+answers 200 with {"eligible": bool, "plan": ..., "coverage_end": ..., "message": ...},
+or 404 for an unknown member. eligibility_stub.py implements this
+protocol for development and testing.
+"""
+import http.client
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from datetime import date, datetime
+from urllib.parse import urlparse
+
+from flask import current_app
+
+DEFAULT_PAYER = {'timeout': 5.0, 'failure_threshold': 5, 'reset_after': 30.0}
+
+
+class PayerUnavailable(Exception):
+    """Raised when a payer cannot be reached or gives an unusable answer"""
+
+
+def parse_payers(value):
+    """Parse ELIGIBILITY_PAYERS (JSON) into {insurance type: payer settings}"""
+    if not value.strip():
+        return {}
+    return {name: {**DEFAULT_PAYER, **settings} for name, settings in json.loads(value).items()}
+
+
+class ConnectionPool:
+    """Keep-alive HTTP(S) connections to one host, reused LIFO"""
+
+    def __init__(self, url, max_size, timeout):
+        parsed = urlparse(url)
+        self.connection_class = http.client.HTTPSConnection if parsed.scheme == 'https' else http.client.HTTPConnection
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = parsed.path or '/'
+        self.timeout = timeout
+        self.idle = queue.LifoQueue(maxsize=max_size)
+        self.stats = {'created': 0, 'reused': 0}
+
+    def _get(self):
+        try:
+            connection = self.idle.get_nowait()
+            self.stats['reused'] += 1
+            return connection, True
+        except queue.Empty:
+            self.stats['created'] += 1
+            return self.connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def _put(self, connection):
+        try:
+            self.idle.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def post_json(self, payload):
+        """POST `payload` as JSON; returns (status, decoded body or None)"""
+        body = json.dumps(payload).encode('utf-8')
+        headers = {'Content-Type': 'application/json', 'Accept': 'application/json', 'Connection': 'keep-alive'}
+        while True:
+            connection, reused = self._get()
+            try:
+                connection.request('POST', self.path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                connection.close()
+                if reused:
+                    # The server closed an idle connection; retry on a fresh one
+                    continue
+                raise
+            except Exception:
+                connection.close()
+                raise
+            if response.will_close:
+                connection.close()
+            else:
+                self._put(connection)
+            try:
+                return response.status, json.loads(data) if data else None
+            except ValueError:
+                return response.status, None
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold, reset_after):
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        self.failures = 0
+        self.opened_at = None
+        self.trial_running = False
+        self.lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        return 'half-open' if time.monotonic() - self.opened_at >= self.reset_after else 'open'
+
+    def allow(self):
+        with self.lock:
+            state = self.state
+            if state == 'closed':
+                return True
+            if state == 'half-open' and not self.trial_running:
+                self.trial_running = True
+                return True
+            return False
+
+    def record(self, success):
+        with self.lock:
+            self.trial_running = False
+            if success:
+                self.failures = 0
+                self.opened_at = None
+            else:
+                self.failures += 1
+                if self.opened_at is not None or self.failures >= self.failure_threshold:
+                    self.opened_at = time.monotonic()
+
+
+class TTLCache:
+    def __init__(self, ttl, max_entries=10000):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class EligibilityChecker:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pid = None
+        self.payers = {}
+        self.executor = None
+        self.pools = {}
+        self.breakers = {}
+        self.cache = None
+        self.in_flight = {}
+        self.stats = {'checks': 0, 'cache_hits': 0, 'short_circuited': 0, 'failures': 0}
+
+    def _configure(self, config):
+        # Threads and sockets do not survive fork, so each worker process builds its own
+        if self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.pid != os.getpid():
+                self.payers = config['ELIGIBILITY_PAYERS']
+                workers = config['ELIGIBILITY_WORKERS']
+                self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='eligibility')
+                self.pools = {
+                    name: ConnectionPool(payer['url'], workers, payer['timeout']) for name, payer in self.payers.items()
+                }
+                self.breakers = {
+                    name: CircuitBreaker(payer['failure_threshold'], payer['reset_after'])
+                    for name, payer in self.payers.items()
+                }
+                self.cache = TTLCache(config['ELIGIBILITY_CACHE_TTL'])
+                self.in_flight = {}
+                self.pid = os.getpid()
+
+    def _check(self, payer_name, insurance_number, service_date):
+        """Ask the payer (on a pool thread); returns the result dict"""
+        breaker = self.breakers[payer_name]
+        if not breaker.allow():
+            self.stats['short_circuited'] += 1
+            return _result('unavailable', payer_name, message="Payer service is unavailable; try again shortly")
+
+        self.stats['checks'] += 1
+        try:
+            status, body = self.pools[payer_name].post_json({
+                'member_id': insurance_number,
+                'service_date': service_date.isoformat(),
+            })
+            if status == 404:
+                result = _result('ineligible', payer_name, message=(body or {}).get('message', "Member not found"))
+            elif status == 200 and isinstance(body, dict) and 'eligible' in body:
+                result = _result(
+                    'eligible' if body['eligible'] else 'ineligible', payer_name,
+                    plan=body.get('plan'), coverage_end=body.get('coverage_end'), message=body.get('message')
+                )
+            else:
+                raise PayerUnavailable(f"Unexpected answer from payer (HTTP {status})")
+        except Exception as e:
+            breaker.record(False)
+            self.stats['failures'] += 1
+            logging.warning("Eligibility check with %s failed: %s", payer_name, e)
+            return _result('unavailable', payer_name, message=f"Payer did not answer: {e}")
+
+        breaker.record(True)
+        self.cache.set((payer_name, insurance_number), result)
+        return result
+
+    def _finished(self, key, future):
+        with self.lock:
+            if self.in_flight.get(key) is future:
+                del self.in_flight[key]
+
+    def submit(self, payer_name, insurance_number, service_date=None):
+        """Start a check unless the answer is cached or one is already running; returns a future or the result"""
+        key = (payer_name, insurance_number)
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.stats['cache_hits'] += 1
+            return cached
+        with self.lock:
+            future = self.in_flight.get(key)
+            if future is None:
+                future = self.executor.submit(self._check, payer_name, insurance_number, service_date or date.today())
+                self.in_flight[key] = future
+                future.add_done_callback(lambda done: self._finished(key, done))
+        return future
+
+    def check(self, insurance_type, insurance_number, wait=0.0):
+        """Eligibility of a member: the answer if known within `wait` seconds, otherwise 'pending'"""
+        self._configure(current_app.config)
+        if insurance_type not in self.payers or not insurance_number:
+            return _result('unsupported', insurance_type, message="No electronic eligibility check for this insurance")
+
+        outcome = self.submit(insurance_type, insurance_number)
+        if isinstance(outcome, dict):
+            return outcome
+        try:
+            return outcome.result(timeout=wait)
+        except FutureTimeout:
+            return _result('pending', insurance_type, message="Waiting for the payer")
+
+    def snapshot(self):
+        return {
+            **self.stats,
+            'in_flight': len(self.in_flight),
+            'payers': {
+                name: {'circuit': self.breakers[name].state, **self.pools[name].stats} for name in self.payers
+            },
+        }
+
+
+def _result(status, payer, plan=None, coverage_end=None, message=None):
+    return {
+        'status': status,
+        'payer': payer,
+        'plan': plan,
+        'coverage_end': coverage_end,
+        'message': message,
+        'checked_at': datetime.utcnow().isoformat(timespec='seconds'),
+    }
+
+
+checker = EligibilityChecker()
+
+
+def check_eligibility(insurance_type, insurance_number, wait=None):
+    if wait is None:
+        wait = current_app.config['ELIGIBILITY_WAIT']
+    return checker.check(insurance_type, (insurance_number or '').strip(), wait)
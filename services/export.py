@@ -0,0 +1,459 @@
+"""Bulk data export for offline analysis and downstream consumers.
+
+Columnar export: each Patient row is one ER encounter. The export walks
+patients in (created_at, id) order with a streaming cursor, joins the
+encounter tables into one flat row and writes month-partitioned Parquet or
+Arrow IPC files. Progress is recorded in a watermark file so an interrupted
+run resumes where it stopped instead of starting over.
+
+Flat export: CSV/NDJSON generators over a query, fetched with yield_per and
+optionally gzip-compressed as they are produced.
+"""
+import csv
+import io
+import json
+import logging
+import os
+import zlib
+from datetime import date, datetime
+
+from sqlalchemy import and_, func, or_
+
+from app import db
+from models import Patient, Triage, NurseAssessment, DoctorExamination, LabRequest, Prescription, Disposition, ExternalLabResult
+
+DEFAULT_CHUNK_SIZE = 5000
+WATERMARK_FILE = '_watermark.json'
+
+# (column name, arrow type name) for the denormalized encounter row
+ENCOUNTER_COLUMNS = [
+    ('patient_id', 'int64'),
+    ('medical_record_number', 'string'),
+    ('gender', 'string'),
+    ('date_of_birth', 'date32'),
+    ('arrival_mode', 'string'),
+    ('referral_source', 'string'),
+    ('insurance_type', 'string'),
+    ('registered_at', 'timestamp'),
+    ('triage_category', 'string'),
+    ('triage_reason', 'string'),
+    ('triaged_at', 'timestamp'),
+    ('chief_complaint', 'string'),
+    ('assessed_at', 'timestamp'),
+    ('diagnosis', 'string'),
+    ('treatment_plan', 'string'),
+    ('doctor_name', 'string'),
+    ('examined_at', 'timestamp'),
+    ('lab_request_count', 'int64'),
+    ('prescription_count', 'int64'),
+    ('disposition_type', 'string'),
+    ('destination_ward', 'string'),
+    ('disposition_completed', 'bool'),
+    ('disposition_completed_at', 'timestamp'),
+]
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError:
+        raise RuntimeError("pyarrow is required for columnar export (pip install pyarrow)")
+    return pyarrow
+
+
+def encounter_schema():
+    """Build the Arrow schema for the denormalized encounter row"""
+    pa = _require_pyarrow()
+    types = {
+        'int64': pa.int64(),
+        'string': pa.string(),
+        'date32': pa.date32(),
+        'bool': pa.bool_(),
+        'timestamp': pa.timestamp('us'),
+    }
+    return pa.schema([(name, types[type_name]) for name, type_name in ENCOUNTER_COLUMNS])
+
+
+def encounter_query(since=None, until=None):
+    """Query returning one flat tuple per encounter, ordered for keyset resumption.
+
+    `since` is a (created_at, patient_id) watermark; rows at or before it are skipped.
+    """
+    lab_count = db.session.query(func.count(LabRequest.id)).filter(
+        LabRequest.patient_id == Patient.id
+    ).correlate(Patient).scalar_subquery()
+    prescription_count = db.session.query(func.count(Prescription.id)).filter(
+        Prescription.patient_id == Patient.id
+    ).correlate(Patient).scalar_subquery()
+
+    query = db.session.query(
+        Patient.id,
+        Patient.medical_record_number,
+        Patient.gender,
+        Patient.date_of_birth,
+        Patient.arrival_mode,
+        Patient.referral_source,
+        Patient.insurance_type,
+        Patient.created_at,
+        Triage.category,
+        Triage.reason,
+        Triage.triaged_at,
+        NurseAssessment.chief_complaint,
+        NurseAssessment.created_at,
+        DoctorExamination.assessment,
+        DoctorExamination.plan,
+        DoctorExamination.doctor_name,
+        DoctorExamination.created_at,
+        lab_count,
+        prescription_count,
+        Disposition.disposition_type,
+        Disposition.destination_ward,
+        Disposition.is_completed,
+        Disposition.completed_at,
+    ).outerjoin(
+        Triage, Triage.patient_id == Patient.id
+    ).outerjoin(
+        NurseAssessment, NurseAssessment.patient_id == Patient.id
+    ).outerjoin(
+        DoctorExamination, DoctorExamination.patient_id == Patient.id
+    ).outerjoin(
+        Disposition, Disposition.patient_id == Patient.id
+    )
+
+    if since:
+        since_at, since_id = since
+        query = query.filter(or_(
+            Patient.created_at > since_at,
+            and_(Patient.created_at == since_at, Patient.id > since_id)
+        ))
+    if until:
+        query = query.filter(Patient.created_at < until)
+
+    return query.order_by(Patient.created_at, Patient.id)
+
+
+def iter_encounter_chunks(since=None, until=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Yield lists of at most `chunk_size` encounter tuples using a server-side cursor"""
+    query = encounter_query(since, until).execution_options(stream_results=True).yield_per(chunk_size)
+    chunk = []
+    for row in query:
+        chunk.append(tuple(row))
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def rows_to_batch(rows, schema):
+    """Convert encounter tuples into an Arrow record batch"""
+    pa = _require_pyarrow()
+    columns = list(zip(*rows)) if rows else [[] for _ in ENCOUNTER_COLUMNS]
+    arrays = [pa.array(list(values), type=field.type) for values, field in zip(columns, schema)]
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def load_watermark(output_dir):
+    path = os.path.join(output_dir, WATERMARK_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        data = json.load(f)
+    return datetime.fromisoformat(data['created_at']), data['patient_id']
+
+
+def save_watermark(output_dir, created_at, patient_id):
+    path = os.path.join(output_dir, WATERMARK_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'created_at': created_at.isoformat(), 'patient_id': patient_id}, f)
+    os.replace(tmp_path, path)
+
+
+class _PartitionWriter:
+    """Writes one month partition to a temporary file and publishes it on close"""
+
+    def __init__(self, output_dir, month, schema, file_format, run_id):
+        pa = _require_pyarrow()
+        extension = 'parquet' if file_format == 'parquet' else 'arrow'
+        partition_dir = os.path.join(output_dir, f"month={month}")
+        os.makedirs(partition_dir, exist_ok=True)
+        self.path = os.path.join(partition_dir, f"part-{run_id}.{extension}")
+        self.tmp_path = self.path + '.tmp'
+        if file_format == 'parquet':
+            self.writer = pa.parquet.ParquetWriter(self.tmp_path, schema, compression='zstd')
+        else:
+            self.writer = pa.ipc.new_file(self.tmp_path, schema)
+
+    def write(self, batch):
+        self.writer.write_batch(batch)
+
+    def close(self):
+        self.writer.close()
+        os.replace(self.tmp_path, self.path)
+
+
+def _clear_incomplete_files(output_dir):
+    for root, _, files in os.walk(output_dir):
+        for name in files:
+            if name.endswith('.tmp'):
+                os.remove(os.path.join(root, name))
+
+
+def export_encounters(output_dir, file_format='parquet', until=None, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Export encounters newer than the stored watermark into month partitions.
+
+    Only one partition file is open at a time because rows arrive in
+    created_at order, so memory stays bounded by `chunk_size`. The watermark
+    only advances after a partition file is published, so a crash re-exports
+    at most the partition that was being written.
+    """
+    if file_format not in ('parquet', 'arrow'):
+        raise ValueError(f"Unsupported export format: {file_format}")
+
+    schema = encounter_schema()
+    os.makedirs(output_dir, exist_ok=True)
+    _clear_incomplete_files(output_dir)
+
+    since = load_watermark(output_dir)
+    run_id = datetime.utcnow().strftime('%Y%m%d%H%M%S')
+    writer = None
+    current_month = None
+    last_row = None
+    total = 0
+
+    try:
+        for chunk in iter_encounter_chunks(since, until, chunk_size):
+            # Split the chunk on month boundaries
+            start = 0
+            while start < len(chunk):
+                month = chunk[start][7].strftime('%Y-%m')
+                end = start
+                while end < len(chunk) and chunk[end][7].strftime('%Y-%m') == month:
+                    end += 1
+
+                if month != current_month:
+                    if writer:
+                        writer.close()
+                        save_watermark(output_dir, last_row[7], last_row[0])
+                    writer = _PartitionWriter(output_dir, month, schema, file_format, run_id)
+                    current_month = month
+
+                writer.write(rows_to_batch(chunk[start:end], schema))
+                last_row = chunk[end - 1]
+                total += end - start
+                start = end
+
+        if writer:
+            writer.close()
+            save_watermark(output_dir, last_row[7], last_row[0])
+    finally:
+        db.session.rollback()
+
+    logging.info("Exported %d encounters to %s", total, output_dir)
+    return total
+
+
+class _DrainableBuffer:
+    """Minimal writable file object whose contents can be taken incrementally"""
+
+    closed = False
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data):
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def stream_encounters_ipc(month, chunk_size=DEFAULT_CHUNK_SIZE):
+    """Generate an Arrow IPC stream of one month's encounters, chunk by chunk"""
+    pa = _require_pyarrow()
+    schema = encounter_schema()
+    start = datetime.strptime(month, '%Y-%m')
+    end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+    buffer = _DrainableBuffer()
+    writer = pa.ipc.new_stream(buffer, schema)
+    try:
+        yield buffer.drain()
+        for chunk in iter_encounter_chunks((start, 0), end, chunk_size):
+            writer.write_batch(rows_to_batch(chunk, schema))
+            yield buffer.drain()
+        writer.close()
+        yield buffer.drain()
+    finally:
+        db.session.rollback()
+
+
+# --- Flat CSV / NDJSON export ---
+
+FLAT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value)
+
+
+def iter_flat_export(query, columns, file_format, chunk_size=1000):
+    """Yield an export of `query` as CSV or NDJSON text, one chunk of rows at a time.
+
+    The header (or nothing, for NDJSON) is yielded before the query runs so the
+    client gets its first byte immediately; rows are then fetched with yield_per
+    so only `chunk_size` rows are held in memory.
+    """
+    if file_format not in FLAT_FORMATS:
+        raise ValueError(f"Unsupported export format: {file_format}")
+
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if file_format == 'csv' else None
+
+    def take():
+        data = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return data
+
+    if writer:
+        writer.writerow(columns)
+    yield take()
+
+    pending = 0
+    try:
+        for row in query.execution_options(stream_results=True).yield_per(chunk_size):
+            if writer:
+                writer.writerow(['' if value is None else
+                                 value.isoformat() if isinstance(value, (datetime, date)) else value
+                                 for value in row])
+            else:
+                buffer.write(json.dumps(dict(zip(columns, row)), default=_json_default))
+                buffer.write('\n')
+            pending += 1
+            if pending >= chunk_size:
+                yield take()
+                pending = 0
+        if pending:
+            yield take()
+    finally:
+        db.session.rollback()
+
+
+def gzip_stream(chunks):
+    """Compress a stream of text chunks with gzip as they are produced"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        # Sync flush keeps each chunk decodable on arrival instead of buffering
+        data += compressor.flush(zlib.Z_SYNC_FLUSH)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def registrations_query(start, end, arrival_mode=None):
+    """Patients registered in [start, end), for the registrations export"""
+    query = db.session.query(
+        Patient.id,
+        Patient.medical_record_number,
+        Patient.first_name,
+        Patient.last_name,
+        Patient.date_of_birth,
+        Patient.gender,
+        Patient.arrival_mode,
+        Patient.referral_source,
+        Patient.insurance_type,
+        Patient.insurance_number,
+        Patient.created_at,
+    ).filter(
+        Patient.created_at >= start,
+        Patient.created_at < end
+    )
+    if arrival_mode:
+        query = query.filter(Patient.arrival_mode == arrival_mode)
+    return query.order_by(Patient.created_at, Patient.id)
+
+
+REGISTRATION_COLUMNS = [
+    'patient_id', 'medical_record_number', 'first_name', 'last_name', 'date_of_birth', 'gender',
+    'arrival_mode', 'referral_source', 'insurance_type', 'insurance_number', 'registered_at',
+]
+
+
+def pending_results_query(test_type=None, patient_mrn=None, start=None, end=None):
+    """External lab results not yet matched to a lab request"""
+    query = db.session.query(
+        ExternalLabResult.id,
+        ExternalLabResult.external_system_id,
+        ExternalLabResult.patient_mrn,
+        ExternalLabResult.test_type,
+        ExternalLabResult.test_name,
+        ExternalLabResult.result,
+        ExternalLabResult.result_date,
+    ).filter(ExternalLabResult.is_imported == False)  # noqa: E712
+    if test_type:
+        query = query.filter(ExternalLabResult.test_type == test_type)
+    if patient_mrn:
+        query = query.filter(ExternalLabResult.patient_mrn == patient_mrn)
+    if start:
+        query = query.filter(ExternalLabResult.result_date >= start)
+    if end:
+        query = query.filter(ExternalLabResult.result_date < end)
+    return query.order_by(ExternalLabResult.result_date, ExternalLabResult.id)
+
+
+PENDING_RESULT_COLUMNS = [
+    'id', 'external_system_id', 'patient_mrn', 'test_type', 'test_name', 'result', 'result_date',
+]
+
+
+def dispensing_log_query(start, end, patient_id=None, dispensed=None):
+    """Prescriptions written in [start, end) with their dispensing status"""
+    query = db.session.query(
+        Prescription.id,
+        Prescription.patient_id,
+        Patient.medical_record_number,
+        Prescription.medication_name,
+        Prescription.dosage,
+        Prescription.route,
+        Prescription.frequency,
+        Prescription.prescribed_by,
+        Prescription.prescribed_at,
+        Prescription.is_dispensed,
+        Prescription.dispensed_by,
+        Prescription.dispensed_at,
+    ).join(
+        Patient, Patient.id == Prescription.patient_id
+    ).filter(
+        Prescription.prescribed_at >= start,
+        Prescription.prescribed_at < end
+    )
+    if patient_id:
+        query = query.filter(Prescription.patient_id == patient_id)
+    if dispensed is not None:
+        query = query.filter(Prescription.is_dispensed == dispensed)
+    return query.order_by(Prescription.prescribed_at, Prescription.id)
+
+
+DISPENSING_LOG_COLUMNS = [
+    'prescription_id', 'patient_id', 'medical_record_number', 'medication_name', 'dosage', 'route',
+    'frequency', 'prescribed_by', 'prescribed_at', 'is_dispensed', 'dispensed_by', 'dispensed_at',
+]
@@ -0,0 +1,131 @@
+"""Template caching for the busy clinical boards.
+
+Two layers:
+
+* a Jinja bytecode cache on disk (JINJA_CACHE_DIR), so a freshly started
+  worker loads compiled templates instead of parsing and compiling them;
+  precompile_templates.py fills it at deploy time;
+* a {% cache %} tag that stores a rendered fragment in a per-process LRU,
+  keyed on the values passed to it:
+
+      {% cache 'patient-row', patient.id, patient.updated_at %} ... {% endcache %}
+
+  Keys should include the entity's version, so a changed row simply misses
+  and is rendered again; nothing needs to be invalidated. Keys are also
+  scoped to the request's site, since row ids repeat across site shards.
+
+Patient.updated_at serves as the version of a whole encounter. It is
+bumped whenever the patient or any of their encounter rows is written.
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from itertools import chain
+
+from flask import g
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+from sqlalchemy import event
+
+from app import db
+from models import Patient, Triage, NurseAssessment, DoctorExamination, LabRequest, Prescription, Disposition
+
+ENCOUNTER_MODELS = (Triage, NurseAssessment, DoctorExamination, LabRequest, Prescription, Disposition)
+
+
+class FragmentCache:
+    """Thread-safe LRU of rendered fragments"""
+
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}
+
+    def get(self, key):
+        with self.lock:
+            value = self.entries.get(key)
+            if value is None:
+                self.stats['misses'] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+class FragmentCacheExtension(Extension):
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key_parts.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render_cached', [nodes.List(key_parts)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render_cached(self, key_parts, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        key = (g.get('site_code'),) + tuple(key_parts)
+        fragment = cache.get(key)
+        if fragment is None:
+            fragment = caller()
+            cache.set(key, fragment)
+        return Markup(fragment)
+
+
+def _touch_patients(session, flush_context):
+    """Bump Patient.updated_at for every patient whose encounter rows were written in this flush"""
+    patient_ids = {
+        obj.patient_id for obj in chain(session.new, session.dirty, session.deleted)
+        if isinstance(obj, ENCOUNTER_MODELS) and obj.patient_id is not None
+        and (obj not in session.dirty or session.is_modified(obj, include_collections=False))
+    }
+    if patient_ids:
+        patient = Patient.__table__
+        session.connection().execute(
+            patient.update().where(patient.c.id.in_(patient_ids)).values(updated_at=datetime.utcnow())
+        )
+
+
+def install_template_caching(app):
+    cache_dir = app.config['JINJA_CACHE_DIR']
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        app.jinja_env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+
+    app.jinja_env.add_extension(FragmentCacheExtension)
+    if app.config['FRAGMENT_CACHE_SIZE']:
+        app.jinja_env.fragment_cache = FragmentCache(app.config['FRAGMENT_CACHE_SIZE'])
+
+    event.listen(db.session, 'after_flush', _touch_patients)
+
+
+def compile_templates(app):
+    """Load every template once so the bytecode cache holds all of them"""
+    compiled = 0
+    for name in app.jinja_env.list_templates(extensions=('html',)):
+        try:
+            app.jinja_env.get_template(name)
+            compiled += 1
+        except Exception as e:
+            logging.error("Error compiling template %s: %s", name, e)
+    return compiled
@@ -0,0 +1,166 @@
+"""Minimal HL7 v2 support for laboratory result feeds.
+
+Covers what the LIS interface needs: MLLP framing, parsing ORU^R01 result
+messages into the same fields the JSON API accepts, and building ACKs.
+"""
+from datetime import datetime
+
+MLLP_START = b'\x0b'
+MLLP_END = b'\x1c\x0d'
+
+# Diagnostic service sections (OBR-24) reported by imaging rather than the lab
+RADIOLOGY_SECTIONS = {'RAD', 'CT', 'MR', 'US', 'XR', 'NMR', 'RX', 'VUS'}
+
+
+class HL7Error(ValueError):
+    """Raised for messages that cannot be parsed as an ORU result"""
+
+
+def parse_facility_sites(value):
+    """Parse 'FACILITY=SITE,...' into {sending facility (MSH-4): site code}"""
+    facilities = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        facility, _, site_code = item.partition('=')
+        facilities[facility.strip()] = site_code.strip()
+    return facilities
+
+
+def frame(message):
+    """Wrap an HL7 message (str) in an MLLP frame"""
+    return MLLP_START + message.encode('utf-8') + MLLP_END
+
+
+def extract_frames(buffer):
+    """Split complete MLLP frames off the front of `buffer`.
+
+    Returns (messages, remaining bytes); bytes before a start block are dropped.
+    """
+    messages = []
+    while True:
+        start = buffer.find(MLLP_START)
+        if start == -1:
+            return messages, b''
+        end = buffer.find(MLLP_END, start)
+        if end == -1:
+            return messages, buffer[start:]
+        messages.append(buffer[start + 1:end].decode('utf-8', errors='replace'))
+        buffer = buffer[end + len(MLLP_END):]
+
+
+def _field(fields, index, component=None, component_separator='^'):
+    value = fields[index] if index < len(fields) else ''
+    if component is not None:
+        parts = value.split(component_separator)
+        value = parts[component] if component < len(parts) else ''
+    return value
+
+
+def parse_hl7_datetime(value):
+    digits = value.split('+')[0].split('-')[0].split('.')[0]
+    for fmt in ('%Y%m%d%H%M%S', '%Y%m%d%H%M', '%Y%m%d'):
+        try:
+            return datetime.strptime(digits, fmt)
+        except ValueError:
+            continue
+    return None
+
+
+class HL7Message:
+    """Parsed ORU^R01 message: header fields plus one result per OBR group"""
+
+    def __init__(self, raw):
+        self.raw = raw
+        segments = [segment for segment in raw.replace('\n', '\r').split('\r') if segment]
+        if not segments or not segments[0].startswith('MSH'):
+            raise HL7Error("Message does not start with an MSH segment")
+
+        field_separator = segments[0][3]
+        self.component_separator = segments[0][4]
+        # MSH-1 is the field separator itself, so MSH field n is at index n - 1
+        msh = [None] + segments[0].split(field_separator)
+        self.sending_application = msh[3] if len(msh) > 3 else ''
+        self.sending_facility = msh[4] if len(msh) > 4 else ''
+        self.message_type = msh[9] if len(msh) > 9 else ''
+        self.control_id = msh[10] if len(msh) > 10 else ''
+        self.version = msh[12] if len(msh) > 12 else '2.5'
+        self.segments = [segment.split(field_separator) for segment in segments[1:]]
+        self.results = []
+
+        if not self.message_type.startswith('ORU'):
+            raise HL7Error(f"Unsupported message type: {self.message_type}")
+        self._parse_results()
+
+    def _parse_results(self):
+        separator = self.component_separator
+        patient_mrn = None
+        current = None
+        observations = []
+
+        def finish():
+            if current:
+                current['result'] = '\n'.join(observations)
+                self.results.append(current)
+
+        for fields in self.segments:
+            segment_type = fields[0]
+            if segment_type == 'PID':
+                patient_mrn = _field(fields, 3, 0, separator)
+            elif segment_type == 'OBR':
+                finish()
+                observations = []
+                service_id = _field(fields, 4, None)
+                section = _field(fields, 24).upper()
+                external_id = _field(fields, 3, 0, separator) or f"{self.control_id}-{_field(fields, 1) or len(self.results) + 1}"
+                observed_at = _field(fields, 22) or _field(fields, 7)
+                current = {
+                    'external_id': external_id,
+                    'patient_mrn': patient_mrn,
+                    'test_type': 'radiology' if section in RADIOLOGY_SECTIONS else 'laboratory',
+                    'test_code': service_id.split(separator)[0],
+                    'test_name': _field(fields, 4, 1, separator) or service_id.split(separator)[0],
+                    'result_date': parse_hl7_datetime(observed_at) if observed_at else None,
+                }
+            elif segment_type == 'OBX' and current is not None:
+                name = _field(fields, 3, 1, separator) or _field(fields, 3, 0, separator)
+                value = _field(fields, 5)
+                units = _field(fields, 6, 0, separator)
+                reference = _field(fields, 7)
+                flags = _field(fields, 8)
+                line = f"{name}: {value}" if name else value
+                if units:
+                    line += f" {units}"
+                if reference:
+                    line += f" (ref {reference})"
+                if flags:
+                    line += f" [{flags}]"
+                observations.append(line)
+        finish()
+
+        if not self.results:
+            raise HL7Error("ORU message contains no OBR result groups")
+        for result in self.results:
+            if not result['patient_mrn']:
+                raise HL7Error("ORU message has no patient identifier (PID-3)")
+            if not result['test_name']:
+                raise HL7Error("OBR segment has no universal service identifier (OBR-4)")
+
+
+def build_ack(message, code='AA', text=''):
+    """Build an ACK for `message` (an HL7Message, or the raw text if it could not be parsed)"""
+    if isinstance(message, HL7Message):
+        control_id, receiver, facility, version = (
+            message.control_id, message.sending_application, message.sending_facility, message.version
+        )
+    else:
+        # Best effort for messages that failed to parse; MSH field n is at index n - 1
+        msh = str(message).split('\r')[0].split('|') if str(message).startswith('MSH') else []
+        receiver = msh[2] if len(msh) > 2 else ''
+        facility = msh[3] if len(msh) > 3 else ''
+        control_id = msh[9] if len(msh) > 9 else ''
+        version = msh[11] if len(msh) > 11 else '2.5'
+    timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+    segments = [
+        f"MSH|^~\\&|SIGEDE|ER|{receiver}|{facility}|{timestamp}||ACK^R01|ACK{control_id}|P|{version}",
+        f"MSA|{code}|{control_id}|{text.replace('|', ' ')}" if text else f"MSA|{code}|{control_id}",
+    ]
+    return '\r'.join(segments) + '\r'
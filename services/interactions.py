@@ -0,0 +1,251 @@
+"""Allergy and drug-interaction checks for new prescriptions.
+
+A new order is checked against the patient's documented allergies
+(NurseAssessment.allergies), home medications (NurseAssessment.medications)
+and the patient's other prescriptions. Warnings are returned before the
+prescription is committed. The prescriber must acknowledge them to save,
+and the acknowledged warnings are stored on the prescription.
+
+The reference dataset is a JSON file (INTERACTION_DATASET, by default
+reference/drug_interactions.json) with:
+
+* "drugs": canonical name -> {"synonyms": [...], "classes": [...], "groups": [...]}.
+  "classes" are chemical classes and take part in allergy checks, e.g.
+  penicillins. "groups" are pharmacological groups used only for
+  interactions, e.g. qt-prolonging;
+* "allergens": class -> allergy terms naming it, e.g. "sulfa";
+* "cross_reactivity": {"allergy", "class", "severity", "description"} rules;
+* "interactions": {"a", "b", "severity", "description"} rules, where a and b
+  name a drug, class or group. A rule with a == b applies to two different
+  drugs of that class or group.
+
+The file is compiled once into an InteractionIndex of plain dicts:
+
+* a term table from normalized names, synonyms and allergy terms, so free
+  text such as "amoxicillin 500mg caps" or "allergic to sulfa (rash)" is
+  matched with one dict lookup per word n-gram;
+* each drug's concept set (itself, its classes and groups);
+* a pair table keyed by (concept, concept).
+
+Checking an order against a medication list is then a few dict lookups
+per listed drug, a matter of microseconds (benchmark.py interactions).
+Each process checks the file's modification time at most every
+INTERACTION_RELOAD_INTERVAL seconds. A changed dataset is compiled and
+swapped in without restarting workers. A file that fails to load is
+logged, and the previous index stays in use.
+
+Free text is matched, not understood: "no penicillin allergy" still
+matches penicillin, so the checker errs towards warning. A medication
+missing from the dataset gets an 'unchecked' notice rather than silence.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+
+from flask import current_app
+
+from models import NurseAssessment, Prescription
+
+SEVERITIES = ('contraindicated', 'major', 'moderate', 'minor', 'info')
+
+PrescriptionWarning = namedtuple('PrescriptionWarning', 'kind severity medication message')
+
+_NON_WORD = re.compile(r'[^\w]+')
+
+
+def normalize_drug_text(text):
+    return ' '.join(_NON_WORD.sub(' ', (text or '').casefold()).split())
+
+
+def _severity_rank(severity):
+    return SEVERITIES.index(severity)
+
+
+class InteractionIndex:
+    """Compiled, read-only form of the reference dataset"""
+
+    def __init__(self, dataset):
+        self.version = dataset.get('version')
+        self.drug_terms = {}       # normalized name or synonym -> drug
+        self.allergen_terms = {}   # normalized allergy term -> frozenset of concepts
+        self.concepts = {}         # drug -> frozenset of itself, its classes and groups
+        self.allergy_classes = {}  # drug -> frozenset of its classes
+        self.pairs = {}            # (concept, concept) -> (severity, description)
+        self.cross_reactivity = {}  # (allergy concept, class) -> (severity, description)
+
+        for drug, entry in dataset['drugs'].items():
+            classes = frozenset(entry.get('classes', ()))
+            self.concepts[drug] = frozenset({drug, *classes, *entry.get('groups', ())})
+            self.allergy_classes[drug] = classes
+            for name in (drug, *entry.get('synonyms', ())):
+                self.drug_terms[normalize_drug_text(name)] = drug
+        for allergen, terms in dataset.get('allergens', {}).items():
+            for term in terms:
+                self.allergen_terms[normalize_drug_text(term)] = frozenset({allergen})
+        # An allergy to a drug is an allergy to it and, with lower certainty, to its classes
+        for term, drug in self.drug_terms.items():
+            self.allergen_terms[term] = self.allergen_terms.get(term, frozenset()) | {drug} | self.allergy_classes[drug]
+
+        for rule in dataset.get('cross_reactivity', ()):
+            self._check_severity(rule)
+            self.cross_reactivity[(rule['allergy'], rule['class'])] = (rule['severity'], rule['description'])
+        for rule in dataset.get('interactions', ()):
+            self._check_severity(rule)
+            key = tuple(sorted((rule['a'], rule['b'])))
+            # Keep the most severe rule for a pair listed twice
+            if key not in self.pairs or _severity_rank(rule['severity']) < _severity_rank(self.pairs[key][0]):
+                self.pairs[key] = (rule['severity'], rule['description'])
+
+        self.max_words = max((len(term.split()) for term in (*self.drug_terms, *self.allergen_terms)), default=1)
+
+    @staticmethod
+    def _check_severity(rule):
+        if rule['severity'] not in SEVERITIES:
+            raise ValueError(f"Unknown severity {rule['severity']!r} in {rule}")
+
+    def _scan(self, text, terms):
+        """Values of `terms` named in free text, longest match first, in order of appearance"""
+        words = normalize_drug_text(text).split()
+        found = []
+        position = 0
+        while position < len(words):
+            for size in range(min(self.max_words, len(words) - position), 0, -1):
+                value = terms.get(' '.join(words[position:position + size]))
+                if value is not None:
+                    found.append(value)
+                    position += size
+                    break
+            else:
+                position += 1
+        return found
+
+    def drugs_in(self, text):
+        """Canonical drugs named in free text, e.g. a medication list"""
+        return list(dict.fromkeys(self._scan(text, self.drug_terms)))
+
+    def _allergy_warnings(self, drug, allergic_to):
+        if drug in allergic_to:
+            return [PrescriptionWarning('allergy', 'contraindicated', drug, f"Documented allergy to {drug}")]
+        warnings = []
+        shared = self.allergy_classes[drug] & allergic_to
+        if shared:
+            warnings.append(PrescriptionWarning(
+                'allergy', 'major', drug, f"Allergy to {', '.join(sorted(shared))}; {drug} belongs to the same class"
+            ))
+        for allergy in allergic_to:
+            for drug_class in self.allergy_classes[drug]:
+                rule = self.cross_reactivity.get((allergy, drug_class))
+                if rule is not None:
+                    warnings.append(PrescriptionWarning('allergy', rule[0], drug, f"Allergy to {allergy}: {rule[1]}"))
+        return warnings
+
+    def _interaction_warnings(self, drug, other_medications):
+        warnings = []
+        concepts = self.concepts[drug]
+        for other, description in other_medications:
+            if other == drug:
+                warnings.append(PrescriptionWarning('duplicate', 'moderate', drug, f"Duplicate therapy: {description}"))
+                continue
+            worst = None
+            for concept in concepts:
+                for other_concept in self.concepts[other]:
+                    rule = self.pairs.get((concept, other_concept) if concept < other_concept else (other_concept, concept))
+                    if rule is not None and (worst is None or _severity_rank(rule[0]) < _severity_rank(worst[0])):
+                        worst = rule
+            if worst is not None:
+                warnings.append(PrescriptionWarning('interaction', worst[0], drug, f"{drug} with {description}: {worst[1]}"))
+        return warnings
+
+    def allergies_in(self, text):
+        """Concepts (drugs and classes) a free-text allergy list names"""
+        return frozenset().union(*self._scan(text, self.allergen_terms))
+
+    def check(self, medication_name, allergies='', other_medications=()):
+        """Warnings for a new order of `medication_name`, most severe first.
+
+        `other_medications` is a sequence of (drug, description) from drugs_in(), for the
+        patient's current medications.
+        """
+        drugs = self.drugs_in(medication_name)
+        if not drugs:
+            return [PrescriptionWarning('unchecked', 'info', medication_name,
+                                        f"{medication_name} is not in the interaction reference; it was not checked")]
+        allergic_to = self.allergies_in(allergies)
+        warnings = []
+        # Combination products name more than one drug
+        for drug in drugs:
+            warnings.extend(self._allergy_warnings(drug, allergic_to))
+            warnings.extend(self._interaction_warnings(drug, other_medications))
+        warnings.sort(key=lambda warning: _severity_rank(warning.severity))
+        return warnings
+
+
+class InteractionChecker:
+    """The current InteractionIndex of this process, reloaded when the dataset file changes"""
+
+    def __init__(self):
+        self.index = None
+        self.path = None
+        self.signature = None
+        self.checked_at = 0.0
+        self.lock = threading.Lock()
+        self.stats = {'loads': 0, 'load_errors': 0}
+
+    def load(self, path):
+        """Compile the dataset at `path` and swap it in; returns the new index"""
+        stat = os.stat(path)
+        with open(path, encoding='utf-8') as f:
+            index = InteractionIndex(json.load(f))
+        self.index = index
+        self.path = path
+        self.signature = (stat.st_mtime_ns, stat.st_size)
+        self.stats['loads'] += 1
+        logging.info("Loaded interaction reference %s (version %s, %d drugs, %d rules)",
+                     path, index.version, len(index.concepts), len(index.pairs))
+        return index
+
+    def get(self, path, reload_interval):
+        now = time.monotonic()
+        if self.index is not None and path == self.path and now - self.checked_at < reload_interval:
+            return self.index
+        with self.lock:
+            if self.index is None or path != self.path or now - self.checked_at >= reload_interval:
+                self.checked_at = now
+                try:
+                    stat = os.stat(path)
+                    if self.index is None or path != self.path or (stat.st_mtime_ns, stat.st_size) != self.signature:
+                        self.load(path)
+                except (OSError, ValueError, KeyError, TypeError) as e:
+                    self.stats['load_errors'] += 1
+                    if self.index is None:
+                        raise
+                    logging.error("Keeping the loaded interaction reference; %s could not be loaded: %s", path, e)
+        return self.index
+
+
+interaction_checker = InteractionChecker()
+
+
+def current_index():
+    return interaction_checker.get(current_app.config['INTERACTION_DATASET'],
+                                   current_app.config['INTERACTION_RELOAD_INTERVAL'])
+
+
+def check_prescription(patient_id, medication_name, exclude_id=None):
+    """Warnings for prescribing `medication_name` to a patient, most severe first"""
+    index = current_index()
+    assessment = NurseAssessment.query.filter_by(patient_id=patient_id).order_by(NurseAssessment.id.desc()).first()
+    other_medications = []
+    if assessment is not None:
+        other_medications.extend((drug, f"{drug} (home medication)") for drug in index.drugs_in(assessment.medications))
+    prescriptions = Prescription.query.filter(Prescription.patient_id == patient_id)
+    if exclude_id is not None:
+        prescriptions = prescriptions.filter(Prescription.id != exclude_id)
+    for prescription in prescriptions:
+        for drug in index.drugs_in(prescription.medication_name):
+            other_medications.append((drug, f"{drug} (prescribed {prescription.prescribed_at:%d-%m %H:%M})"))
+    return index.check(medication_name, assessment.allergies if assessment else '', other_medications)
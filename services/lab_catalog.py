@@ -0,0 +1,112 @@
+"""Lab test catalog: canonical test codes and their spelling variants.
+
+Requests are typed by clinicians, and results arrive from the LIS with
+its own names, e.g. "CBC", "Complete blood count" or "FBC". Instead of comparing
+free text, both are resolved to a TestCatalog id when they are stored.
+Matching a result to its request is then an integer comparison on the
+ix_lab_request_patient_test_open index.
+
+Names are resolved through an in-memory alias map from normalized text
+(lower case, punctuation and extra spaces removed) to catalog id. The
+synonym table holds every code, name and alternative spelling. The map
+is loaded once per process at startup. A spelling it does not know costs
+one indexed lookup, and a hit is added to the map, so synonyms added
+after startup are picked up without a restart. Names that resolve to
+nothing keep a NULL catalog id; those rows are still matched on test
+type and name, as before.
+"""
+import re
+import threading
+
+from app import db
+from models import TestCatalog, TestSynonym, LabRequest, ExternalLabResult
+
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize_test_name(text):
+    return ' '.join(_NON_WORD.sub(' ', text or '').casefold().split())
+
+
+class AliasMap:
+    def __init__(self):
+        self.aliases = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        aliases = {}
+        for synonym in TestSynonym.query.join(TestCatalog).filter(TestCatalog.is_active == True):
+            aliases[synonym.alias] = synonym.test_catalog_id
+        with self.lock:
+            self.aliases = aliases
+        return len(aliases)
+
+    def _lookup(self, alias):
+        """Catalog id for an alias the map does not know yet, straight from the synonym table"""
+        return db.session.query(TestSynonym.test_catalog_id).join(TestCatalog).filter(
+            TestSynonym.alias == alias, TestCatalog.is_active == True
+        ).scalar()
+
+    def resolve(self, *names):
+        """Catalog id of the first of `names` that is known, or None"""
+        if self.aliases is None:
+            self.load()
+        for name in names:
+            alias = normalize_test_name(name)
+            if not alias:
+                continue
+            catalog_id = self.aliases.get(alias)
+            if catalog_id is None:
+                catalog_id = self._lookup(alias)
+                if catalog_id is not None:
+                    with self.lock:
+                        self.aliases[alias] = catalog_id
+            if catalog_id is not None:
+                return catalog_id
+        return None
+
+
+alias_map = AliasMap()
+
+
+def resolve_test(*names):
+    """Catalog id for a test known by any of `names` (e.g. an LIS code, then its name)"""
+    return alias_map.resolve(*names)
+
+
+def add_test(code, name, test_type, synonyms=()):
+    """Create or update a catalog test and its synonyms; the caller commits.
+
+    The code and name are stored as synonyms too, so every spelling is in one indexed table.
+    """
+    test = TestCatalog.query.filter_by(code=code).first()
+    if test is None:
+        test = TestCatalog(code=code)
+        db.session.add(test)
+    test.name = name
+    test.test_type = test_type
+    test.is_active = True
+    known = {synonym.alias for synonym in test.synonyms}
+    for synonym in (code, name, *synonyms):
+        alias = normalize_test_name(synonym)
+        if alias and alias not in known:
+            test.synonyms.append(TestSynonym(alias=alias))
+            known.add(alias)
+    return test
+
+
+def backfill_test_catalog_ids():
+    """Resolve the catalog id of stored requests and results that do not have one yet"""
+    updated = 0
+    for model in (LabRequest, ExternalLabResult):
+        names = db.session.query(model.test_name).filter(model.test_catalog_id.is_(None)).distinct().all()
+        for (name,) in names:
+            catalog_id = resolve_test(name)
+            if catalog_id is None:
+                continue
+            # One UPDATE per distinct name rather than per row
+            updated += model.query.filter(
+                model.test_catalog_id.is_(None), model.test_name == name
+            ).execution_options(all_sites=True).update({'test_catalog_id': catalog_id}, synchronize_session=False)
+        db.session.commit()
+    return updated
@@ -0,0 +1,207 @@
+"""Standalone asyncio MLLP listener for HL7 ORU result feeds from the LIS.
+
+Runs as its own process (see lab_listener.py) so result ingestion scales
+separately from the web workers. Each connection may pipeline messages: they
+are parsed as frames arrive, handed to a shared batch writer, and ACKed in
+the order received once their batch has committed. The batch writer stores
+up to `batch_size` messages per transaction on a single worker thread and
+reuses match_external_result() from routes/laboratory.py for matching.
+
+Each message belongs to the site of its sending facility (MSH-4, see
+LAB_FACILITY_SITES). Its results are stored for that site and matched
+only against that site's patients, the way the JSON API scopes a request.
+"""
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from flask import current_app, g
+
+from app import db
+from models import ExternalLabResult
+from routes.laboratory import match_external_result
+from services.hl7 import HL7Error, HL7Message, build_ack, extract_frames, frame
+from services.lab_catalog import resolve_test
+
+logger = logging.getLogger(__name__)
+
+
+class LabResultListener:
+    def __init__(self, app, host='0.0.0.0', port=2575, batch_size=100, batch_delay=0.05):
+        self.app = app
+        self.host = host
+        self.port = port
+        self.batch_size = batch_size
+        self.batch_delay = batch_delay
+        # Bounded so a flood of messages pushes back on the senders' sockets
+        self.pending = asyncio.Queue(maxsize=batch_size * 10)
+        # One thread owns the database session
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='lab-listener-db')
+        self.stats = {'connections': 0, 'messages': 0, 'results': 0, 'matched': 0, 'batches': 0, 'errors': 0}
+
+    async def serve_forever(self):
+        writer_task = asyncio.create_task(self._batch_writer())
+        server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        logger.info("MLLP listener on %s", ', '.join(str(sock.getsockname()) for sock in server.sockets))
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            writer_task.cancel()
+            self.executor.shutdown(wait=True)
+
+    async def handle_connection(self, reader, writer):
+        self.stats['connections'] += 1
+        loop = asyncio.get_running_loop()
+        acks = asyncio.Queue()
+        ack_task = asyncio.create_task(self._write_acks(writer, acks))
+        buffer = b''
+        try:
+            while True:
+                data = await reader.read(65536)
+                if not data:
+                    break
+                messages, buffer = extract_frames(buffer + data)
+                for raw in messages:
+                    self.stats['messages'] += 1
+                    ack = loop.create_future()
+                    await acks.put(ack)
+                    try:
+                        message = HL7Message(raw)
+                    except HL7Error as e:
+                        self.stats['errors'] += 1
+                        ack.set_result(build_ack(raw, 'AR', str(e)))
+                        continue
+                    await self.pending.put((message, ack))
+        except ConnectionError:
+            pass
+        finally:
+            await acks.put(None)
+            await ack_task
+            writer.close()
+
+    async def _write_acks(self, writer, acks):
+        """Send ACKs in message order, each as soon as its batch has committed"""
+        while True:
+            ack = await acks.get()
+            if ack is None:
+                return
+            try:
+                writer.write(frame(await ack))
+                await writer.drain()
+            except ConnectionError:
+                return
+
+    async def _batch_writer(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.pending.get()]
+            deadline = loop.time() + self.batch_delay
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.pending.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+            messages = [message for message, _ in batch]
+            try:
+                outcomes = await loop.run_in_executor(self.executor, self._store_batch, messages)
+            except Exception as e:
+                logger.error("Error storing result batch: %s", e)
+                outcomes = [('AE', 'Internal error storing result')] * len(batch)
+
+            for (message, ack), (code, text) in zip(batch, outcomes):
+                ack.set_result(build_ack(message, code, text))
+
+    def _store_batch(self, messages):
+        """Store a batch in one transaction; on failure retry message by message"""
+        with self.app.app_context():
+            try:
+                outcomes = self._store(messages)
+                db.session.commit()
+                self.stats['batches'] += 1
+                return outcomes
+            except Exception as e:
+                db.session.rollback()
+                logger.warning("Batch of %d messages failed (%s), storing individually", len(messages), e)
+
+            outcomes = []
+            for message in messages:
+                try:
+                    outcomes.extend(self._store([message]))
+                    db.session.commit()
+                except Exception as e:
+                    db.session.rollback()
+                    self.stats['errors'] += 1
+                    logger.error("Error storing HL7 message %s: %s", message.control_id, e)
+                    outcomes.append(('AE', 'Error storing result'))
+            return outcomes
+
+    def site_for(self, message):
+        """Site of the message's sending facility, or None if the facility is not known"""
+        facility = message.sending_facility.split(message.component_separator)[0]
+        facility_sites = current_app.config['LAB_FACILITY_SITES']
+        if facility in facility_sites:
+            return facility_sites[facility]
+        if facility in current_app.config['SITES']:
+            return facility
+        return None if facility_sites else current_app.config['SITE_CODE']
+
+    def _store(self, messages):
+        outcomes = {}
+        by_site = {}
+        for index, message in enumerate(messages):
+            site_code = self.site_for(message)
+            if site_code is None:
+                self.stats['errors'] += 1
+                outcomes[index] = ('AR', f"Unknown sending facility {message.sending_facility}")
+                continue
+            by_site.setdefault(site_code, []).append((index, message))
+
+        for site_code, site_messages in by_site.items():
+            # Scopes the MRN match to the site and routes to its database, as for a web request
+            g.site_code = site_code
+            try:
+                self._store_site([message for _, message in site_messages], site_code)
+            finally:
+                g.pop('site_code', None)
+            outcomes.update((index, ('AA', '')) for index, _ in site_messages)
+        return [outcomes[index] for index in range(len(messages))]
+
+    def _store_site(self, messages, site_code):
+        external_ids = [result['external_id'] for message in messages for result in message.results]
+        # Unscoped, since the external id is unique across sites
+        existing = {
+            row.external_system_id for row in
+            db.session.query(ExternalLabResult.external_system_id).filter(
+                ExternalLabResult.external_system_id.in_(external_ids)
+            ).execution_options(all_sites=True)
+        }
+
+        new_results = []
+        for message in messages:
+            for result in message.results:
+                # A redelivered message is acknowledged without storing it twice
+                if result['external_id'] in existing:
+                    continue
+                existing.add(result['external_id'])
+                new_results.append(ExternalLabResult(
+                    site_code=site_code,
+                    external_system_id=result['external_id'],
+                    patient_mrn=result['patient_mrn'],
+                    test_type=result['test_type'],
+                    test_name=result['test_name'],
+                    test_catalog_id=resolve_test(result['test_code'], result['test_name']),
+                    result=result['result'],
+                    result_date=result['result_date'] or datetime.now()
+                ))
+        db.session.add_all(new_results)
+        db.session.flush()
+
+        matched = sum(1 for external_result in new_results if match_external_result(external_result))
+        self.stats['results'] += len(new_results)
+        self.stats['matched'] += matched
@@ -0,0 +1,283 @@
+"""Server-side rendering of patient wristbands and specimen labels.
+
+Labels are rendered as ZPL for Zebra-compatible label printers, or as PDF
+for ordinary printers and previews. Both can be rendered singly or as a
+batch: a batch is one ZPL stream or one PDF with a page per label. A
+layout is a list of text and Code 128 barcode fields in points, and each
+output format draws the same layout. The PDF writer is built in, so no
+extra dependency is needed.
+
+Rendered labels are cached per row and version. Patient.updated_at changes
+whenever the patient or any of their encounter rows is written, so both
+wristbands and specimen labels are keyed on it. Reprinting the same band
+or a batch of unchanged labels needs no rendering at all.
+
+Jobs go to LABEL_PRINTER:
+
+* a directory: a spool directory, which is the default (instance/label_spool).
+  Each job is written atomically as one .zpl or .pdf file, for a print
+  service or CUPS folder watcher to pick up;
+* tcp://host:port: a raw socket, port 9100 on most label printers.
+  label_printer_standin.py is a stand-in that saves what it receives.
+"""
+import os
+import socket
+from datetime import datetime
+from urllib.parse import urlparse
+
+from flask import current_app
+
+from models import Patient, LabRequest
+from services.fragment_cache import FragmentCache
+
+FORMATS = {'zpl': 'application/zpl', 'pdf': 'application/pdf'}
+
+# Printer resolution for ZPL
+ZPL_DPI = 203
+
+# Label stock in points (1/72 inch), as (width, height) with text reading along the width
+LABEL_SIZES = {
+    'wristband': (792, 72),   # 11 x 1 in
+    'specimen': (144, 72),    # 2 x 1 in
+}
+# Wristbands run along the printer's feed direction, so their ZPL is rotated
+ROTATED_KINDS = {'wristband'}
+
+# Code 128 bar/space widths for symbol values 0-105, then the stop pattern
+CODE128_PATTERNS = [
+    '212222', '222122', '222221', '121223', '121322', '131222', '122213', '122312', '132212', '221213',
+    '221312', '231212', '112232', '122132', '122231', '113222', '123122', '123221', '223211', '221132',
+    '221231', '213212', '223112', '312131', '311222', '321122', '321221', '312212', '322112', '322211',
+    '212123', '212321', '232121', '111323', '131123', '131321', '112313', '132113', '132311', '211313',
+    '231113', '231311', '112133', '112331', '132131', '113123', '113321', '133121', '313121', '211331',
+    '231131', '213113', '213311', '213131', '311123', '311321', '331121', '312113', '312311', '332111',
+    '314111', '221411', '431111', '111224', '111422', '121124', '121421', '141122', '141221', '112214',
+    '112412', '122114', '122411', '142112', '142211', '241211', '221114', '413111', '241112', '134111',
+    '111242', '121142', '121241', '114212', '124112', '124211', '411212', '421112', '421211', '212141',
+    '214121', '412121', '111143', '111341', '131141', '114113', '114311', '411113', '411311', '113141',
+    '114131', '311141', '411131', '211412', '211214', '211232', '2331112',
+]
+CODE128_START_B = 104
+CODE128_STOP = 106
+
+_cache = {'labels': None}
+
+
+class Text:
+    def __init__(self, x, y, size, text):
+        self.x, self.y, self.size, self.text = x, y, size, text
+
+
+class Barcode:
+    """Code 128 barcode; `module` is the narrowest bar in points"""
+
+    def __init__(self, x, y, height, data, module=1.0):
+        self.x, self.y, self.height, self.data, self.module = x, y, height, data, module
+
+
+# --- Layouts ---
+
+def _date(value, fmt='%d-%m-%Y'):
+    return value.strftime(fmt) if value else ''
+
+
+def specimen_id(lab_request):
+    """Accession number printed on a specimen; ids repeat across sites, so it carries the site"""
+    return f"{lab_request.site_code}-L{lab_request.id}"
+
+
+def wristband_layout(patient):
+    dob = 'DOB unknown' if patient.is_placeholder else f"DOB {_date(patient.date_of_birth)}  {patient.gender}"
+    mrn = patient.medical_record_number or ''
+    fields = [
+        Text(90, 6, 16, f"{patient.last_name}, {patient.first_name}"),
+        Text(90, 28, 10, f"{dob}   MRN {mrn or 'not assigned'}"),
+        Text(90, 44, 9, f"SiGeDe EMERGENCY DEPARTMENT   {_date(patient.created_at, '%d-%m-%Y %H:%M')}"),
+    ]
+    if patient.incident_code:
+        fields.append(Text(90, 58, 8, f"MASS-CASUALTY INCIDENT {patient.incident_code}"))
+    if mrn:
+        fields.append(Barcode(480, 10, 50, mrn, module=1.0))
+    return fields
+
+
+def specimen_layout(lab_request):
+    patient = lab_request.patient
+    return [
+        Text(6, 4, 8, f"{patient.last_name}, {patient.first_name}"[:34]),
+        Text(6, 14, 6, f"MRN {patient.medical_record_number or '-'}  DOB {_date(patient.date_of_birth)}"),
+        Text(6, 22, 7, f"{lab_request.test_name} ({lab_request.priority.upper()})"[:38]),
+        Barcode(6, 31, 24, specimen_id(lab_request), module=0.75),
+        Text(6, 58, 6, f"{specimen_id(lab_request)}  {_date(lab_request.requested_at, '%d-%m-%Y %H:%M')}"),
+    ]
+
+
+# --- ZPL ---
+
+def _zpl_field_data(text):
+    # ^FH lets field data carry _XX hex escapes, so ^ and ~ cannot end the field early
+    escaped = text.replace('_', '_5F').replace('^', '_5E').replace('~', '_7E')
+    return f"^FH^FD{escaped}^FS"
+
+
+def render_zpl(kind, fields):
+    width, height = LABEL_SIZES[kind]
+    dots = ZPL_DPI / 72
+    rotated = kind in ROTATED_KINDS
+    page_width, page_length = (height, width) if rotated else (width, height)
+    commands = ['^XA', '^CI28', f"^PW{round(page_width * dots)}", f"^LL{round(page_length * dots)}"]
+    for field in fields:
+        extent = field.size if isinstance(field, Text) else field.height
+        if rotated:
+            # Text reads along the feed direction: the layout's x runs down the label, its top faces right
+            x, y = page_width - field.y - extent, field.x
+        else:
+            x, y = field.x, field.y
+        orientation = 'R' if rotated else 'N'
+        origin = f"^FO{round(x * dots)},{round(y * dots)}"
+        if isinstance(field, Text):
+            size = round(field.size * dots)
+            commands.append(f"{origin}^A0{orientation},{size},{size}{_zpl_field_data(field.text)}")
+        else:
+            module = max(1, round(field.module * dots))
+            commands.append(
+                f"{origin}^BY{module}^BC{orientation},{round(field.height * dots)},N,N{_zpl_field_data(field.data)}"
+            )
+    commands.append('^XZ')
+    return '\n'.join(commands) + '\n'
+
+
+# --- PDF ---
+
+def code128_modules(data):
+    """Bar/space widths, in modules, of `data` as Code 128 (code set B: printable ASCII)"""
+    values = [CODE128_START_B]
+    for char in data:
+        if not 32 <= ord(char) <= 126:
+            raise ValueError(f"Cannot encode {char!r} in a Code 128 barcode")
+        values.append(ord(char) - 32)
+    checksum = (values[0] + sum(position * value for position, value in enumerate(values[1:], 1))) % 103
+    values += [checksum, CODE128_STOP]
+    return [int(width) for value in values for width in CODE128_PATTERNS[value]]
+
+
+def _pdf_text(text):
+    escaped = text.encode('latin-1', 'replace').decode('latin-1')
+    return escaped.replace('\\', '\\\\').replace('(', '\\(').replace(')', '\\)')
+
+
+def render_pdf_page(kind, fields):
+    """Content stream of one label page"""
+    height = LABEL_SIZES[kind][1]
+    operations = []
+    for field in fields:
+        if isinstance(field, Text):
+            # PDF's origin is the bottom left; place the baseline below the field's top
+            baseline = height - field.y - field.size * 0.8
+            operations.append(f"BT /F1 {field.size} Tf {field.x} {baseline:.2f} Td ({_pdf_text(field.text)}) Tj ET")
+        else:
+            x = field.x
+            bottom = height - field.y - field.height
+            for index, width in enumerate(code128_modules(field.data)):
+                if index % 2 == 0:
+                    operations.append(f"{x:.2f} {bottom:.2f} {width * field.module:.2f} {field.height} re f")
+                x += width * field.module
+    return '\n'.join(operations).encode('latin-1')
+
+
+def assemble_pdf(kind, pages):
+    """A PDF document with one page per content stream"""
+    width, height = LABEL_SIZES[kind]
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        None,  # page tree, filled in once the page numbers are known
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>",
+    ]
+    page_numbers = []
+    for content in pages:
+        objects.append(b"<< /Length %d >>\nstream\n%s\nendstream" % (len(content), content))
+        objects.append((
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {width} {height}] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>"
+        ).encode())
+        page_numbers.append(len(objects))
+    kids = ' '.join(f"{number} 0 R" for number in page_numbers)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_numbers)} >>".encode()
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, 1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b''.join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(output)
+
+
+# --- Rendering with cache ---
+
+def _label_cache():
+    size = current_app.config['LABEL_CACHE_SIZE']
+    if size and _cache['labels'] is None:
+        _cache['labels'] = FragmentCache(size)
+    return _cache['labels']
+
+
+def _rows(kind, ids):
+    """Rows to label, in the order requested"""
+    if kind == 'wristband':
+        rows = Patient.query.filter(Patient.id.in_(ids)).all()
+    elif kind == 'specimen':
+        rows = LabRequest.query.filter(LabRequest.id.in_(ids)).all()
+    else:
+        raise ValueError(f"Unknown label kind {kind!r}")
+    by_id = {row.id: row for row in rows}
+    return [by_id[row_id] for row_id in ids if row_id in by_id]
+
+
+def _render_one(kind, row, fmt):
+    patient = row if kind == 'wristband' else row.patient
+    key = (kind, row.site_code, row.id, patient.updated_at, fmt)
+    cache = _label_cache()
+    rendered = cache.get(key) if cache is not None else None
+    if rendered is None:
+        fields = wristband_layout(row) if kind == 'wristband' else specimen_layout(row)
+        rendered = render_zpl(kind, fields).encode('utf-8') if fmt == 'zpl' else render_pdf_page(kind, fields)
+        if cache is not None:
+            cache.set(key, rendered)
+    return rendered
+
+
+def render_labels(kind, ids, fmt):
+    """Render a batch of labels; returns (document bytes, number of labels)"""
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown label format {fmt!r}")
+    rendered = [_render_one(kind, row, fmt) for row in _rows(kind, ids)]
+    if not rendered:
+        raise ValueError("Nothing to print")
+    if fmt == 'zpl':
+        return b''.join(rendered), len(rendered)
+    return assemble_pdf(kind, rendered), len(rendered)
+
+
+# --- Output ---
+
+def send_to_printer(document, fmt, job_name):
+    """Deliver a rendered job to LABEL_PRINTER; returns where it went"""
+    target = current_app.config['LABEL_PRINTER']
+    if target.startswith('tcp://'):
+        address = urlparse(target)
+        with socket.create_connection((address.hostname, address.port or 9100), timeout=10) as connection:
+            connection.sendall(document)
+        return target
+
+    os.makedirs(target, exist_ok=True)
+    name = f"{datetime.utcnow().strftime('%Y%m%d%H%M%S%f')}-{job_name}.{fmt}"
+    path = os.path.join(target, name)
+    # Spool watchers must never pick up a half-written job
+    with open(path + '.tmp', 'wb') as f:
+        f.write(document)
+    os.replace(path + '.tmp', path)
+    return path
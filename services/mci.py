@@ -0,0 +1,147 @@
+"""Mass-casualty incident (MCI) registration.
+
+During an MCI, staff cannot run the full registration form for every casualty.
+register_casualties() creates any number of placeholder patients in one
+transaction. Each gets an automatically allocated MRN, a name derived from
+the incident tag ("Unknown", "MCI-20240501-1403 #017") and the initial triage
+category assigned at the scene. All ID bands for the incident can then be
+printed in one go.
+
+A placeholder is resolved later in one of two ways:
+
+* identify_placeholder() writes the real identity onto it. The record,
+  its MRN and its band stay valid.
+* merge_placeholder() moves its encounter rows onto the existing record of
+  a known patient. The placeholder is kept, pointing at that record
+  (merged_into), so anything still carrying the band's MRN, such as an
+  external lab result, can still be matched.
+
+MRNs come from a counter row per prefix (MrnSequence). A whole batch is
+reserved with a single UPDATE, which also serialises concurrent
+registrations. The prefix defaults to the site code. Nodes that register
+patients independently, such as edge installations, need their own
+MRN_PREFIX so their numbers cannot collide.
+"""
+from datetime import date, datetime
+
+from flask import current_app
+
+from app import db
+from services.sites import current_site_code
+from models import Patient, Triage, MrnSequence
+
+TRIAGE_CATEGORIES = ('red', 'yellow', 'green', 'black')
+
+# Upper bound on one registration batch, against typos like 1000 for 100
+MAX_CASUALTIES_PER_BATCH = 500
+
+# Placeholder identity, until the patient is identified
+PLACEHOLDER_FIRST_NAME = 'Unknown'
+PLACEHOLDER_DATE_OF_BIRTH = date(1900, 1, 1)
+PLACEHOLDER_GENDER = 'Unknown'
+
+# Encounter relationships moved when a placeholder is merged; single ones conflict if both patients have one
+SINGLE_ENCOUNTER_ROWS = ('triage', 'disposition')
+MULTIPLE_ENCOUNTER_ROWS = ('nurse_assessments', 'doctor_examinations', 'lab_requests', 'prescriptions')
+
+
+def new_incident_code():
+    return f"MCI-{datetime.now().strftime('%Y%m%d-%H%M')}"
+
+
+def mrn_prefix():
+    return current_app.config['MRN_PREFIX'] or current_site_code()
+
+
+def allocate_mrns(count, prefix=None):
+    """Reserve `count` consecutive MRNs in the current transaction and return them"""
+    prefix = prefix or mrn_prefix()
+    sequence = MrnSequence.__table__
+    reserved = db.session.execute(
+        sequence.update()
+        .where(sequence.c.prefix == prefix)
+        .values(next_value=sequence.c.next_value + count)
+        .returning(sequence.c.next_value)
+    ).scalar()
+    if reserved is None:
+        db.session.execute(sequence.insert().values(prefix=prefix, next_value=count + 1))
+        reserved = count + 1
+    return [f"{prefix}-{value:07d}" for value in range(reserved - count, reserved)]
+
+
+def register_casualties(incident_code, counts, arrival_mode, triaged_by):
+    """Create placeholder patients with their initial triage; `counts` is {category: number}.
+
+    Adds everything to the session and flushes it in one batch; the caller commits.
+    """
+    total = sum(counts.get(category, 0) for category in TRIAGE_CATEGORIES)
+    if total <= 0:
+        raise ValueError("Enter the number of casualties for at least one triage category")
+    if total > MAX_CASUALTIES_PER_BATCH:
+        raise ValueError(f"At most {MAX_CASUALTIES_PER_BATCH} casualties can be registered at once")
+
+    mrns = iter(allocate_mrns(total))
+    number = Patient.query.filter_by(incident_code=incident_code).count()
+    patients = []
+    for category in TRIAGE_CATEGORIES:
+        for _ in range(counts.get(category, 0)):
+            number += 1
+            patient = Patient(
+                medical_record_number=next(mrns),
+                first_name=PLACEHOLDER_FIRST_NAME,
+                last_name=f"{incident_code} #{number:03d}",
+                date_of_birth=PLACEHOLDER_DATE_OF_BIRTH,
+                gender=PLACEHOLDER_GENDER,
+                arrival_mode=arrival_mode,
+                referral_source=f"Mass-casualty incident {incident_code}",
+                is_placeholder=True,
+                incident_code=incident_code
+            )
+            patient.triage = Triage(
+                category=category,
+                reason=f"Mass-casualty incident {incident_code}: initial triage",
+                triaged_by=triaged_by
+            )
+            patients.append(patient)
+
+    db.session.add_all(patients)
+    db.session.flush()
+    return patients
+
+
+def incident_patients(incident_code):
+    """Placeholder patients of an incident that have not been merged away, in registration order"""
+    return Patient.query.filter(
+        Patient.incident_code == incident_code,
+        Patient.merged_into_id.is_(None)
+    ).order_by(Patient.id).all()
+
+
+def identify_placeholder(patient, **identity):
+    """Replace a placeholder's identity with the patient's real details"""
+    if not patient.is_placeholder:
+        raise ValueError("Patient has already been identified")
+    for key, value in identity.items():
+        setattr(patient, key, value)
+    patient.is_placeholder = False
+
+
+def merge_placeholder(placeholder, target):
+    """Move a placeholder's encounter rows onto `target`, the patient's existing record"""
+    if not placeholder.is_placeholder or placeholder.merged_into_id is not None:
+        raise ValueError("Only an unresolved placeholder can be merged")
+    if target.id == placeholder.id or target.merged_into_id is not None:
+        raise ValueError("Choose the patient's own existing record to merge into")
+    for name in SINGLE_ENCOUNTER_ROWS:
+        if getattr(placeholder, name) is not None and getattr(target, name) is not None:
+            raise ValueError(f"Both records have a {name}; resolve it on the existing record first")
+
+    # Through the ORM rather than a bulk UPDATE, so the change log and audit log see every row
+    for name in SINGLE_ENCOUNTER_ROWS:
+        row = getattr(placeholder, name)
+        if row is not None:
+            row.patient = target
+    for name in MULTIPLE_ENCOUNTER_ROWS:
+        for row in list(getattr(placeholder, name)):
+            row.patient = target
+    placeholder.merged_into_id = target.id
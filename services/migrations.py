@@ -0,0 +1,122 @@
+"""Bring existing databases up to the current models.
+
+db.create_all() creates missing tables but never alters existing ones, so
+a database created by an earlier release lacks the columns added since
+(site_code, uid, version, bed_id, test_catalog_id, updated_at,
+is_placeholder, merged_into_id, acknowledged_warnings, the clinician id
+columns, ...) and every query on those tables fails. upgrade_schema()
+runs at startup, right after create_all() and before anything queries the
+new columns. It compares each table with its model, adds the missing
+columns and indexes, and fills in the added columns of existing rows:
+
+- site_code: the site the database belongs to (SITE_CODE, or the site of
+  a SITE_DATABASES entry)
+- columns with a constant default (version, is_placeholder): that default
+- uid: a new uid per row
+- updated_at: the row's created_at
+
+The clinician id columns (doctor_id, requested_by_id, ...) are resolved
+from the stored names by backfill_clinician_ids() in the same startup;
+names it cannot resolve are reported, and backfill_clinicians.py can be
+run again later (e.g. with --create-missing). Other added columns stay
+NULL, which is what they mean for old rows (no bed held, no overridden
+warnings, not merged). test_catalog_id is linked by load_test_catalog.py
+once the catalog is loaded.
+
+Added NOT NULL columns carry their fill value as the column default,
+because existing rows need a value when the column is added. Running on
+an up-to-date database only reads the schema.
+"""
+import logging
+
+from flask import g
+from sqlalchemy import bindparam, column as sql_column, inspect, literal, select, table as sql_table
+
+from app import db
+from services.clinicians import CLINICIAN_COLUMNS, backfill_clinician_ids
+
+CLINICIAN_ID_COLUMNS = {f"{model.__tablename__}.{id_column}" for model, _, id_column, _ in CLINICIAN_COLUMNS}
+
+
+def _fill_value(column, site_code):
+    """Value for the existing rows of an added column, or None to leave them NULL"""
+    if column.name == 'site_code':
+        return site_code
+    if column.default is not None and column.default.is_scalar:
+        return column.default.arg
+    return None
+
+
+def _add_column(connection, table, column, site_code):
+    dialect = connection.dialect
+    preparer = dialect.identifier_preparer
+    ddl = (f"ALTER TABLE {preparer.format_table(table)} "
+           f"ADD COLUMN {preparer.format_column(column)} {column.type.compile(dialect=dialect)}")
+    value = _fill_value(column, site_code)
+    if value is not None:
+        default = literal(value, column.type).compile(dialect=dialect, compile_kwargs={'literal_binds': True})
+        ddl += f" DEFAULT {default}"
+        if not column.nullable:
+            ddl += " NOT NULL"
+    for foreign_key in column.foreign_keys:
+        target = foreign_key.column
+        ddl += f" REFERENCES {preparer.format_table(target.table)} ({preparer.format_column(target)})"
+    connection.exec_driver_sql(ddl)
+
+
+def _fill_rows(connection, table, column):
+    """Fill the existing rows of an added column whose value differs per row"""
+    # A bare table clause, so the model's onupdate defaults (updated_at) are not applied
+    rows = sql_table(table.name, sql_column('id'), sql_column('uid'), sql_column('created_at'), sql_column('updated_at'))
+    if column.name == 'uid':
+        ids = connection.execute(select(rows.c.id).where(rows.c.uid.is_(None))).scalars().all()
+        if ids:
+            connection.execute(
+                rows.update().where(rows.c.id == bindparam('row_id')).values(uid=bindparam('new_uid')),
+                [{'row_id': row_id, 'new_uid': column.default.arg(None)} for row_id in ids]
+            )
+        if column.unique:
+            # SQLite cannot add a UNIQUE column, so uniqueness comes from an index once every row has a uid
+            db.Index(f"uq_{table.name}_uid", column, unique=True).create(connection)
+    elif column.name == 'updated_at' and 'created_at' in table.c:
+        connection.execute(rows.update().where(rows.c.updated_at.is_(None)).values(updated_at=rows.c.created_at))
+
+
+def _backfill_clinicians(engine, site_code):
+    # backfill_clinician_ids() works through the session; a site database is reached through g.site_code
+    g.site_code = None if engine is db.engine else site_code
+    try:
+        updated, unresolved = backfill_clinician_ids()
+    finally:
+        g.pop('site_code', None)
+    logging.info("Linked %d rows of the %s database to clinician accounts", updated, site_code)
+    if unresolved:
+        logging.warning("%d clinician names in the %s database match no account, or more than one; "
+                        "see backfill_clinicians.py", len(unresolved), site_code)
+
+
+def upgrade_schema(engine, site_code):
+    """Add the model columns and indexes an existing database lacks; returns the added columns as 'table.column'"""
+    added = []
+    with engine.begin() as connection:
+        inspector = inspect(connection)
+        existing_tables = set(inspector.get_table_names())
+        for table in db.metadata.sorted_tables:
+            if table.name not in existing_tables:
+                continue
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+                _add_column(connection, table, column, site_code)
+                _fill_rows(connection, table, column)
+                added.append(f"{table.name}.{column.name}")
+            existing_indexes = {index['name'] for index in inspector.get_indexes(table.name)}
+            for index in table.indexes:
+                if index.name not in existing_indexes:
+                    index.create(connection)
+    if added:
+        logging.info("Added %d columns to the %s database: %s", len(added), site_code, ', '.join(added))
+    if CLINICIAN_ID_COLUMNS.intersection(added):
+        _backfill_clinicians(engine, site_code)
+    return added
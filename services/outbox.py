@@ -0,0 +1,293 @@
+"""Transactional outbox: clinical events for billing, the inpatient HIS and pharmacy.
+
+Downstream systems hear about completed dispositions, prescriptions and
+lab results through events. A request never talks to them itself. Instead,
+a session hook writes an OutboxEvent row for every subscribed destination
+in the same flush as the change. The event is stored only if the change is
+committed, and a slow or unreachable downstream system cannot delay or fail
+a clinician's request.
+
+outbox_relay.py delivers the stored events. Per destination, events go out
+in id order, in batches, and a batch is marked delivered only after the
+destination has accepted it. Delivery is at least once: a relay that dies
+after sending but before marking sends the batch again, so receivers
+de-duplicate on event_id. A failed batch is retried with exponential
+backoff. Later events wait behind it, which keeps each destination's
+events in order. Run a single relay per database.
+
+Destinations are configured in OUTBOX_DESTINATIONS as a JSON object:
+
+    {"billing":  {"url": "http://billing:8090/events", "events": ["disposition.*", "prescription.dispensed"]},
+     "pharmacy": {"file": "instance/outbox/pharmacy.jsonl", "events": ["prescription.*"]}}
+
+An "url" destination receives POST {"events": [...]} and must answer 2xx.
+A "file" destination appends one JSON event per line. "events" holds
+fnmatch patterns of the event types to deliver (default: all). Optional
+keys are "batch_size" (default 100) and "timeout" (seconds, default 10).
+outbox_sink_standin.py is a local HTTP receiver for testing. Events are
+only written for destinations configured when the change is made.
+
+Event types:
+
+* disposition.completed: discharge, referral, inpatient transfer with a bed, or death documented
+* prescription.created, prescription.dispensed
+* lab_request.created, lab_result.completed
+"""
+import json
+import logging
+import os
+import random
+from datetime import date, datetime, timedelta
+from fnmatch import fnmatch
+
+from flask import current_app
+from sqlalchemy import event, func, inspect
+
+from app import db
+from models import Patient, LabRequest, Prescription, Disposition, OutboxEvent, new_uid
+from services.eligibility import ConnectionPool
+from services.sites import current_site_code
+
+DEFAULT_DESTINATION = {'events': ['*'], 'batch_size': 100, 'timeout': 10.0}
+
+# Backoff after a failed delivery: RETRY_BASE * 2^(attempts - 1) seconds, at most RETRY_MAX, with jitter
+RETRY_BASE_SECONDS = 1.0
+RETRY_MAX_SECONDS = 300.0
+
+
+def parse_destinations(value):
+    """Parse OUTBOX_DESTINATIONS (JSON) into {name: destination settings}"""
+    if not value.strip():
+        return {}
+    destinations = {}
+    for name, settings in json.loads(value).items():
+        if ('url' in settings) == ('file' in settings):
+            raise ValueError(f"Outbox destination {name!r} needs exactly one of 'url' and 'file'")
+        destinations[name] = {**DEFAULT_DESTINATION, **settings}
+    return destinations
+
+
+# --- Capture ---
+
+def _encode(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _became_true(obj, attribute):
+    history = inspect(obj).attrs[attribute].history
+    return bool(history.added) and history.added[0] is True and True not in (history.deleted or ())
+
+
+def _events_for(session, obj):
+    """Event types that a pending change to `obj` raises"""
+    is_new = obj in session.new
+    if isinstance(obj, Disposition):
+        if _became_true(obj, 'is_completed'):
+            return ['disposition.completed']
+    elif isinstance(obj, Prescription):
+        types = ['prescription.created'] if is_new else []
+        if _became_true(obj, 'is_dispensed'):
+            types.append('prescription.dispensed')
+        return types
+    elif isinstance(obj, LabRequest):
+        types = ['lab_request.created'] if is_new else []
+        if _became_true(obj, 'is_completed'):
+            types.append('lab_result.completed')
+        return types
+    return []
+
+
+def _patient_data(patient):
+    if patient is None:
+        return None
+    return {
+        'uid': patient.uid,
+        'medical_record_number': patient.medical_record_number,
+        'first_name': patient.first_name,
+        'last_name': patient.last_name,
+        'date_of_birth': _encode(patient.date_of_birth),
+        'gender': patient.gender,
+    }
+
+
+def build_events(event_type, row, patient):
+    """OutboxEvent rows, one per destination subscribed to `event_type`, reporting `row`"""
+    destinations = [
+        name for name, destination in current_app.config['OUTBOX_DESTINATIONS'].items()
+        if any(fnmatch(event_type, pattern) for pattern in destination['events'])
+    ]
+    if not destinations:
+        return []
+    if row.uid is None:
+        row.uid = new_uid()
+    envelope = {
+        'type': event_type,
+        'occurred_at': datetime.utcnow().isoformat(),
+        'site_code': row.site_code or current_site_code(),
+        'table': row.__tablename__,
+        'uid': row.uid,
+        'patient': _patient_data(patient),
+        'data': {column.key: _encode(getattr(row, column.key)) for column in row.__table__.columns},
+    }
+    events = []
+    for destination in destinations:
+        event_id = new_uid()
+        events.append(OutboxEvent(
+            event_id=event_id,
+            destination=destination,
+            event_type=event_type,
+            payload={'event_id': event_id, **envelope}
+        ))
+    return events
+
+
+def _capture_events(session, flush_context, instances):
+    events = []
+    for obj in list(session.new) + list(session.dirty):
+        if not isinstance(obj, (Disposition, Prescription, LabRequest)):
+            continue
+        for event_type in _events_for(session, obj):
+            patient = session.get(Patient, obj.patient_id) if obj.patient_id else None
+            events.extend(build_events(event_type, obj, patient))
+    session.add_all(events)
+
+
+def install_outbox():
+    """Write outbox events in the same flush as the changes they report"""
+    event.listen(db.session, 'before_flush', _capture_events)
+
+
+def record_bulk_events(model, ids, event_type):
+    """Outbox events for rows changed with bulk UPDATE statements, which bypass the session hook"""
+    if not current_app.config.get('OUTBOX_DESTINATIONS') or not ids:
+        return
+    for row in model.query.filter(model.id.in_(ids)):
+        db.session.add_all(build_events(event_type, row, row.patient))
+
+
+# --- Delivery ---
+
+class DeliveryError(Exception):
+    """Raised when a destination does not accept a batch"""
+
+
+class HttpSink:
+    def __init__(self, url, timeout):
+        self.url = url
+        self.pool = ConnectionPool(url, max_size=1, timeout=timeout)
+
+    def send(self, events):
+        status, body = self.pool.post_json({'events': events})
+        if not 200 <= status < 300:
+            message = (body or {}).get('error') if isinstance(body, dict) else None
+            raise DeliveryError(f"HTTP {status}" + (f": {message}" if message else ''))
+
+
+class FileSink:
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, events):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(''.join(json.dumps(event) + '\n' for event in events))
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def make_sink(destination):
+    if 'url' in destination:
+        return HttpSink(destination['url'], destination['timeout'])
+    return FileSink(destination['file'])
+
+
+def retry_delay(attempts):
+    delay = min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+    return delay * random.uniform(0.5, 1.0)
+
+
+class OutboxRelay:
+    def __init__(self, destinations):
+        self.destinations = destinations
+        self.sinks = {name: make_sink(destination) for name, destination in destinations.items()}
+        self.stats = {'delivered': 0, 'batches': 0, 'failures': 0}
+
+    def deliver_batch(self, name, now=None):
+        """Send the oldest undelivered events of one destination; returns the number delivered"""
+        now = now or datetime.utcnow()
+        rows = OutboxEvent.query.filter(
+            OutboxEvent.destination == name,
+            OutboxEvent.delivered_at.is_(None)
+        ).order_by(OutboxEvent.id).limit(self.destinations[name]['batch_size']).all()
+        if not rows:
+            return 0
+        head = rows[0]
+        if head.next_attempt_at is not None and head.next_attempt_at > now:
+            # Still backing off; later events wait so the destination sees them in order
+            return 0
+
+        try:
+            self.sinks[name].send([row.payload for row in rows])
+        except Exception as e:
+            # The head carries the retry state, since the batch starts with it next time too
+            head.attempts += 1
+            head.next_attempt_at = now + timedelta(seconds=retry_delay(head.attempts))
+            head.last_error = str(e)[:1000]
+            db.session.commit()
+            self.stats['failures'] += 1
+            logging.warning("Outbox delivery to %s failed (attempt %d), retrying after %s: %s",
+                            name, head.attempts, head.next_attempt_at, e)
+            return 0
+
+        OutboxEvent.query.filter(OutboxEvent.id.in_([row.id for row in rows])).update(
+            {'delivered_at': now, 'next_attempt_at': None}, synchronize_session=False
+        )
+        db.session.commit()
+        self.stats['delivered'] += len(rows)
+        self.stats['batches'] += 1
+        return len(rows)
+
+    def run_once(self):
+        """One delivery round over all destinations; returns the number of events delivered"""
+        return sum(self.deliver_batch(name) for name in self.destinations)
+
+
+def purge_delivered(retention_days):
+    """Remove events delivered more than `retention_days` ago; returns how many"""
+    cutoff = datetime.utcnow() - timedelta(days=retention_days)
+    removed = OutboxEvent.query.filter(OutboxEvent.delivered_at < cutoff).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+
+def outbox_metrics(window_seconds=300):
+    """Backlog and recent throughput per destination, from the outbox table"""
+    now = datetime.utcnow()
+    since = now - timedelta(seconds=window_seconds)
+    pending = dict(db.session.query(OutboxEvent.destination, func.count(OutboxEvent.id)).filter(
+        OutboxEvent.delivered_at.is_(None)
+    ).group_by(OutboxEvent.destination).all())
+    oldest = dict(db.session.query(OutboxEvent.destination, func.min(OutboxEvent.created_at)).filter(
+        OutboxEvent.delivered_at.is_(None)
+    ).group_by(OutboxEvent.destination).all())
+    delivered = dict(db.session.query(OutboxEvent.destination, func.count(OutboxEvent.id)).filter(
+        OutboxEvent.delivered_at >= since
+    ).group_by(OutboxEvent.destination).all())
+
+    metrics = {}
+    for name in current_app.config['OUTBOX_DESTINATIONS']:
+        head = OutboxEvent.query.filter(
+            OutboxEvent.destination == name, OutboxEvent.delivered_at.is_(None)
+        ).order_by(OutboxEvent.id).first()
+        metrics[name] = {
+            'pending': pending.get(name, 0),
+            'oldest_pending_seconds': round((now - oldest[name]).total_seconds(), 1) if name in oldest else None,
+            'delivered_per_second': round(delivered.get(name, 0) / window_seconds, 2),
+            'failed_attempts': head.attempts if head else 0,
+            'last_error': head.last_error if head else None,
+        }
+    return metrics
@@ -0,0 +1,114 @@
+"""Monthly partition maintenance for the high-volume tables on Postgres.
+
+With PARTITION_TABLES enabled, models.py declares LabRequest, ExternalLabResult,
+Prescription and Triage as range partitioned by month on their timestamp
+column. Postgres does not create partitions on its own, so this module
+creates the current and upcoming months ahead of time (at startup and from
+maintain_partitions.py on a daily schedule), plus a default partition so an
+out-of-range timestamp never fails an insert.
+
+Rows for a month without a partition land in the default partition, e.g.
+after a missed maintenance run or with back-dated data. Postgres then
+refuses to create that month's partition, because the default partition
+holds rows that belong in it. Each partition is created on its own, so
+such a month is logged and skipped without affecting the others, and
+never stops the application from starting. maintain_partitions.py, run
+with --move-default-rows, creates these months properly: it detaches the
+default partition, creates the month, moves the month's rows over and
+reattaches the default partition. Detaching locks the table, so do this
+outside busy hours.
+
+Partitioning applies to tables created fresh by db.create_all(); converting
+an existing unpartitioned table is a one-off migration.
+"""
+import logging
+from datetime import datetime
+
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from app import db
+from models import Triage, LabRequest, Prescription, ExternalLabResult
+
+PARTITIONED_MODELS = {
+    LabRequest: 'requested_at',
+    ExternalLabResult: 'result_date',
+    Prescription: 'prescribed_at',
+    Triage: 'triaged_at',
+}
+
+
+def _add_months(month_start, count):
+    month_index = month_start.year * 12 + month_start.month - 1 + count
+    return datetime(month_index // 12, month_index % 12 + 1, 1)
+
+
+def partition_name(table_name, month_start):
+    return f"{table_name}_y{month_start.year}m{month_start.month:02d}"
+
+
+def _create_month_partition(table_name, start, end):
+    db.session.execute(text(
+        f'CREATE TABLE IF NOT EXISTS "{partition_name(table_name, start)}" '
+        f'PARTITION OF "{table_name}" '
+        f"FOR VALUES FROM ('{start:%Y-%m-%d}') TO ('{end:%Y-%m-%d}')"
+    ))
+
+
+def _move_default_rows(model, start, end):
+    """Create a month's partition and move its rows out of the default partition"""
+    table_name = model.__tablename__
+    column = PARTITIONED_MODELS[model]
+    default = f"{table_name}_default"
+    in_month = f""""{column}" >= '{start:%Y-%m-%d}' AND "{column}" < '{end:%Y-%m-%d}'"""
+    db.session.execute(text(f'ALTER TABLE "{table_name}" DETACH PARTITION "{default}"'))
+    _create_month_partition(table_name, start, end)
+    moved = db.session.execute(text(f'INSERT INTO "{table_name}" SELECT * FROM "{default}" WHERE {in_month}')).rowcount
+    db.session.execute(text(f'DELETE FROM "{default}" WHERE {in_month}'))
+    db.session.execute(text(f'ALTER TABLE "{table_name}" ATTACH PARTITION "{default}" DEFAULT'))
+    logging.info("Moved %d rows of %s from %s into %s", moved, f"{start:%Y-%m}", default,
+                 partition_name(table_name, start))
+
+
+def ensure_partitions(months_ahead=3, months_back=0, now=None, move_default_rows=False):
+    """Create monthly partitions from `months_back` before to `months_ahead` after the current month.
+
+    A partition that cannot be created is logged and skipped. With `move_default_rows`, a
+    month whose rows already sit in the default partition gets its partition and its rows.
+    """
+    now = now or datetime.utcnow()
+    current = datetime(now.year, now.month, 1)
+    created = 0
+    failed = 0
+
+    for model in PARTITIONED_MODELS:
+        table_name = model.__tablename__
+        db.session.execute(text(
+            f'CREATE TABLE IF NOT EXISTS "{table_name}_default" PARTITION OF "{table_name}" DEFAULT'
+        ))
+        db.session.commit()
+        for offset in range(-months_back, months_ahead + 1):
+            start = _add_months(current, offset)
+            end = _add_months(start, 1)
+            try:
+                with db.session.begin_nested():
+                    _create_month_partition(table_name, start, end)
+            except SQLAlchemyError as e:
+                if not move_default_rows:
+                    failed += 1
+                    logging.warning("Could not create partition %s, probably because %s_default holds rows "
+                                    "of that month; run maintain_partitions.py --move-default-rows: %s",
+                                    partition_name(table_name, start), table_name, e)
+                    continue
+                try:
+                    with db.session.begin_nested():
+                        _move_default_rows(model, start, end)
+                except SQLAlchemyError as e:
+                    failed += 1
+                    logging.error("Could not create partition %s: %s", partition_name(table_name, start), e)
+                    continue
+            created += 1
+        db.session.commit()
+
+    logging.info("Ensured %d monthly partitions, %d failed", created, failed)
+    return created
@@ -0,0 +1,217 @@
+"""Staff roster: who is on duty when.
+
+Each rostered shift is a Shift row covering [starts_at, ends_at) in local
+clock time, the way rosters are written. "Who is on duty at T" is an
+interval stabbing query:
+
+* on Postgres it uses the GiST index on tsrange(starts_at, ends_at)
+  (ix_shift_period), with the range containment operator @>;
+* elsewhere it uses the ix_shift_site_starts_at index, sorted by start.
+  No shift is longer than MAX_SHIFT_HOURS, so a shift on duty at T
+  started within that window. The query scans only that slice of the
+  index instead of every shift that ever started before T.
+
+The dashboard asks for the current roster on every load, but the roster only
+changes at shift boundaries. current_roster() therefore keeps a snapshot
+per site. It is valid until the earliest shift end among those on duty or
+the next shift start, whichever comes first. It is also capped at
+ROSTER_CACHE_MAX_AGE, so a roster imported in another worker process
+shows up within that time. An upload on /admin/roster drops this
+process's snapshot at once.
+
+Monthly rosters are imported as CSV (import_roster.py, or the upload on
+/admin/roster) with one row per shift:
+
+    username,date,shift[,role]
+    nurse1,2024-05-01,M
+    doctor1,2024-05-01,19:00-07:00,doctor
+
+`shift` is a code from SHIFT_PATTERNS or a HH:MM-HH:MM range; a range that
+ends at or before its start finishes the next day. `role` defaults to the
+staff member's account role. By default an import replaces the site's
+shifts that start within the dates it covers, so a corrected roster can
+simply be imported again.
+"""
+import csv
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+from flask import current_app
+from sqlalchemy import insert
+
+from app import db
+from models import Shift, User
+from services.sites import current_site_code
+
+# Longest shift accepted; bounds the index scan of the on-duty query
+MAX_SHIFT_HOURS = 24
+
+# Standard shift codes: (start, end) as HH:MM
+SHIFT_PATTERNS = {
+    'M': ('07:00', '15:00'),   # Morning
+    'E': ('15:00', '23:00'),   # Evening
+    'N': ('23:00', '07:00'),   # Night, ends the next morning
+    'D': ('07:00', '19:00'),   # Long day
+    'L': ('19:00', '07:00'),   # Long night
+}
+
+RosterEntry = namedtuple('RosterEntry', 'user_id full_name role starts_at ends_at')
+
+
+def on_duty_criteria(at):
+    """Filter for shifts on duty at `at`, using the interval index of the database in use"""
+    criteria = [Shift.starts_at <= at, Shift.ends_at > at]
+    if db.session.get_bind(mapper=Shift.__mapper__).dialect.name == 'postgresql':
+        criteria.append(db.func.tsrange(Shift.starts_at, Shift.ends_at).op('@>')(db.cast(at, db.DateTime)))
+    else:
+        criteria.append(Shift.starts_at > at - timedelta(hours=MAX_SHIFT_HOURS))
+    return criteria
+
+
+def on_duty(at):
+    """Roster entries on duty at `at`, by role and name"""
+    rows = db.session.query(
+        Shift.user_id, User.full_name, Shift.role, Shift.starts_at, Shift.ends_at
+    ).join(User, User.id == Shift.user_id).filter(
+        *on_duty_criteria(at)
+    ).order_by(Shift.role, User.full_name).all()
+    return [RosterEntry(*row) for row in rows]
+
+
+def next_shift_start(after):
+    return db.session.query(db.func.min(Shift.starts_at)).filter(Shift.starts_at > after).scalar()
+
+
+class RosterCache:
+    """Current-roster snapshot per site, kept until the next shift boundary"""
+
+    def __init__(self):
+        self.entries = {}
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'refreshes': 0}
+
+    def get(self, site_code, max_age):
+        now = datetime.now()
+        with self.lock:
+            entry = self.entries.get(site_code)
+            if entry is not None:
+                valid_until, expires, snapshot = entry
+                if now < valid_until and time.monotonic() < expires:
+                    self.stats['hits'] += 1
+                    return snapshot
+
+        snapshot = on_duty(now)
+        boundaries = [entry.ends_at for entry in snapshot]
+        next_start = next_shift_start(now)
+        if next_start is not None:
+            boundaries.append(next_start)
+        valid_until = min(boundaries, default=datetime.max)
+        with self.lock:
+            self.entries[site_code] = (valid_until, time.monotonic() + max_age, snapshot)
+            self.stats['refreshes'] += 1
+        return snapshot
+
+    def invalidate(self):
+        with self.lock:
+            self.entries.clear()
+
+
+roster_cache = RosterCache()
+
+
+def current_roster(role=None):
+    """Staff on duty now at the current site, optionally only those with `role`"""
+    snapshot = roster_cache.get(current_site_code(), current_app.config['ROSTER_CACHE_MAX_AGE'])
+    if role is None:
+        return snapshot
+    return [entry for entry in snapshot if entry.role == role]
+
+
+# --- Import ---
+
+def _clock(value, line_number):
+    try:
+        return datetime.strptime(value.strip(), '%H:%M').time()
+    except ValueError:
+        raise ValueError(f"Line {line_number}: invalid time {value!r}, expected HH:MM")
+
+
+def shift_interval(day, shift, line_number=None):
+    """(starts_at, ends_at) of a shift code or HH:MM-HH:MM range worked on `day`"""
+    shift = shift.strip()
+    if shift.upper() in SHIFT_PATTERNS:
+        start, end = SHIFT_PATTERNS[shift.upper()]
+    elif '-' in shift:
+        start, end = shift.split('-', 1)
+    else:
+        raise ValueError(f"Line {line_number}: unknown shift {shift!r}")
+    starts_at = datetime.combine(day, _clock(start, line_number))
+    ends_at = datetime.combine(day, _clock(end, line_number))
+    if ends_at <= starts_at:
+        ends_at += timedelta(days=1)
+    if ends_at - starts_at > timedelta(hours=MAX_SHIFT_HOURS):
+        raise ValueError(f"Line {line_number}: shifts cannot be longer than {MAX_SHIFT_HOURS} hours")
+    return starts_at, ends_at
+
+
+def parse_roster_csv(lines):
+    """Roster rows from CSV text lines; raises ValueError naming the first bad line"""
+    rows = []
+    reader = csv.DictReader(lines)
+    missing = {'username', 'date', 'shift'} - set(reader.fieldnames or ())
+    if missing:
+        raise ValueError(f"Roster is missing the column(s): {', '.join(sorted(missing))}")
+    for line_number, row in enumerate(reader, 2):
+        if not any((value or '').strip() for value in row.values()):
+            continue
+        try:
+            day = datetime.strptime(row['date'].strip(), '%Y-%m-%d').date()
+        except ValueError:
+            raise ValueError(f"Line {line_number}: invalid date {row['date']!r}, expected YYYY-MM-DD")
+        starts_at, ends_at = shift_interval(day, row['shift'], line_number)
+        rows.append({
+            'line': line_number,
+            'username': row['username'].strip(),
+            'role': (row.get('role') or '').strip() or None,
+            'starts_at': starts_at,
+            'ends_at': ends_at,
+        })
+    return rows
+
+
+def import_roster(rows, replace=True):
+    """Store parsed roster rows as shifts of the current site in one bulk insert; the caller commits.
+
+    With `replace`, the site's shifts starting on the dates the roster covers are removed first.
+    Returns the number of shifts stored.
+    """
+    if not rows:
+        raise ValueError("The roster has no shifts")
+    usernames = {row['username'] for row in rows}
+    users = {user.username: user for user in User.query.filter(User.username.in_(usernames))}
+    unknown = sorted(usernames - set(users))
+    if unknown:
+        raise ValueError(f"Unknown staff username(s): {', '.join(unknown)}")
+
+    site_code = current_site_code()
+    if replace:
+        first_day = min(row['starts_at'] for row in rows).replace(hour=0, minute=0)
+        last_day = max(row['starts_at'] for row in rows).replace(hour=0, minute=0) + timedelta(days=1)
+        # Explicit, since scripts run without a request site and would otherwise delete every site's shifts
+        Shift.query.filter(
+            Shift.site_code == site_code, Shift.starts_at >= first_day, Shift.starts_at < last_day
+        ).delete(synchronize_session=False)
+
+    db.session.execute(insert(Shift), [
+        {
+            'site_code': site_code,
+            'user_id': users[row['username']].id,
+            'role': row['role'] or users[row['username']].role,
+            'starts_at': row['starts_at'],
+            'ends_at': row['ends_at'],
+        }
+        for row in rows
+    ])
+    return len(rows)
@@ -0,0 +1,370 @@
+"""Full-text search over clinical notes and results.
+
+Doctor examinations (SOAP notes), nursing assessments and lab results
+are searchable across all patients of the site. Search never scans the
+note text itself; each database keeps an inverted index:
+
+* Postgres: every searched table has a `search_vector` tsvector column,
+  kept up to date by a BEFORE INSERT/UPDATE trigger, and a GIN index on it.
+  Fields are weighted, e.g. the assessment (diagnosis) over the plan, so
+  ts_rank_cd ranks a match in the diagnosis first. Queries use
+  websearch_to_tsquery syntax: words, "quoted phrases", OR and -word.
+* SQLite: one FTS5 table (clinical_note_fts) mirrors the notes of all
+  three tables. AFTER INSERT/UPDATE/DELETE triggers on the source tables
+  keep it current. The FTS rowid encodes the source table and row id, so a
+  trigger updates its entry by rowid rather than by scanning. Ranking is
+  bm25 with the heading fields weighted over the body, and the query
+  syntax is translated to FTS5.
+
+A search returns one page of hits, best first, and fetches one extra hit
+to tell whether there is a next page: counting every match of a common
+word on a large table costs more than the search. Highlighted snippets
+(ts_headline or snippet()) are only computed for the hits on the page.
+
+The index objects are created by install_search_index() at startup when
+they are missing (SEARCH_INDEX=1), and existing rows are indexed once.
+It runs after the schema upgrade (services/migrations.py); a table still
+lacking a column the index reads is logged and the index left for the
+next start, rather than failing the start.
+rebuild_search_index.py re-indexes existing rows in batches, e.g. after
+restoring a dump taken without the triggers.
+"""
+import logging
+import re
+from collections import namedtuple
+from datetime import datetime
+
+from markupsafe import Markup, escape
+from sqlalchemy import bindparam, inspect, text
+
+from app import db
+from models import DoctorExamination, NurseAssessment, LabRequest, Patient, Triage
+from services.sites import current_site_code
+
+# Text search configuration (stemming and stop words) used on Postgres
+TEXT_SEARCH_CONFIG = 'english'
+
+FTS_TABLE = 'clinical_note_fts'
+# FTS rowid = source row id * ROWID_SLOTS + source kind
+ROWID_SLOTS = 4
+
+# Snippet highlight markers; control characters cannot come from form input
+START_MARK, STOP_MARK = '\x02', '\x03'
+
+SearchSource = namedtuple('SearchSource', 'name model kind date_column heading body label')
+
+SOURCES = {
+    source.name: source for source in [
+        SearchSource('examination', DoctorExamination, 1, 'created_at',
+                     ['assessment'], ['subjective', 'objective', 'plan'], 'Doctor examination'),
+        SearchSource('assessment', NurseAssessment, 2, 'created_at',
+                     ['chief_complaint'], ['history', 'assessment_details'], 'Nursing assessment'),
+        SearchSource('lab_result', LabRequest, 3, 'requested_at',
+                     ['test_name'], ['result'], 'Lab result'),
+    ]
+}
+
+SearchHit = namedtuple('SearchHit', 'source id patient_id noted_at rank snippet')
+
+
+def _table(source):
+    return source.model.__tablename__
+
+
+# --- Index objects ---
+
+def _concat(row, columns, separator):
+    return f" || {separator} || ".join(f"coalesce({row}.{column}, '')" for column in columns)
+
+
+def _pg_vector(source, row):
+    heading = _concat(row, source.heading, "' '")
+    body = _concat(row, source.body, "' '")
+    return (
+        f"setweight(to_tsvector('{TEXT_SEARCH_CONFIG}', {heading}), 'A') || "
+        f"setweight(to_tsvector('{TEXT_SEARCH_CONFIG}', {body}), 'B')"
+    )
+
+
+def _postgres_ddl(source):
+    table = _table(source)
+    columns = ', '.join(source.heading + source.body)
+    return [
+        f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS search_vector tsvector",
+        f"CREATE OR REPLACE FUNCTION {table}_search_vector() RETURNS trigger AS $$ "
+        f"BEGIN NEW.search_vector := {_pg_vector(source, 'NEW')}; RETURN NEW; END $$ LANGUAGE plpgsql",
+        f"DROP TRIGGER IF EXISTS {table}_search ON {table}",
+        f"CREATE TRIGGER {table}_search BEFORE INSERT OR UPDATE OF {columns} ON {table} "
+        f"FOR EACH ROW EXECUTE FUNCTION {table}_search_vector()",
+        f"CREATE INDEX IF NOT EXISTS ix_{table}_search ON {table} USING gin (search_vector)",
+    ]
+
+
+def _sqlite_values(source, row):
+    return (
+        f"{row}.id * {ROWID_SLOTS} + {source.kind}, {_concat(row, source.heading, 'char(10)')}, "
+        f"{_concat(row, source.body, 'char(10)')}, '{source.name}', {row}.id, {row}.patient_id, "
+        f"{row}.site_code, {row}.{source.date_column}"
+    )
+
+
+_FTS_COLUMNS = 'rowid, heading, body, source, source_id, patient_id, site_code, noted_at'
+
+
+def _sqlite_ddl(source):
+    table = _table(source)
+    rowid = f"OLD.id * {ROWID_SLOTS} + {source.kind}"
+    # Also re-index when a note moves to another patient, e.g. a merged placeholder
+    columns = ', '.join(source.heading + source.body + ['patient_id', 'site_code', source.date_column])
+    return [
+        f"CREATE TRIGGER IF NOT EXISTS {table}_fts_insert AFTER INSERT ON {table} BEGIN "
+        f"INSERT INTO {FTS_TABLE}({_FTS_COLUMNS}) VALUES ({_sqlite_values(source, 'NEW')}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_fts_update AFTER UPDATE OF {columns} ON {table} BEGIN "
+        f"DELETE FROM {FTS_TABLE} WHERE rowid = {rowid}; "
+        f"INSERT INTO {FTS_TABLE}({_FTS_COLUMNS}) VALUES ({_sqlite_values(source, 'NEW')}); END",
+        f"CREATE TRIGGER IF NOT EXISTS {table}_fts_delete AFTER DELETE ON {table} BEGIN "
+        f"DELETE FROM {FTS_TABLE} WHERE rowid = {rowid}; END",
+    ]
+
+
+def _search_index_installed(connection):
+    if connection.dialect.name == 'postgresql':
+        return connection.execute(text(
+            "SELECT count(DISTINCT table_name) FROM information_schema.columns "
+            "WHERE column_name = 'search_vector' AND table_name IN :tables"
+        ).bindparams(bindparam('tables', expanding=True)), {
+            'tables': [_table(source) for source in SOURCES.values()]
+        }).scalar() == len(SOURCES)
+    return connection.execute(text(
+        "SELECT count(*) FROM sqlite_master WHERE name = :name"
+    ), {'name': FTS_TABLE}).scalar() > 0
+
+
+def _index_rows(connection, source, first_id=0, last_id=None):
+    """(Re)index the rows of `source` with first_id <= id < last_id"""
+    table = _table(source)
+    id_range = f"id >= {int(first_id)}" + (f" AND id < {int(last_id)}" if last_id is not None else '')
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text(f"UPDATE {table} SET search_vector = {_pg_vector(source, table)} WHERE {id_range}"))
+        return
+    rowid_range = f"rowid >= {int(first_id) * ROWID_SLOTS}"
+    if last_id is not None:
+        rowid_range += f" AND rowid < {int(last_id) * ROWID_SLOTS}"
+    connection.execute(text(
+        f"DELETE FROM {FTS_TABLE} WHERE {rowid_range} AND rowid % {ROWID_SLOTS} = {source.kind}"
+    ))
+    connection.execute(text(
+        f"INSERT INTO {FTS_TABLE}({_FTS_COLUMNS}) SELECT {_sqlite_values(source, table)} FROM {table} WHERE {id_range}"
+    ))
+
+
+def _missing_columns(connection):
+    """'table.column' for each column the index reads that the database does not have"""
+    inspector = inspect(connection)
+    missing = []
+    for source in SOURCES.values():
+        table = _table(source)
+        existing = {column['name'] for column in inspector.get_columns(table)}
+        for column in ['id', 'patient_id', 'site_code', source.date_column, *source.heading, *source.body]:
+            if column not in existing:
+                missing.append(f"{table}.{column}")
+    return missing
+
+
+def install_search_index(engine):
+    """Create the search index objects on `engine` if they are missing, and index existing rows"""
+    with engine.begin() as connection:
+        if _search_index_installed(connection):
+            return False
+        missing = _missing_columns(connection)
+        if missing:
+            logging.warning("Search index not installed; the database lacks %s", ', '.join(missing))
+            return False
+        if connection.dialect.name == 'postgresql':
+            for source in SOURCES.values():
+                for statement in _postgres_ddl(source):
+                    connection.execute(text(statement))
+        else:
+            connection.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+                f"heading, body, source UNINDEXED, source_id UNINDEXED, patient_id UNINDEXED, "
+                f"site_code UNINDEXED, noted_at UNINDEXED, tokenize='porter unicode61 remove_diacritics 2')"
+            ))
+            for source in SOURCES.values():
+                for statement in _sqlite_ddl(source):
+                    connection.execute(text(statement))
+        for source in SOURCES.values():
+            _index_rows(connection, source)
+    return True
+
+
+def rebuild_search_index(engine, batch_size=10000, progress=None):
+    """Re-index every row on `engine`, one transaction per batch of ids; returns the number of batches"""
+    batches = 0
+    for source in SOURCES.values():
+        with engine.connect() as connection:
+            last = connection.execute(text(f"SELECT max(id) FROM {_table(source)}")).scalar() or 0
+        for first_id in range(0, last + 1, batch_size):
+            with engine.begin() as connection:
+                _index_rows(connection, source, first_id, first_id + batch_size)
+            batches += 1
+            if progress:
+                progress(source.name, min(first_id + batch_size, last + 1), last + 1)
+    return batches
+
+
+# --- Queries ---
+
+_TERM = re.compile(r'-?"[^"]*"|\S+')
+
+
+def fts5_query(query):
+    """Translate web-style search syntax (words, "phrases", OR, -word, prefix*) to an FTS5 query"""
+    groups, excluded = [], []
+    join_next = False
+    for token in _TERM.findall(query):
+        if token == 'OR':
+            join_next = bool(groups)
+            continue
+        negated = token.startswith('-') and len(token) > 1
+        token = token[1:] if negated else token
+        prefix = token.endswith('*') and not token.startswith('"')
+        words = token.strip('"').rstrip('*') if not token.startswith('"') else token[1:-1]
+        if not words.strip():
+            continue
+        term = '"' + words.replace('"', '""') + '"' + ('*' if prefix else '')
+        if negated:
+            excluded.append(term)
+        elif join_next:
+            groups[-1].append(term)
+        else:
+            groups.append([term])
+        join_next = False
+    if not groups:
+        return None
+    expression = ' AND '.join('(' + ' OR '.join(group) + ')' for group in groups)
+    for term in excluded:
+        expression = f"({expression}) NOT {term}"
+    return expression
+
+
+def _filters(alias, source, date_from, date_to, triage, params):
+    clauses = []
+    date_column = f"{alias}.{source.date_column}" if alias else 'noted_at'
+    if date_from is not None:
+        clauses.append(f"{date_column} >= :date_from")
+        params['date_from'] = date_from
+    if date_to is not None:
+        clauses.append(f"{date_column} < :date_to")
+        params['date_to'] = date_to
+    if triage:
+        patient_column = f"{alias}.patient_id" if alias else 'patient_id'
+        clauses.append(f"{patient_column} IN (SELECT patient_id FROM triage WHERE category = :triage)")
+        params['triage'] = triage
+    return ''.join(f" AND {clause}" for clause in clauses)
+
+
+def _postgres_page(query, sources, date_from, date_to, triage, limit, offset):
+    params = {'query': query, 'site_code': current_site_code(), 'limit': limit, 'offset': offset}
+    parts = []
+    for source in sources:
+        parts.append(
+            f"SELECT '{source.name}' AS source, t.id, t.patient_id, t.{source.date_column} AS noted_at, "
+            f"ts_rank_cd(t.search_vector, query.q) AS rank FROM {_table(source)} t, query "
+            f"WHERE t.search_vector @@ query.q AND t.site_code = :site_code"
+            + _filters('t', source, date_from, date_to, triage, params)
+        )
+    rows = db.session.execute(text(
+        f"WITH query AS (SELECT websearch_to_tsquery('{TEXT_SEARCH_CONFIG}', :query) AS q) "
+        f"SELECT * FROM ({' UNION ALL '.join(parts)}) hits "
+        f"ORDER BY rank DESC, noted_at DESC LIMIT :limit OFFSET :offset"
+    ), params).all()
+
+    snippets = {}
+    options = f"StartSel={START_MARK}, StopSel={STOP_MARK}, MaxFragments=2, MaxWords=24, MinWords=8"
+    for source in sources:
+        ids = [row.id for row in rows if row.source == source.name]
+        if not ids:
+            continue
+        document = _concat('t', source.heading + source.body, "' … '")
+        for row_id, snippet in db.session.execute(text(
+            f"SELECT t.id, ts_headline('{TEXT_SEARCH_CONFIG}', {document}, "
+            f"websearch_to_tsquery('{TEXT_SEARCH_CONFIG}', :query), :options) "
+            f"FROM {_table(source)} t WHERE t.id IN :ids"
+        ).bindparams(bindparam('ids', expanding=True)), {'query': query, 'options': options, 'ids': ids}):
+            snippets[(source.name, row_id)] = snippet
+    return [
+        SearchHit(row.source, row.id, row.patient_id, row.noted_at, row.rank, snippets.get((row.source, row.id), ''))
+        for row in rows
+    ]
+
+
+def _sqlite_page(query, sources, date_from, date_to, triage, limit, offset):
+    match = fts5_query(query)
+    if match is None:
+        return []
+    params = {'match': match, 'site_code': current_site_code(), 'limit': limit, 'offset': offset}
+    source_names = ', '.join(f"'{source.name}'" for source in sources)
+    # noted_at holds the source's timestamp as SQLite stores it, so it is compared as text
+    filters = _filters(None, None, date_from and date_from.strftime('%Y-%m-%d %H:%M:%S'),
+                       date_to and date_to.strftime('%Y-%m-%d %H:%M:%S'), triage, params)
+    rows = db.session.execute(text(
+        f"SELECT rowid, source, source_id, patient_id, noted_at, bm25({FTS_TABLE}, 2.0, 1.0) AS rank "
+        f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match AND site_code = :site_code "
+        f"AND source IN ({source_names}){filters} "
+        f"ORDER BY rank LIMIT :limit OFFSET :offset"
+    ), params).all()
+    if not rows:
+        return []
+
+    snippets = dict(db.session.execute(text(
+        f"SELECT rowid, snippet({FTS_TABLE}, -1, char(2), char(3), '…', 24) "
+        f"FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :match AND rowid IN :rowids"
+    ).bindparams(bindparam('rowids', expanding=True)), {'match': match, 'rowids': [row.rowid for row in rows]}).all())
+    return [
+        SearchHit(row.source, row.source_id, row.patient_id, _parse_timestamp(row.noted_at), -row.rank,
+                  snippets.get(row.rowid, ''))
+        for row in rows
+    ]
+
+
+def _parse_timestamp(value):
+    if value is None or isinstance(value, datetime):
+        return value
+    return datetime.fromisoformat(value)
+
+
+def search_notes(query, date_from=None, date_to=None, triage=None, sources=None, page=1, per_page=20):
+    """One page of hits for `query` at the current site, best first; returns (hits, has_next).
+
+    `date_from` and `date_to` bound the note's timestamp (to is exclusive), `triage` limits it
+    to patients triaged in that category and `sources` to some of SOURCES.
+    """
+    query = (query or '').strip()
+    if not query:
+        return [], False
+    selected = [SOURCES[name] for name in (sources or SOURCES) if name in SOURCES]
+    if not selected:
+        return [], False
+    page = max(page, 1)
+    arguments = (query, selected, date_from, date_to, triage, per_page + 1, (page - 1) * per_page)
+    if db.session.get_bind(mapper=DoctorExamination.__mapper__).dialect.name == 'postgresql':
+        hits = _postgres_page(*arguments)
+    else:
+        hits = _sqlite_page(*arguments)
+    return hits[:per_page], len(hits) > per_page
+
+
+def highlight(snippet):
+    """Snippet as HTML: the note text escaped, the matched words in <mark>"""
+    return Markup(str(escape(snippet)).replace(START_MARK, '<mark>').replace(STOP_MARK, '</mark>'))
+
+
+def hit_context(hits):
+    """Patients and triage categories of a page of hits, keyed by patient id"""
+    patient_ids = {hit.patient_id for hit in hits}
+    if not patient_ids:
+        return {}, {}
+    patients = {patient.id: patient for patient in Patient.query.filter(Patient.id.in_(patient_ids))}
+    triage = dict(db.session.query(Triage.patient_id, Triage.category).filter(Triage.patient_id.in_(patient_ids)))
+    return patients, triage
@@ -0,0 +1,97 @@
+"""Facilities (sites) and per-site routing.
+
+Every patient, encounter row, ward and user belongs to a site, stored in
+its `site_code` column. The site for a web request is chosen at login and
+kept in the session (g.site_code). While it is set, every ORM query and
+bulk UPDATE/DELETE on a site-scoped model is automatically restricted to
+that site, and new rows are stamped with it. Scripts and background jobs
+do not set a site, so they see every site. New rows they create belong to
+the installation's SITE_CODE.
+
+Optionally, a site can have its own database (SITE_DATABASES). Requests
+for that site then run entirely against that database's engine and pool,
+so a large site can be sized, tuned or moved without affecting the others.
+
+This module is imported by app.py before the database extension exists,
+so it does not import app or models at module level.
+"""
+import json
+
+from flask import current_app, g, has_app_context
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event
+from sqlalchemy.orm import with_loader_criteria
+
+
+def parse_sites(value, default_code):
+    """Parse 'CODE:Name,CODE:Name' into an ordered {code: name}; always includes the default site"""
+    sites = {}
+    for item in filter(None, (part.strip() for part in value.split(','))):
+        code, _, name = item.partition(':')
+        sites[code.strip()] = name.strip() or code.strip()
+    sites.setdefault(default_code, default_code)
+    return sites
+
+
+def parse_site_databases(value):
+    """SQLALCHEMY_BINDS entries for sites with their own database.
+
+    Accepts 'CODE=url,CODE=url', or a JSON object mapping each code to a URL
+    or to a dict of engine options with a 'url' key (e.g. a pool_size per site).
+    """
+    value = value.strip()
+    if not value:
+        return {}
+    if value.startswith('{'):
+        databases = json.loads(value)
+    else:
+        databases = dict(item.split('=', 1) for item in value.split(',') if item.strip())
+    return {site_bind_key(code.strip()): options for code, options in databases.items()}
+
+
+def site_bind_key(site_code):
+    return f"site:{site_code}"
+
+
+def current_site_code():
+    """Site of the current request, or the installation's default site"""
+    if has_app_context():
+        return g.get('site_code') or current_app.config['SITE_CODE']
+    return None
+
+
+class SiteRoutingSession(Session):
+    """Session that sends default-bind queries to the current site's database, if it has one"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        engine = super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+        if bind is None and has_app_context() and g.get('site_code'):
+            engines = self._db.engines
+            site_engine = engines.get(site_bind_key(g.site_code))
+            if site_engine is not None and engine is engines[None]:
+                return site_engine
+        return engine
+
+
+def site_databases():
+    """{site code: engine} for the sites that have their own database"""
+    return {
+        key.split(':', 1)[1]: engine
+        for key, engine in current_app.extensions['sqlalchemy'].engines.items()
+        if key and key.startswith('site:')
+    }
+
+
+def install_site_scoping(session, models):
+    """Restrict ORM statements on `models` to the request's site"""
+    @event.listens_for(session, 'do_orm_execute')
+    def _scope_to_site(state):
+        site_code = g.get('site_code') if has_app_context() else None
+        if not site_code or state.is_column_load or state.execution_options.get('all_sites', False):
+            return
+        if not (state.is_select or state.is_update or state.is_delete):
+            return
+        state.statement = state.statement.options(*[
+            with_loader_criteria(model, lambda cls: cls.site_code == site_code, include_aliases=True)
+            for model in models
+        ])
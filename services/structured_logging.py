@@ -0,0 +1,227 @@
+"""Structured application logging, formatted and written off the request thread.
+
+Every handler of the root logger used to run on the thread that logged, so a
+request paid for formatting and writing each record, including the debug
+output of SQLAlchemy and werkzeug. configure_logging() installs a single
+QueueingHandler instead. It stamps each record with its request context
+and puts it on a bounded in-process queue. A QueueListener thread formats
+the queued records as JSON lines (or plain text) and writes them to stderr.
+If the listener falls behind and the queue fills up, records are dropped
+and counted rather than blocking the request. The listener is started
+lazily in each process, because threads do not survive fork, and it
+is drained at interpreter exit.
+
+Each request gets an id, taken from an incoming X-Request-ID header when a
+caller such as a proxy or another service already assigned one, so log
+lines can be correlated across systems. Incoming ids that are not short
+tokens are replaced. The id is sent back in the response header of the
+same name. With LOG_REQUESTS, one "request" record per request carries
+the method, path, status and duration.
+
+Levels come from LOG_LEVEL (the root logger) and LOG_LEVELS, which lists
+per-logger overrides as "name=LEVEL,...", for example
+"sqlalchemy.engine=INFO,werkzeug=WARNING".
+
+Log with %-style arguments, e.g. logging.info("Matched %s", result_id),
+so a disabled level costs no string formatting at all.
+"""
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import re
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+from flask import g, request, session
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+# Incoming ids are only trusted if they cannot break a log line
+VALID_REQUEST_ID = re.compile(r'[A-Za-z0-9._:-]{1,128}')
+
+# Attributes every LogRecord has; anything else on a record came from `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', None, None))) | {
+    'message', 'asctime', 'request_id', 'site_code', 'user_id',
+}
+
+TEXT_FORMAT = '%(asctime)s %(levelname)s [%(request_id)s] %(name)s: %(message)s'
+
+
+def parse_levels(value):
+    """Parse "logger=LEVEL,..." into {logger: level}"""
+    levels = {}
+    for item in value.split(','):
+        if not item.strip():
+            continue
+        name, _, level = item.partition('=')
+        if not level.strip():
+            raise ValueError(f"Invalid logger level {item!r}, expected name=LEVEL")
+        levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per record, with the request context and any `extra=` fields"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+            'site_code': getattr(record, 'site_code', None),
+            'user_id': getattr(record, 'user_id', None),
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES:
+                entry[key] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class QueueingHandler(logging.handlers.QueueHandler):
+    """Puts records on the pipeline's queue, with the request context they were logged in"""
+
+    def __init__(self, pipeline):
+        super().__init__(pipeline.queue)
+        self.pipeline = pipeline
+        self.dropped = 0
+
+    def handle(self, record):
+        # The queue is thread-safe, so the handler lock that Handler.handle() takes is not needed
+        if self.filter(record):
+            self.emit(record)
+        return record
+
+    def prepare(self, record):
+        # Merge the arguments now, since they may change before the listener gets to them.
+        # Tracebacks stay live objects and are only formatted on the listener thread.
+        if record.args:
+            record.msg = record.getMessage()
+            record.args = None
+        context = _request_context.get()
+        if context is None:
+            record.request_id = record.site_code = record.user_id = None
+        else:
+            record.request_id, record.user_id, request_globals = context
+            record.site_code = getattr(request_globals, 'site_code', None)
+        return record
+
+    def enqueue(self, record):
+        # Approximate bound: SimpleQueue has no maxsize, but is far cheaper to put to than Queue
+        if self.queue.qsize() >= self.pipeline.queue_size:
+            self.dropped += 1
+        else:
+            self.queue.put(record)
+
+    def emit(self, record):
+        self.pipeline.ensure_started()
+        super().emit(record)
+
+
+class LogPipeline:
+    def __init__(self, queue_size=10000):
+        self.queue_size = queue_size
+        self.queue = queue.SimpleQueue()
+        self.handler = QueueingHandler(self)
+        self.output = logging.StreamHandler(sys.stderr)
+        self.listener = None
+        self.pid = None
+        self.lock = threading.Lock()
+
+    def ensure_started(self):
+        # Threads do not survive fork, so a forked worker starts its own listener
+        if self.listener is not None and self.pid == os.getpid():
+            return
+        with self.lock:
+            if self.listener is None or self.pid != os.getpid():
+                self.queue = self.handler.queue = queue.SimpleQueue()
+                self.pid = os.getpid()
+                self.listener = logging.handlers.QueueListener(self.queue, self.output)
+                self.listener.start()
+
+    def stop(self):
+        """Write out everything queued so far and stop the listener"""
+        with self.lock:
+            if self.listener is not None and self.pid == os.getpid():
+                self.listener.stop()
+            self.listener = None
+
+    def snapshot(self):
+        return {'queued': self.queue.qsize(), 'dropped': self.handler.dropped}
+
+
+pipeline = LogPipeline()
+atexit.register(pipeline.stop)
+
+
+def configure_logging(level='INFO', levels=None, fmt='json', stream=None, queue_size=10000):
+    """Route all logging through the background pipeline; can be called again to reconfigure"""
+    pipeline.stop()
+    pipeline.queue_size = queue_size
+    pipeline.output = logging.StreamHandler(stream or sys.stderr)
+    pipeline.output.setFormatter(JsonFormatter() if fmt == 'json' else logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(pipeline.handler)
+    root.setLevel(level.upper())
+    for name, logger_level in (levels or {}).items():
+        logging.getLogger(name).setLevel(logger_level)
+    return pipeline
+
+
+request_logger = logging.getLogger('sigede.request')
+
+# (request id, user id, flask.g) of the request being handled. Records read it from here
+# rather than through Flask's context proxies, which cost more than the rest of prepare().
+_request_context = contextvars.ContextVar('request_log_context', default=None)
+
+
+def _start_request():
+    incoming = request.headers.get(REQUEST_ID_HEADER, '')
+    g.request_id = incoming if VALID_REQUEST_ID.fullmatch(incoming) else uuid.uuid4().hex
+    g.request_started = time.perf_counter()
+    _request_context.set((g.request_id, session.get('_user_id'), g._get_current_object()))
+
+
+def _finish_request(response):
+    response.headers[REQUEST_ID_HEADER] = g.get('request_id', '')
+    if request_logger.isEnabledFor(logging.INFO) and 'request_started' in g:
+        request_logger.info("%s %s %s", request.method, request.path, response.status_code, extra={
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round((time.perf_counter() - g.request_started) * 1000, 2),
+        })
+    return response
+
+
+def _end_request(exc):
+    # A streamed response (stream_with_context) tears the request down from inside the response
+    # generator, in another context than _start_request ran in, so the token cannot be reset there
+    _request_context.set(None)
+
+
+def install_request_logging(app, log_requests=True):
+    """Give every request an id for its log records; with `log_requests`, log each request"""
+    app.before_request(_start_request)
+    app.after_request(_finish_request)
+    app.teardown_request(_end_request)
+    if not log_requests:
+        request_logger.setLevel(logging.WARNING)
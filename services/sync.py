@@ -0,0 +1,484 @@
+"""Change capture and edge-to-central synchronisation.
+
+Edge installations (rural triage posts on a local SQLite file) record every
+change to an encounter table in the append-only ChangeLog, in the same
+transaction as the change itself. The sync agent (sync_agent.py) ships the
+unsynced part of the log to the central database in gzip-compressed
+batches, several changes to the same row collapsed into one, and pulls back
+reference data such as user accounts.
+
+Rows are identified across nodes by their `uid` (a UUID) rather than the
+per-node autoincrement id, and foreign keys travel as the referenced row's
+uid or username. Central resolves concurrent changes to the same row with
+last-writer-wins on (changed_at, node_id, change_id), so the outcome does
+not depend on the order batches arrive in, and ignores change ids it has
+already received, so a batch can be resent safely after a dropped link.
+
+Central answers a push with the outcome of every change it received. Changes
+it rejected, for example because they reference a user central does not
+know, are not marked as synced on the edge. They are marked 'rejected' with
+central's error instead, so they stay visible in the edge's change log and
+in the sync agent's output. Once the cause is fixed, `sync_agent.py
+--retry-rejected` ships them again, and central applies a change it
+rejected earlier as if it were new.
+"""
+import gzip
+import json
+import logging
+import urllib.request
+from datetime import date, datetime
+
+from flask import current_app
+from sqlalchemy import event, func, or_
+
+from app import db
+from services.lab_catalog import resolve_test
+from models import (
+    Patient, Triage, NurseAssessment, DoctorExamination, LabRequest, Prescription, Disposition,
+    User, ChangeLog, new_uid,
+)
+
+DEFAULT_BATCH_SIZE = 500
+
+# In dependency order: central applies each batch in this order
+SYNCED_MODELS = [Patient, Triage, NurseAssessment, DoctorExamination, LabRequest, Prescription, Disposition]
+MODELS_BY_TABLE = {model.__tablename__: model for model in SYNCED_MODELS}
+_SYNCED_TYPES = tuple(SYNCED_MODELS)
+
+# Local ids mean nothing on another node, so these columns carry the natural key
+FOREIGN_KEYS = {
+    'patient_id': (Patient, 'uid'),
+    'merged_into_id': (Patient, 'uid'),
+    'triaged_by': (User, 'username'),
+    'nurse_id': (User, 'username'),
+    'doctor_id': (User, 'username'),
+    'requested_by_id': (User, 'username'),
+    'prescribed_by_id': (User, 'username'),
+    'dispensed_by_id': (User, 'username'),
+    'authorized_by_id': (User, 'username'),
+}
+
+# Node-local columns that are never shipped
+LOCAL_COLUMNS = {'id', 'uid', 'version', 'bed_id', 'test_catalog_id'}
+
+# Reference data served by central: name -> (model, natural key, fields)
+REFERENCE_MODELS = {
+    'users': (User, 'username', ['email', 'password_hash', 'full_name', 'role']),
+}
+
+
+class SyncError(Exception):
+    """Raised when a change cannot be applied on the central database"""
+
+
+def make_version(changed_at, node_id, change_id):
+    return f"{changed_at.isoformat(timespec='microseconds')}|{node_id}|{change_id}"
+
+
+def _log_entry(row_uid, table_name, operation, node_id=None, changed_at=None, change_id=None):
+    node_id = node_id or current_app.config['NODE_ID']
+    changed_at = changed_at or datetime.utcnow()
+    change_id = change_id or new_uid()
+    return ChangeLog(
+        change_id=change_id,
+        node_id=node_id,
+        table_name=table_name,
+        row_uid=row_uid,
+        operation=operation,
+        changed_at=changed_at,
+        version=make_version(changed_at, node_id, change_id)
+    )
+
+
+# --- Capture ---
+
+def _capture_changes(session, flush_context, instances):
+    if session.info.get('skip_change_capture'):
+        return
+
+    entries = []
+    for obj in session.new:
+        if isinstance(obj, _SYNCED_TYPES):
+            if obj.uid is None:
+                obj.uid = new_uid()
+            entries.append(_log_entry(obj.uid, obj.__tablename__, 'upsert'))
+    for obj in session.dirty:
+        if isinstance(obj, _SYNCED_TYPES) and session.is_modified(obj, include_collections=False):
+            if obj.uid is None:
+                obj.uid = new_uid()
+            entries.append(_log_entry(obj.uid, obj.__tablename__, 'upsert'))
+    for obj in session.deleted:
+        if isinstance(obj, _SYNCED_TYPES) and obj.uid is not None:
+            entries.append(_log_entry(obj.uid, obj.__tablename__, 'delete'))
+    session.add_all(entries)
+
+
+def install_change_capture():
+    """Log every ORM change to a synced model in the same flush"""
+    event.listen(db.session, 'before_flush', _capture_changes)
+
+
+def record_changes(model, ids):
+    """Log rows changed with bulk UPDATE statements, which bypass the ORM capture"""
+    if not current_app.config.get('CHANGE_LOG') or not ids:
+        return
+    for (row_uid,) in db.session.query(model.uid).filter(model.id.in_(ids), model.uid.isnot(None)):
+        db.session.add(_log_entry(row_uid, model.__tablename__, 'upsert'))
+
+
+def snapshot_changes(batch_size=DEFAULT_BATCH_SIZE):
+    """Log an upsert for every existing row, e.g. before a node's first sync.
+
+    Rows created before uids existed are given one here.
+    """
+    total = 0
+    db.session.info['skip_change_capture'] = True
+    try:
+        for model in SYNCED_MODELS:
+            last_id = 0
+            while True:
+                rows = model.query.filter(model.id > last_id).order_by(model.id).limit(batch_size).all()
+                if not rows:
+                    break
+                for row in rows:
+                    if row.uid is None:
+                        row.uid = new_uid()
+                    db.session.add(_log_entry(row.uid, model.__tablename__, 'upsert'))
+                db.session.commit()
+                last_id = rows[-1].id
+                total += len(rows)
+    finally:
+        db.session.info.pop('skip_change_capture', None)
+    return total
+
+
+# --- Serialisation ---
+
+def _encode(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+
+def _decode(column, value):
+    if value is None:
+        return None
+    if isinstance(column.type, db.DateTime):
+        return datetime.fromisoformat(value)
+    if isinstance(column.type, db.Date):
+        return date.fromisoformat(value)
+    return value
+
+
+def _natural_keys(rows):
+    """{column: {local id: natural key}} for the foreign keys of `rows`"""
+    keys = {}
+    for column, (model, attribute) in FOREIGN_KEYS.items():
+        ids = {getattr(row, column) for row in rows if getattr(row, column, None) is not None}
+        if ids:
+            keys[column] = dict(
+                db.session.query(model.id, getattr(model, attribute)).filter(model.id.in_(ids)).all()
+            )
+    return keys
+
+
+def _serialize_row(row, natural_keys):
+    data = {}
+    for column in row.__table__.columns:
+        if column.key in LOCAL_COLUMNS:
+            continue
+        value = getattr(row, column.key)
+        if column.key in FOREIGN_KEYS and value is not None:
+            value = natural_keys[column.key].get(value)
+        data[column.key] = _encode(value)
+    return data
+
+
+def build_batch(entries):
+    """Changes to ship for a run of log entries, keeping only the latest per row.
+
+    Upserts carry the row as it is now, so earlier changes to it are covered.
+    """
+    latest = {}
+    for entry in entries:
+        latest[(entry.table_name, entry.row_uid)] = entry
+
+    rows = {}
+    for table_name in {table_name for table_name, _ in latest}:
+        model = MODELS_BY_TABLE[table_name]
+        uids = [row_uid for name, row_uid in latest if name == table_name]
+        found = model.query.filter(model.uid.in_(uids)).all()
+        natural_keys = _natural_keys(found)
+        for row in found:
+            rows[(table_name, row.uid)] = _serialize_row(row, natural_keys)
+
+    changes = []
+    for key, entry in latest.items():
+        change = {
+            'change_id': entry.change_id,
+            'node_id': entry.node_id,
+            'table': entry.table_name,
+            'row_uid': entry.row_uid,
+            'operation': entry.operation,
+            'changed_at': entry.changed_at.isoformat(),
+            'version': entry.version,
+        }
+        if entry.operation == 'upsert':
+            if key not in rows:
+                # Archived or deleted without a logged delete; nothing left to ship
+                continue
+            change['data'] = rows[key]
+        changes.append(change)
+    return changes
+
+
+# --- Edge side ---
+
+def _request(url, body=None, timeout=60):
+    config = current_app.config
+    headers = {
+        'X-Node-Id': config['NODE_ID'],
+        'X-API-Key': config['SYNC_API_KEY'],
+        'Accept-Encoding': 'gzip',
+    }
+    data = None
+    if body is not None:
+        data = gzip.compress(json.dumps(body).encode('utf-8'))
+        headers['Content-Type'] = 'application/json'
+        headers['Content-Encoding'] = 'gzip'
+    request = urllib.request.Request(url, data=data, headers=headers, method='POST' if data else 'GET')
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        payload = response.read()
+        if response.headers.get('Content-Encoding') == 'gzip':
+            payload = gzip.decompress(payload)
+    return json.loads(payload)
+
+
+def push_changes(batch_size=DEFAULT_BATCH_SIZE, max_batches=None):
+    """Ship unsynced log entries to central until none are left; returns the count shipped.
+
+    Entries of changes central rejected are marked 'rejected' rather than synced.
+    """
+    url = current_app.config['SYNC_CENTRAL_URL'].rstrip('/') + '/sync/push'
+    total = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        entries = ChangeLog.query.filter(
+            ChangeLog.synced_at.is_(None),
+            ChangeLog.status.is_(None)
+        ).order_by(ChangeLog.id).limit(batch_size).all()
+        if not entries:
+            break
+
+        changes = build_batch(entries)
+        errors = {}
+        if changes:
+            outcome = _request(url, {'node_id': current_app.config['NODE_ID'], 'changes': changes})
+            statuses = outcome.get('changes', {})
+            # A shipped change stands for every entry of its row in this batch
+            errors = {
+                (change['table'], change['row_uid']): outcome.get('errors', {}).get(change['change_id'])
+                for change in changes if statuses.get(change['change_id']) == 'rejected'
+            }
+            if errors:
+                logging.warning("Central rejected %d change(s); they are marked 'rejected' in the change log",
+                                len(errors))
+
+        now = datetime.utcnow()
+        for entry in entries:
+            row_key = (entry.table_name, entry.row_uid)
+            if row_key in errors:
+                entry.status = 'rejected'
+                entry.error = errors[row_key]
+            else:
+                entry.synced_at = now
+        db.session.commit()
+        total += len(entries)
+        batches += 1
+    return total
+
+
+def rejected_changes():
+    """Edge entries central rejected, oldest first"""
+    return ChangeLog.query.filter(ChangeLog.status == 'rejected').order_by(ChangeLog.id).all()
+
+
+def retry_rejected_changes():
+    """Queue the rejected entries to be shipped again; returns how many"""
+    count = ChangeLog.query.filter(ChangeLog.status == 'rejected').update(
+        {'status': None, 'error': None}, synchronize_session=False
+    )
+    db.session.commit()
+    return count
+
+
+def pull_reference_data():
+    url = current_app.config['SYNC_CENTRAL_URL'].rstrip('/') + '/sync/reference'
+    return apply_reference_data(_request(url))
+
+
+def apply_reference_data(data):
+    """Insert or update reference rows by natural key; returns the number of rows written"""
+    written = 0
+    for name, (model, key, fields) in REFERENCE_MODELS.items():
+        records = data.get(name, [])
+        key_column = getattr(model, key)
+        existing = {
+            getattr(row, key): row
+            for row in model.query.filter(key_column.in_([record[key] for record in records]))
+        }
+        for record in records:
+            row = existing.get(record[key])
+            if row is None:
+                row = model(**{key: record[key]})
+                db.session.add(row)
+            for field in fields:
+                if getattr(row, field) != record.get(field):
+                    setattr(row, field, record.get(field))
+                    written += 1
+    db.session.commit()
+    return written
+
+
+# --- Central side ---
+
+def reference_data():
+    data = {}
+    for name, (model, key, fields) in REFERENCE_MODELS.items():
+        data[name] = [
+            {key: getattr(row, key), **{field: getattr(row, field) for field in fields}}
+            for row in model.query.order_by(getattr(model, key))
+        ]
+    return data
+
+
+def _current_versions(changes):
+    """{(table, row_uid): latest applied version} for the rows a batch touches"""
+    row_uids = {change['row_uid'] for change in changes}
+    return {
+        (table_name, row_uid): version
+        for table_name, row_uid, version in db.session.query(
+            ChangeLog.table_name, ChangeLog.row_uid, func.max(ChangeLog.version)
+        ).filter(
+            ChangeLog.row_uid.in_(row_uids),
+            or_(ChangeLog.status.is_(None), ChangeLog.status == 'applied')
+        ).group_by(ChangeLog.table_name, ChangeLog.row_uid)
+    }
+
+
+def _resolve_foreign_key(column, natural_key):
+    model, attribute = FOREIGN_KEYS[column]
+    local_id = db.session.query(model.id).filter(getattr(model, attribute) == natural_key).scalar()
+    if local_id is None:
+        raise SyncError(f"Unknown {model.__tablename__} {natural_key!r} for {column}")
+    return local_id
+
+
+def _apply_change(change):
+    model = MODELS_BY_TABLE.get(change['table'])
+    if model is None:
+        raise SyncError(f"Table {change['table']!r} is not synchronised")
+
+    row = model.query.filter_by(uid=change['row_uid']).first()
+    if change['operation'] == 'delete':
+        if row is not None:
+            db.session.delete(row)
+            db.session.flush()
+        return
+
+    # Resolve everything before touching the session, so no autoflush sees a half-built row
+    columns = model.__table__.columns
+    values = {}
+    for key, value in change['data'].items():
+        if key in LOCAL_COLUMNS or key not in columns:
+            continue
+        if key in FOREIGN_KEYS and value is not None:
+            value = _resolve_foreign_key(key, value)
+        else:
+            value = _decode(columns[key], value)
+        values[key] = value
+
+    if 'test_catalog_id' in columns and 'test_name' in values:
+        # Catalog ids are local to each node; resolve the name against this node's catalog
+        values['test_catalog_id'] = resolve_test(values['test_name'])
+
+    if row is None:
+        db.session.add(model(uid=change['row_uid'], **values))
+    else:
+        for key, value in values.items():
+            setattr(row, key, value)
+    db.session.flush()
+
+
+def apply_changes(node_id, changes):
+    """Apply a batch from an edge node.
+
+    Returns counts per outcome, plus 'changes' ({change_id: outcome}) and 'errors'
+    ({change_id: error} for rejected changes). Every received change is recorded in the
+    central ChangeLog with its outcome, which is what makes resends idempotent and lets
+    later changes be compared against the version already applied to a row. A change
+    that was rejected before is tried again.
+    """
+    counts = {'applied': 0, 'superseded': 0, 'rejected': 0, 'duplicate': 0}
+    outcomes = {}
+    errors = {}
+    received = {
+        entry.change_id: entry for entry in ChangeLog.query.filter(
+            ChangeLog.change_id.in_([change['change_id'] for change in changes])
+        )
+    }
+    known = {change_id for change_id, entry in received.items() if entry.status != 'rejected'}
+    versions = _current_versions(changes)
+    order = {model.__tablename__: position for position, model in enumerate(SYNCED_MODELS)}
+    changes = sorted(changes, key=lambda change: (order.get(change['table'], len(order)), change['version']))
+
+    db.session.info['skip_change_capture'] = True
+    try:
+        for change in changes:
+            if change['change_id'] in known:
+                counts['duplicate'] += 1
+                outcomes[change['change_id']] = 'duplicate'
+                continue
+
+            error = None
+            row_key = (change['table'], change['row_uid'])
+            if row_key in versions and versions[row_key] > change['version']:
+                status = 'superseded'
+            else:
+                try:
+                    with db.session.begin_nested():
+                        _apply_change(change)
+                    status = 'applied'
+                    versions[row_key] = change['version']
+                except Exception as e:
+                    status = 'rejected'
+                    error = str(e)
+                    logging.warning("Rejected change %s from %s: %s", change['change_id'], node_id, e)
+
+            entry = received.get(change['change_id'])
+            if entry is None:
+                entry = _log_entry(
+                    change['row_uid'], change['table'], change['operation'],
+                    node_id=change['node_id'],
+                    changed_at=datetime.fromisoformat(change['changed_at']),
+                    change_id=change['change_id']
+                )
+                db.session.add(entry)
+            entry.version = change['version']
+            entry.synced_at = datetime.utcnow()
+            entry.status = status
+            entry.error = error
+            known.add(change['change_id'])
+            counts[status] += 1
+            outcomes[change['change_id']] = status
+            if error is not None:
+                errors[change['change_id']] = error
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        db.session.info.pop('skip_change_capture', None)
+
+    logging.info("Applied sync batch from %s: %s", node_id, counts)
+    return {**counts, 'changes': outcomes, 'errors': errors}
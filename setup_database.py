@@ -1,8 +1,59 @@
 from app import app, db
-from models import User, Patient, Triage
+from models import User, Patient, Triage, Ward
+from services.beds import create_ward
+from services.lab_catalog import add_test, backfill_test_catalog_ids
+from services.clinicians import backfill_clinician_ids
 from datetime import datetime, timedelta
 import random
 
+# Inpatient wards as (name, bed label prefix, number of beds)
+DEFAULT_WARDS = [
+    ('General Medicine', 'GM', 20),
+    ('Cardiology', 'CARD', 16),
+    ('Neurology', 'NEURO', 12),
+    ('Orthopedics', 'ORTHO', 15),
+    ('Surgery', 'SURG', 18),
+    ('Pediatrics', 'PEDS', 24),
+    ('Intensive Care', 'ICU', 8),
+    ('Coronary Care', 'CCU', 6),
+    ('Obstetrics', 'OB', 10),
+    ('Gynecology', 'GYN', 8),
+    ('Oncology', 'ONC', 12),
+    ('Pulmonology', 'PULM', 10),
+    ('Nephrology', 'NEPH', 8),
+    ('Gastroenterology', 'GASTRO', 10),
+    ('Neonatal ICU', 'NICU', 12),
+    ('Psychiatric', 'PSYCH', 20),
+    ('Rehabilitation', 'REHAB', 16),
+]
+
+# Common emergency department tests as (code, name, test type, synonyms)
+DEFAULT_TEST_CATALOG = [
+    ('CBC', 'Complete Blood Count', 'laboratory', ['Full Blood Count', 'FBC', 'Hemogram', 'Blood Count']),
+    ('BMP', 'Basic Metabolic Panel', 'laboratory', ['Chem 7', 'Chem-7', 'Electrolytes', 'U&E', 'Urea and Electrolytes']),
+    ('CMP', 'Comprehensive Metabolic Panel', 'laboratory', ['Chem 14', 'Chem-14']),
+    ('TROP', 'Troponin', 'laboratory', ['Troponin I', 'Troponin T', 'hs-Troponin', 'High Sensitivity Troponin', 'TnI', 'TnT']),
+    ('LACT', 'Lactate', 'laboratory', ['Lactic Acid', 'Serum Lactate']),
+    ('ABG', 'Arterial Blood Gas', 'laboratory', ['Blood Gas', 'Arterial Blood Gases']),
+    ('COAG', 'Coagulation Panel', 'laboratory', ['PT/INR', 'PT INR', 'Coags', 'Clotting Screen']),
+    ('DDIM', 'D-Dimer', 'laboratory', ['D Dimer', 'Dimer']),
+    ('LFT', 'Liver Function Tests', 'laboratory', ['Liver Panel', 'Hepatic Function Panel']),
+    ('LIP', 'Lipase', 'laboratory', ['Serum Lipase']),
+    ('BNP', 'B-type Natriuretic Peptide', 'laboratory', ['NT-proBNP', 'Pro-BNP']),
+    ('CRP', 'C-Reactive Protein', 'laboratory', ['C Reactive Protein']),
+    ('BCX', 'Blood Culture', 'laboratory', ['Blood Cultures', 'Blood C/S']),
+    ('UA', 'Urinalysis', 'laboratory', ['Urine Analysis', 'Urine Dipstick', 'UA with Micro']),
+    ('GLU', 'Blood Glucose', 'laboratory', ['Glucose', 'Random Blood Sugar', 'RBS', 'Fingerstick Glucose']),
+    ('HCG', 'Pregnancy Test', 'laboratory', ['beta-hCG', 'Beta HCG', 'Serum hCG', 'Urine hCG']),
+    ('CXR', 'Chest X-Ray', 'radiology', ['Chest Radiograph', 'CXR PA', 'Chest Xray', 'Chest X Ray']),
+    ('CTH', 'CT Head', 'radiology', ['CT Brain', 'Head CT', 'Non-contrast CT Head']),
+    ('CTAP', 'CT Abdomen and Pelvis', 'radiology', ['CT Abd/Pelvis', 'CT A/P', 'CT Abdomen Pelvis']),
+    ('CTPA', 'CT Pulmonary Angiogram', 'radiology', ['CT Angiogram Chest', 'CTA Chest']),
+    ('ECG', 'Electrocardiogram', 'radiology', ['EKG', '12 Lead ECG', '12-lead EKG']),
+    ('USAB', 'Ultrasound Abdomen', 'radiology', ['Abdominal Ultrasound', 'US Abdomen']),
+    ('FAST', 'FAST Ultrasound', 'radiology', ['Focused Assessment with Sonography for Trauma', 'eFAST']),
+]
+
 def setup_test_data():
     """Create test users and some basic data for testing"""
     with app.app_context():
@@ -22,6 +73,18 @@ def setup_test_data():
             print("Created test user: nurse1/password123")
         else:
             print("Test user already exists")
+        
+        if not User.query.filter_by(username='doctor1').first():
+            test_doctor = User(
+                username='doctor1',
+                email='doctor1@example.com',
+                full_name='Test Doctor',
+                role='doctor'
+            )
+            test_doctor.set_password('password123')
+            db.session.add(test_doctor)
+            db.session.commit()
+            print("Created test doctor: doctor1/password123")
             
         # Create test patient if there are no patients
         if Patient.query.count() == 0:
@@ -62,6 +125,25 @@ def setup_test_data():
             db.session.commit()
             print("Created triage for test patients")
         
+        # Create the ward and bed inventory
+        if Ward.query.count() == 0:
+            for name, code, bed_count in DEFAULT_WARDS:
+                create_ward(name, code, bed_count)
+            db.session.commit()
+            print(f"Created {len(DEFAULT_WARDS)} wards")
+        else:
+            print("Wards already exist")
+        
+        # Create the lab test catalog, and link requests and results stored before it existed
+        for code, name, test_type, synonyms in DEFAULT_TEST_CATALOG:
+            add_test(code, name, test_type, synonyms)
+        db.session.commit()
+        print(f"Test catalog has {len(DEFAULT_TEST_CATALOG)} default tests; linked {backfill_test_catalog_ids()} stored rows")
+        
+        # Link examinations, orders and dispositions recorded by name to staff accounts
+        updated, unresolved = backfill_clinician_ids()
+        print(f"Linked {updated} rows to clinician accounts; {len(unresolved)} names unresolved")
+        
         print("Test data setup complete!")
 
 if __name__ == "__main__":
@@ -0,0 +1,90 @@
+import argparse
+import asyncio
+import random
+import time
+from datetime import datetime
+
+from services.hl7 import frame, extract_frames
+
+TESTS = [
+    ('CBC', 'Complete Blood Count', 'LAB', [('HGB', 'Hemoglobin', '13.5', 'g/dL', '12-16')]),
+    ('BMP', 'Basic Metabolic Panel', 'LAB', [('NA', 'Sodium', '140', 'mmol/L', '135-145'),
+                                             ('K', 'Potassium', '4.1', 'mmol/L', '3.5-5.1')]),
+    ('CXR', 'Chest X-Ray', 'RAD', [('IMP', 'Impression', 'No acute cardiopulmonary process', '', '')]),
+]
+
+def build_oru(control_id, mrn):
+    """Build a synthetic ORU^R01 message for one patient and one test"""
+    code, name, section, observations = random.choice(TESTS)
+    now = datetime.now().strftime('%Y%m%d%H%M%S')
+    segments = [
+        f"MSH|^~\\&|SIMLIS|LAB|SIGEDE|ER|{now}||ORU^R01|{control_id}|P|2.5",
+        f"PID|1||{mrn}^^^HOSP^MR||Test^Patient",
+        f"OBR|1||{control_id}^SIMLIS|{code}^{name}|||{now}||||||||||||||{now}|||F|{section}",
+    ]
+    for index, (obs_code, obs_name, value, units, reference) in enumerate(observations, start=1):
+        segments.append(f"OBX|{index}|NM|{obs_code}^{obs_name}||{value}|{units}|{reference}||||F")
+    return '\r'.join(segments) + '\r'
+
+async def run_connection(host, port, connection_id, count, mrns, window):
+    """Send `count` messages over one connection, keeping up to `window` un-ACKed"""
+    reader, writer = await asyncio.open_connection(host, port)
+    latencies = []
+    sent_at = {}
+    buffer = b''
+    acked = 0
+
+    async def receive():
+        nonlocal buffer, acked
+        while acked < count:
+            data = await reader.read(65536)
+            if not data:
+                return
+            acks, buffer = extract_frames(buffer + data)
+            for ack in acks:
+                control_id = ack.split('\r')[1].split('|')[2]
+                latencies.append(time.perf_counter() - sent_at.pop(control_id))
+                acked += 1
+
+    receiver = asyncio.create_task(receive())
+    for number in range(count):
+        while len(sent_at) >= window:
+            await asyncio.sleep(0.001)
+        control_id = f"SIM{connection_id:03d}{number:06d}{random.randint(0, 999999):06d}"
+        sent_at[control_id] = time.perf_counter()
+        writer.write(frame(build_oru(control_id, random.choice(mrns))))
+        await writer.drain()
+    await receiver
+    writer.close()
+    return latencies
+
+async def simulate(args):
+    mrns = [f"MRN{1000 + i}" for i in range(args.patients)]
+    started = time.perf_counter()
+    results = await asyncio.gather(*[
+        run_connection(args.host, args.port, i, args.messages, mrns, args.window)
+        for i in range(args.connections)
+    ])
+    elapsed = time.perf_counter() - started
+    latencies = sorted(latency for result in results for latency in result)
+    if not latencies:
+        print("No messages were acknowledged")
+        return
+    print(f"{len(latencies)} messages in {elapsed:.2f}s ({len(latencies) / elapsed:.0f} msg/s)")
+    print(f"ACK latency p50={latencies[len(latencies) // 2] * 1000:.1f}ms "
+          f"p99={latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms")
+
+def main():
+    """Simulated LIS that sends ORU^R01 results to the MLLP listener"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2575)
+    parser.add_argument('--connections', type=int, default=4)
+    parser.add_argument('--messages', type=int, default=250, help="Messages per connection")
+    parser.add_argument('--window', type=int, default=20, help="Un-ACKed messages allowed per connection")
+    parser.add_argument('--patients', type=int, default=5, help="Patients MRN1000.. to report results for")
+    args = parser.parse_args()
+    asyncio.run(simulate(args))
+
+if __name__ == "__main__":
+    main()
@@ -9,50 +9,18 @@ function initBedSelector() {
     const wardSelect = document.getElementById('destination_ward');
     const bedSelector = document.getElementById('bed-selection-container');
     const bedNumberInput = document.getElementById('bed_number');
+    const bedIdInput = document.getElementById('bed_id');
     const bedAvailableRadios = document.querySelectorAll('input[name="is_bed_available"]');
     const waitingListFields = document.getElementById('waiting-list-fields');
-    
-    // Mock data for beds - in a real implementation, this would come from an API
-    const wardsData = {
-        'General Medicine': generateWardData('GM', 20, 16),
-        'Cardiology': generateWardData('CARD', 16, 10),
-        'Neurology': generateWardData('NEURO', 12, 8),
-        'Orthopedics': generateWardData('ORTHO', 15, 9),
-        'Surgery': generateWardData('SURG', 18, 12),
-        'Pediatrics': generateWardData('PEDS', 24, 18),
-        'Intensive Care': generateWardData('ICU', 8, 7),
-        'Coronary Care': generateWardData('CCU', 6, 4),
-        'Obstetrics': generateWardData('OB', 10, 6),
-        'Gynecology': generateWardData('GYN', 8, 5),
-        'Oncology': generateWardData('ONC', 12, 9),
-        'Pulmonology': generateWardData('PULM', 10, 7),
-        'Nephrology': generateWardData('NEPH', 8, 5),
-        'Gastroenterology': generateWardData('GASTRO', 10, 8),
-        'Neonatal ICU': generateWardData('NICU', 12, 10),
-        'Psychiatric': generateWardData('PSYCH', 20, 15),
-        'Rehabilitation': generateWardData('REHAB', 16, 12)
-    };
-    
-    let selectedBed = null;
-    
+
+    // Bed the patient already holds, so it stays selectable when the page is revisited
+    const currentBedId = bedIdInput.value;
+
     // Event listeners
     wardSelect.addEventListener('change', function() {
-        updateBedDisplay(this.value);
-        
-        // Check if there are any available beds in this ward
-        const wardData = wardsData[this.value];
-        const availableBeds = wardData.beds.filter(bed => !bed.occupied);
-        
-        // Auto-select Yes/No for bed availability based on available beds
-        if (availableBeds.length > 0) {
-            document.getElementById('bed_available_yes').checked = true;
-            waitingListFields.classList.add('d-none');
-        } else {
-            document.getElementById('bed_available_no').checked = true;
-            waitingListFields.classList.remove('d-none');
-        }
+        loadWard(this.options[this.selectedIndex], true);
     });
-    
+
     // Toggle waiting list fields based on bed availability selection
     bedAvailableRadios.forEach(radio => {
         radio.addEventListener('change', function() {
@@ -63,24 +31,50 @@ function initBedSelector() {
             }
         });
     });
-    
+
     // Initial bed display if a ward is already selected
     if (wardSelect.value) {
-        updateBedDisplay(wardSelect.value);
+        loadWard(wardSelect.options[wardSelect.selectedIndex], false);
     }
-    
-    function updateBedDisplay(wardName) {
-        const wardData = wardsData[wardName];
-        if (!wardData) return;
-        
-        // Clear previous selection
-        selectedBed = null;
-        bedNumberInput.value = '';
-        
+
+    function loadWard(option, autoSelectAvailability) {
+        // Bed occupancy comes from the server-side inventory
+        fetch(option.dataset.bedsUrl)
+            .then(response => response.json())
+            .then(beds => {
+                updateBedDisplay(option.dataset.name, beds);
+
+                if (!autoSelectAvailability) return;
+
+                // Auto-select Yes/No for bed availability based on available beds
+                const availableBeds = beds.filter(bed => !bed.occupied);
+                if (availableBeds.length > 0) {
+                    document.getElementById('bed_available_yes').checked = true;
+                    waitingListFields.classList.add('d-none');
+                } else {
+                    document.getElementById('bed_available_no').checked = true;
+                    waitingListFields.classList.remove('d-none');
+                }
+            })
+            .catch(error => {
+                console.error('Error loading ward beds:', error);
+                bedSelector.innerHTML = '<div class="alert alert-danger mt-3">Unable to load bed availability for this ward</div>';
+            });
+    }
+
+    function updateBedDisplay(wardName, beds) {
+        const occupiedCount = beds.filter(b => b.occupied).length;
+
+        // Clear previous selection unless it is the patient's current bed
+        if (!beds.some(bed => String(bed.id) === currentBedId)) {
+            bedIdInput.value = '';
+            bedNumberInput.value = '';
+        }
+
         // Create the bed visualization
         bedSelector.innerHTML = `
             <div class="bed-selection-header mt-3 mb-3">
-                <h5>${wardName} Ward - ${wardData.beds.length} Beds</h5>
+                <h5>${wardName} Ward - ${beds.length} Beds</h5>
                 <div class="bed-legend">
                     <span class="bed-legend-item"><span class="bed-icon available"></span> Available</span>
                     <span class="bed-legend-item"><span class="bed-icon occupied"></span> Occupied</span>
@@ -93,94 +87,73 @@ function initBedSelector() {
                     <div class="ward-info card">
                         <div class="card-body">
                             <h6 class="card-title">Ward Information</h6>
-                            <p><strong>Total Beds:</strong> ${wardData.beds.length}</p>
-                            <p><strong>Occupied Beds:</strong> ${wardData.beds.filter(b => b.occupied).length}</p>
-                            <p><strong>Available Beds:</strong> ${wardData.beds.filter(b => !b.occupied).length}</p>
+                            <p><strong>Total Beds:</strong> ${beds.length}</p>
+                            <p><strong>Occupied Beds:</strong> ${occupiedCount}</p>
+                            <p><strong>Available Beds:</strong> ${beds.length - occupiedCount}</p>
                             <div class="selected-bed-info mt-3">
                                 <h6>Selected Bed</h6>
-                                <p id="selected-bed-display">None selected</p>
+                                <p id="selected-bed-display">${bedNumberInput.value || 'None selected'}</p>
                             </div>
                         </div>
                     </div>
                 </div>
             </div>
         `;
-        
+
         const bedGrid = document.getElementById('bed-grid');
-        const rows = Math.ceil(wardData.beds.length / 4); // 4 beds per row
-        
+        const rows = Math.ceil(beds.length / 4); // 4 beds per row
+
         // Create the bed grid
         for (let row = 0; row < rows; row++) {
             const rowDiv = document.createElement('div');
             rowDiv.className = 'bed-row';
-            
+
             for (let col = 0; col < 4; col++) {
                 const bedIndex = row * 4 + col;
-                if (bedIndex < wardData.beds.length) {
-                    const bed = wardData.beds[bedIndex];
+                if (bedIndex < beds.length) {
+                    const bed = beds[bedIndex];
+                    const isCurrent = String(bed.id) === currentBedId;
                     const bedDiv = document.createElement('div');
-                    bedDiv.className = `bed-cell ${bed.occupied ? 'occupied' : 'available'}`;
+                    bedDiv.className = `bed-cell ${isCurrent ? 'selected' : bed.occupied ? 'occupied' : 'available'}`;
                     bedDiv.setAttribute('data-bed-id', bed.id);
                     bedDiv.innerHTML = `
                         <div class="bed-icon"></div>
-                        <div class="bed-label">${bed.id}</div>
+                        <div class="bed-label">${bed.label}</div>
                     `;
-                    
+
                     // Only allow selection of available beds
-                    if (!bed.occupied) {
+                    if (!bed.occupied || isCurrent) {
                         bedDiv.addEventListener('click', function() {
-                            selectBed(bed.id, bedDiv);
+                            selectBed(bed, bedDiv);
                         });
                     }
-                    
+
                     rowDiv.appendChild(bedDiv);
                 }
             }
-            
+
             bedGrid.appendChild(rowDiv);
         }
     }
-    
-    function selectBed(bedId, bedElement) {
+
+    function selectBed(bed, bedElement) {
         // Clear previous selection
         const previousSelection = document.querySelector('.bed-cell.selected');
         if (previousSelection) {
             previousSelection.classList.remove('selected');
         }
-        
-        // Update selection
-        selectedBed = bedId;
+
         bedElement.classList.add('selected');
-        
-        // Update form field
-        bedNumberInput.value = bedId;
-        
+
+        // Update form fields
+        bedIdInput.value = bed.id;
+        bedNumberInput.value = bed.label;
+
         // Update display
-        document.getElementById('selected-bed-display').textContent = bedId;
-        
+        document.getElementById('selected-bed-display').textContent = bed.label;
+
         // Ensure "Yes" is selected for bed availability
         document.getElementById('bed_available_yes').checked = true;
         waitingListFields.classList.add('d-none');
     }
 }
-
-// Helper function to generate mock data for a ward
-function generateWardData(prefix, totalBeds, occupiedCount) {
-    const beds = [];
-    const occupiedBeds = new Set();
-    
-    // Generate a set of random occupied beds
-    while (occupiedBeds.size < occupiedCount) {
-        occupiedBeds.add(Math.floor(Math.random() * totalBeds) + 1);
-    }
-    
-    // Create the bed objects
-    for (let i = 1; i <= totalBeds; i++) {
-        beds.push({
-            id: `${prefix}-${i.toString().padStart(2, '0')}`,
-            occupied: occupiedBeds.has(i)
-        });
-    }
-    
-    return { beds };
-}
\ No newline at end of file
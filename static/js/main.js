@@ -46,6 +46,52 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     }
 
+    // Insurance eligibility check; the payer answers asynchronously, so poll while it is pending
+    const checkEligibilityBtn = document.getElementById('check-eligibility-btn');
+    if (checkEligibilityBtn) {
+        const eligibilityResult = document.getElementById('eligibility-result');
+        const badges = {
+            'eligible': 'bg-success',
+            'ineligible': 'bg-danger',
+            'pending': 'bg-secondary',
+            'unavailable': 'bg-warning text-dark',
+            'unsupported': 'bg-secondary'
+        };
+        
+        const showEligibility = function(data) {
+            const badge = document.createElement('span');
+            badge.className = 'badge ' + (badges[data.status] || 'bg-secondary');
+            badge.textContent = data.status.toUpperCase();
+            const details = document.createElement('span');
+            details.className = 'ms-2 small';
+            details.textContent = [data.plan, data.coverage_end && ('until ' + data.coverage_end), data.message]
+                .filter(Boolean).join(' - ');
+            eligibilityResult.replaceChildren(badge, details);
+        };
+        
+        const checkEligibility = function(attempt) {
+            const params = new URLSearchParams({
+                insurance_type: document.getElementById('insurance_type').value,
+                insurance_number: document.getElementById('insurance_number').value
+            });
+            fetch('/admin/eligibility?' + params.toString())
+            .then(response => response.json())
+            .then(data => {
+                showEligibility(data);
+                if (data.status === 'pending' && attempt < 20) {
+                    setTimeout(() => checkEligibility(attempt + 1), 1000);
+                }
+            })
+            .catch(error => {
+                console.error('Error checking eligibility:', error);
+            });
+        };
+        
+        checkEligibilityBtn.addEventListener('click', function() {
+            checkEligibility(0);
+        });
+    }
+
     // Triage category selection highlighting
     const triageCategoryRadios = document.querySelectorAll('input[name="triage_category"]');
     const triageDisplay = document.getElementById('triage-display');
@@ -1,6 +1,11 @@
 // print.js - Printing functionality for SiGeDe EMR system
 
 document.addEventListener('DOMContentLoaded', function() {
+    // Reuse the page's own (self-hosted, fingerprinted) stylesheets in printouts
+    const pageStylesheets = Array.from(document.querySelectorAll('link[rel="stylesheet"]'))
+        .map(link => link.outerHTML)
+        .join('\n');
+
     // Print Patient ID Band
     const printBandBtn = document.getElementById('print-id-band');
     if (printBandBtn) {
@@ -13,8 +18,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 <html>
                 <head>
                     <title>Patient ID Band</title>
-                    <link href="https://cdn.replit.com/agent/bootstrap-agent-dark-theme.min.css" rel="stylesheet">
-                    <link href="/static/css/custom.css" rel="stylesheet">
+                    ${pageStylesheets}
                     <style>
                         body {
                             background-color: white;
@@ -65,8 +69,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 <html>
                 <head>
                     <title>Patient Assessment</title>
-                    <link href="https://cdn.replit.com/agent/bootstrap-agent-dark-theme.min.css" rel="stylesheet">
-                    <link href="/static/css/custom.css" rel="stylesheet">
+                    ${pageStylesheets}
                     <style>
                         body {
                             background-color: white;
@@ -124,8 +127,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 <html>
                 <head>
                     <title>Discharge Instructions</title>
-                    <link href="https://cdn.replit.com/agent/bootstrap-agent-dark-theme.min.css" rel="stylesheet">
-                    <link href="/static/css/custom.css" rel="stylesheet">
+                    ${pageStylesheets}
                     <style>
                         body {
                             background-color: white;
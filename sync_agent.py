@@ -0,0 +1,59 @@
+import argparse
+import logging
+import time
+import urllib.error
+
+from app import app, db
+from services.sync import (
+    push_changes, pull_reference_data, snapshot_changes, rejected_changes, retry_rejected_changes, DEFAULT_BATCH_SIZE,
+)
+
+def sync_once(batch_size):
+    shipped = push_changes(batch_size)
+    updated = pull_reference_data()
+    logging.info("Shipped %d change log entries, updated %d reference fields", shipped, updated)
+    return shipped, updated
+
+def main():
+    """Ship this edge node's change log to the central database and pull reference data"""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    parser.add_argument('--once', action='store_true', help="Sync once and exit instead of looping")
+    parser.add_argument('--interval', type=float, default=60, help="Seconds between sync rounds")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument('--snapshot', action='store_true',
+                        help="First log every existing row, for a node that recorded data before syncing")
+    parser.add_argument('--retry-rejected', action='store_true',
+                        help="Ship changes central rejected earlier again, e.g. after adding a missing user there")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if not app.config['SYNC_CENTRAL_URL']:
+            parser.error("SYNC_CENTRAL_URL is not set")
+        if args.snapshot:
+            print(f"Logged {snapshot_changes(args.batch_size)} existing rows")
+        if args.retry_rejected:
+            print(f"Queued {retry_rejected_changes()} rejected change log entries to be shipped again")
+
+        while True:
+            try:
+                shipped, updated = sync_once(args.batch_size)
+                rejected = rejected_changes()
+                if rejected:
+                    logging.warning("%d change log entries were rejected by central; "
+                                    "fix the cause and run with --retry-rejected", len(rejected))
+                if args.once:
+                    print(f"Shipped {shipped} change log entries, updated {updated} reference fields")
+                    for entry in rejected:
+                        print(f"Rejected: {entry.table_name} {entry.row_uid} (change {entry.change_id}): {entry.error}")
+            except (urllib.error.URLError, OSError) as e:
+                # Offline is normal for an edge node; unsynced entries wait for the next round
+                db.session.rollback()
+                logging.warning("Central database unreachable, will retry: %s", e)
+                if args.once:
+                    raise SystemExit(1)
+            if args.once:
+                break
+            time.sleep(args.interval)
+
+if __name__ == "__main__":
+    main()
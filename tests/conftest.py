@@ -0,0 +1,11 @@
+import os
+import tempfile
+
+# The app reads its configuration at import; point it at scratch databases before any test imports it
+_scratch = tempfile.mkdtemp()
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{_scratch}/sigede.db",
+    ARCHIVE_DATABASE_URL=f"sqlite:///{_scratch}/sigede_archive.db",
+    JINJA_CACHE_DIR='',
+    LABEL_PRINTER=os.path.join(_scratch, 'label_spool'),
+)
@@ -0,0 +1,45 @@
+from datetime import date, datetime, timedelta
+
+from app import app, db
+from models import AdmissionQueueEntry, ArchivedEncounter, Disposition, Patient
+from services.archive import archive_closed_encounters, restore_encounter
+from services.beds import cancel_queue_entries, create_ward, enqueue
+
+
+def _closed_encounter(name, days_ago=400):
+    patient = Patient(first_name='Archive', last_name=name, date_of_birth=date(1970, 1, 1),
+                      gender='F', arrival_mode='walk-in')
+    db.session.add(patient)
+    db.session.flush()
+    disposition = Disposition(patient_id=patient.id, disposition_type='inpatient', authorized_by='Dr. Test',
+                              is_completed=True, completed_at=datetime.utcnow() - timedelta(days=days_ago))
+    db.session.add(disposition)
+    db.session.flush()
+    return patient, disposition
+
+
+def test_archive_moves_queue_history_and_keeps_merge_targets():
+    with app.app_context():
+        ward = create_ward('Archive check ward', 'ACW', 1)
+        queued, disposition = _closed_encounter('Queued')
+        enqueue(disposition, ward.id, priority=5)
+        cancel_queue_entries(disposition.id)
+        target, _ = _closed_encounter('Merge target')
+        placeholder = Patient(first_name='Unknown', last_name='Placeholder', date_of_birth=date(1970, 1, 1),
+                              gender='U', arrival_mode='ambulance', is_placeholder=True, merged_into_id=target.id)
+        db.session.add(placeholder)
+        db.session.commit()
+        queued_id, target_id = queued.id, target.id
+
+        archive_closed_encounters(pause=0)
+
+        # The queue entry referring to the disposition went to the archive with it
+        assert db.session.get(Patient, queued_id) is None
+        assert AdmissionQueueEntry.query.filter_by(patient_id=queued_id).count() == 0
+        assert db.session.get(ArchivedEncounter, queued_id).payload['admission_queue_entry']
+        # A placeholder still points at the target, so the target stays in the hot tables
+        assert db.session.get(Patient, target_id) is not None
+        assert db.session.get(ArchivedEncounter, target_id) is None
+
+        restore_encounter(queued_id)
+        assert AdmissionQueueEntry.query.filter_by(patient_id=queued_id).count() == 1
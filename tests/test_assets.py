@@ -0,0 +1,13 @@
+from app import app
+from services.assets import asset_urls
+
+
+def test_missing_vendor_files_are_not_loaded_from_a_cdn(monkeypatch, tmp_path):
+    # No build, and static/vendor has not been fetched in this checkout
+    monkeypatch.setitem(app.config, 'ASSET_DIST_DIR', str(tmp_path))
+    monkeypatch.setattr(app, 'static_folder', str(tmp_path))
+    with app.test_request_context():
+        assert asset_urls('chart.js') == []
+
+        monkeypatch.setitem(app.config, 'ASSET_CDN_FALLBACK', True)
+        assert asset_urls('chart.js') == ['https://cdn.jsdelivr.net/npm/chart.js@4.4.0/dist/chart.umd.js']
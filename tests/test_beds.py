@@ -0,0 +1,52 @@
+from datetime import date
+
+from app import app, db
+from models import Bed, Disposition, Patient, User, Ward
+from services.beds import assign_bed, create_ward, enqueue, withdraw_from_admission
+
+
+def _inpatient(name):
+    patient = Patient(first_name='Bed', last_name=name, date_of_birth=date(1980, 1, 1),
+                      gender='M', arrival_mode='walk-in')
+    db.session.add(patient)
+    db.session.flush()
+    disposition = Disposition(patient_id=patient.id, disposition_type='inpatient', authorized_by='Dr. Test')
+    db.session.add(disposition)
+    db.session.flush()
+    return disposition
+
+
+def test_released_bed_is_not_freed_again_by_its_previous_patient():
+    with app.app_context():
+        user = User(username='bed-check', email='bed-check@example.org', full_name='Bed Check')
+        user.set_password('secret')
+        db.session.add(user)
+        ward = create_ward('Bed check ward', 'BCW', 1)
+        bed = Bed.query.filter_by(ward_id=ward.id).one()
+        first, second = _inpatient('First'), _inpatient('Second')
+        assign_bed(bed.id, first.patient_id)
+        first.bed_id, first.bed_number = bed.id, bed.label
+        enqueue(second, ward.id, priority=3)
+        db.session.commit()
+        ward_id, bed_id, first_id, second_id = ward.id, bed.id, first.id, second.id
+        first_patient_id = first.patient_id
+
+    client = app.test_client()
+    client.post('/login', data={'username': 'bed-check', 'password': 'secret'})
+    # The ward discharges the first patient; the bed goes to the head of the queue
+    assert client.post(f'/transfer/beds/{bed_id}/release').status_code == 200
+
+    with app.app_context():
+        first = db.session.get(Disposition, first_id)
+        assert first.bed_id is None
+        second = db.session.get(Disposition, second_id)
+        assert db.session.get(Bed, bed_id).patient_id == second.patient_id
+        # Changing the first patient's disposition afterwards must leave the new patient's bed alone
+        withdraw_from_admission(first)
+        db.session.commit()
+        assert db.session.get(Bed, bed_id).patient_id == second.patient_id
+        assert db.session.get(Ward, ward_id).occupied_beds == 1
+
+    # Releasing for a patient who no longer holds the bed is refused
+    response = client.post(f'/transfer/beds/{bed_id}/release', data={'patient_id': first_patient_id})
+    assert response.status_code == 409
@@ -0,0 +1,73 @@
+import threading
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from app import app
+from eligibility_stub import PayerHandler
+from services.eligibility import EligibilityChecker, parse_payers
+
+PAYER = 'National Health Insurance'
+
+
+@pytest.fixture
+def stub_payer():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), PayerHandler)
+    server.latency = 0.0
+    server.failure_rate = 0.0
+    server.quiet = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture
+def checker(stub_payer, monkeypatch):
+    url = f"http://127.0.0.1:{stub_payer.server_address[1]}/eligibility"
+    monkeypatch.setitem(app.config, 'ELIGIBILITY_PAYERS', parse_payers(
+        f'{{"{PAYER}": {{"url": "{url}", "timeout": 2, "failure_threshold": 2, "reset_after": 60}}}}'
+    ))
+    monkeypatch.setitem(app.config, 'ELIGIBILITY_WORKERS', 2)
+    monkeypatch.setitem(app.config, 'ELIGIBILITY_CACHE_TTL', 60.0)
+    with app.app_context():
+        checker = EligibilityChecker()
+        yield checker
+    if checker.executor is not None:
+        checker.executor.shutdown(wait=True)
+
+
+def test_answers_are_mapped_cached_and_sent_over_kept_alive_connections(checker):
+    assert checker.check(PAYER, 'A100', wait=5)['status'] == 'eligible'
+    assert checker.check(PAYER, 'A101', wait=5)['status'] == 'ineligible'
+    unknown = checker.check(PAYER, 'X999', wait=5)
+    assert (unknown['status'], unknown['message']) == ('ineligible', 'Member not found')
+    assert checker.check('Self-pay', 'A100')['status'] == 'unsupported'
+
+    assert checker.check(PAYER, 'A100', wait=5)['status'] == 'eligible'
+    snapshot = checker.snapshot()
+    assert snapshot['checks'] == 3
+    assert snapshot['cache_hits'] == 1
+    assert snapshot['payers'][PAYER]['reused'] >= 1
+
+
+def test_slow_payer_answers_pending_and_shares_the_running_check(checker, stub_payer):
+    stub_payer.latency = 0.5
+    assert checker.check(PAYER, 'A200', wait=0)['status'] == 'pending'
+    # The same member is not asked twice while the first check is running
+    first = checker.submit(PAYER, 'A200')
+    assert checker.submit(PAYER, 'A200') is first
+    assert first.result(timeout=5)['status'] == 'eligible'
+    assert checker.snapshot()['checks'] == 1
+
+
+def test_failing_payer_opens_the_circuit(checker, stub_payer):
+    stub_payer.failure_rate = 1.0
+    assert checker.check(PAYER, 'A300', wait=5)['status'] == 'unavailable'
+    assert checker.check(PAYER, 'A302', wait=5)['status'] == 'unavailable'
+    # failure_threshold is 2: the next check is answered without calling the payer
+    assert checker.check(PAYER, 'A304', wait=5)['status'] == 'unavailable'
+    snapshot = checker.snapshot()
+    assert snapshot['payers'][PAYER]['circuit'] == 'open'
+    assert (snapshot['checks'], snapshot['failures'], snapshot['short_circuited']) == (2, 2, 1)
@@ -0,0 +1,43 @@
+import csv
+import io
+from datetime import date
+
+from app import app, db
+from models import Patient, User
+
+
+def _logged_in_client():
+    with app.app_context():
+        if User.query.filter_by(username='export-check').first() is None:
+            user = User(username='export-check', email='export-check@example.org', full_name='Export Check')
+            user.set_password('secret')
+            db.session.add(user)
+            for number in range(3):
+                db.session.add(Patient(first_name='Test', last_name=f'Patient {number}',
+                                       date_of_birth=date(1990, 1, 1), gender='F', arrival_mode='walk-in'))
+            db.session.commit()
+    client = app.test_client()
+    client.post('/login', data={'username': 'export-check', 'password': 'secret'})
+    return client
+
+
+def test_registrations_csv_streams_to_the_end():
+    client = _logged_in_client()
+    response = client.get('/export/registrations.csv')
+    assert response.status_code == 200
+    rows = list(csv.reader(io.StringIO(response.get_data(as_text=True))))
+    with app.app_context():
+        assert len(rows) == Patient.query.count() + 1
+    # The request teardown ran inside the stream; the next request must still be served
+    assert client.get('/export/registrations.csv').status_code == 200
+
+
+def test_registrations_gzip_follows_accept_encoding():
+    client = _logged_in_client()
+    response = client.get('/export/registrations.ndjson', headers={'Accept-Encoding': 'gzip, br'})
+    assert response.headers.get('Content-Encoding') == 'gzip'
+    # Read to the end, so the stream's request context is closed here rather than at garbage collection
+    response.get_data()
+    response = client.get('/export/registrations.ndjson', headers={'Accept-Encoding': 'gzip;q=0, br'})
+    assert 'Content-Encoding' not in response.headers
+    response.get_data()
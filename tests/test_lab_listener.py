@@ -0,0 +1,119 @@
+import asyncio
+import socket
+import threading
+from datetime import date
+
+import pytest
+
+from app import app, db
+from models import ExternalLabResult, LabRequest, Patient
+from services.hl7 import HL7Message, extract_frames, frame
+from services.lab_listener import LabResultListener
+from simulate_lis import build_oru, run_connection
+
+
+@pytest.fixture
+def listener():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        port = probe.getsockname()[1]
+    listener = LabResultListener(app, host='127.0.0.1', port=port, batch_size=10, batch_delay=0.01)
+    loop = asyncio.new_event_loop()
+    task = loop.create_task(listener.serve_forever())
+
+    def serve():
+        try:
+            loop.run_until_complete(task)
+        except asyncio.CancelledError:
+            pass
+
+    thread = threading.Thread(target=serve, daemon=True)
+    thread.start()
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            break
+        except OSError:
+            threading.Event().wait(0.05)
+    yield listener
+    loop.call_soon_threadsafe(task.cancel)
+    thread.join(timeout=5)
+    loop.close()
+
+
+def _oru(control_id, facility, mrn, test='GLU^Glucose'):
+    return '\r'.join([
+        f"MSH|^~\\&|LIS|{facility}|SIGEDE|ER|20250101120000||ORU^R01|{control_id}|P|2.5",
+        f"PID|1||{mrn}^^^HOSP^MR||Test^Patient",
+        f"OBR|1||{control_id}^LIS|{test}|||20250101115000||||||||||||||20250101115500|||F|CH",
+        "OBX|1|NM|GLU^Glucose||5.4|mmol/L|3.9-7.8||||F",
+    ]) + '\r'
+
+
+def _patient_with_open_request(mrn):
+    patient = Patient(first_name='Lab', last_name=mrn, date_of_birth=date(1985, 5, 5), gender='F',
+                      arrival_mode='walk-in', medical_record_number=mrn)
+    db.session.add(patient)
+    db.session.flush()
+    db.session.add(LabRequest(patient_id=patient.id, test_type='laboratory', test_name='Glucose',
+                              requested_by='Dr. Test'))
+    db.session.commit()
+
+
+def test_results_are_stored_and_matched_for_the_sending_facility_site(monkeypatch):
+    monkeypatch.setitem(app.config, 'SITES', {'MAIN': 'Main', 'NORTH': 'North'})
+    monkeypatch.setitem(app.config, 'LAB_FACILITY_SITES', {'NORTHLAB': 'NORTH'})
+    with app.app_context():
+        _patient_with_open_request('LS-MAIN-1')
+    listener = LabResultListener(app)
+
+    outcomes = listener._store_batch([
+        HL7Message(_oru('LS0001', 'NORTHLAB', 'LS-MAIN-1')),
+        HL7Message(_oru('LS0002', 'MAIN', 'LS-MAIN-1')),
+        HL7Message(_oru('LS0003', 'ELSEWHERE', 'LS-MAIN-1')),
+    ])
+
+    assert [code for code, _ in outcomes] == ['AA', 'AA', 'AR']
+    with app.app_context():
+        north = ExternalLabResult.query.filter_by(external_system_id='LS0001').one()
+        main = ExternalLabResult.query.filter_by(external_system_id='LS0002').one()
+        # The North lab's result is not matched to a patient of the main site
+        assert (north.site_code, north.is_imported) == ('NORTH', False)
+        assert (main.site_code, main.is_imported) == ('MAIN', True)
+        assert ExternalLabResult.query.filter_by(external_system_id='LS0003').count() == 0
+
+
+def test_pipelined_messages_from_the_simulated_lis_are_stored_and_acked(listener):
+    async def send_all():
+        return await asyncio.gather(*[
+            run_connection('127.0.0.1', listener.port, connection_id, 25, ['LIS-SIM-1', 'LIS-SIM-2'], window=10)
+            for connection_id in (901, 902)
+        ])
+
+    latencies = asyncio.run(send_all())
+    # Every message was acknowledged, several per batch
+    assert [len(connection) for connection in latencies] == [25, 25]
+    assert listener.stats['messages'] == 50
+    assert listener.stats['batches'] < 50
+    with app.app_context():
+        assert ExternalLabResult.query.filter(ExternalLabResult.patient_mrn.like('LIS-SIM-%')).count() == 50
+
+
+def test_redelivered_message_is_acked_without_storing_it_twice(listener):
+    message = build_oru('REDELIVER0001', 'LIS-SIM-3')
+
+    async def send_twice():
+        reader, writer = await asyncio.open_connection('127.0.0.1', listener.port)
+        writer.write(frame(message) + frame(message))
+        await writer.drain()
+        acks, buffer = [], b''
+        while len(acks) < 2:
+            received, buffer = extract_frames(buffer + await reader.read(65536))
+            acks.extend(received)
+        writer.close()
+        return acks
+
+    acks = asyncio.run(send_twice())
+    assert [ack.split('\r')[1].split('|')[1] for ack in acks] == ['AA', 'AA']
+    with app.app_context():
+        assert ExternalLabResult.query.filter_by(patient_mrn='LIS-SIM-3').count() == 1
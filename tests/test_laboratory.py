@@ -0,0 +1,14 @@
+from app import app
+
+
+def _result(external_id, site_code):
+    return {'external_id': external_id, 'patient_mrn': 'LAB-NONE', 'test_type': 'laboratory',
+            'test_name': 'Glucose', 'result': '5.4 mmol/L', 'site_code': site_code}
+
+
+def test_duplicate_external_id_from_another_site_is_a_conflict(monkeypatch):
+    monkeypatch.setitem(app.config, 'SITES', {'MAIN': 'Main', 'NORTH': 'North'})
+    client = app.test_client()
+    assert client.post('/external-lab-api/results', json=_result('DUP-1', 'MAIN')).status_code == 201
+    response = client.post('/external-lab-api/results', json=_result('DUP-1', 'NORTH'))
+    assert response.status_code == 409
@@ -0,0 +1,52 @@
+import os
+import shutil
+import tempfile
+
+from sqlalchemy import create_engine, inspect, text
+
+from app import app, db
+from services.migrations import upgrade_schema
+from services.sites import site_bind_key
+
+# Database as created by the first release, before site_code, uid and the other added columns
+BASELINE_DB = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'instance', 'sigede.db')
+
+
+def test_upgrade_schema_adds_and_fills_new_columns():
+    path = os.path.join(tempfile.mkdtemp(), 'baseline.db')
+    shutil.copy(BASELINE_DB, path)
+    engine = create_engine(f"sqlite:///{path}")
+    with engine.begin() as connection:
+        connection.execute(text(
+            "INSERT INTO user (username, email, password_hash, full_name, role) "
+            "VALUES ('anggi', 'anggi@example.org', 'x', 'Anggi Pratama', 'doctor')"
+        ))
+        connection.execute(text("UPDATE doctor_examination SET doctor_name = 'dr. Anggi Pratama'"))
+    with app.app_context():
+        # Upgraded as the database of site NORTH, the way SITE_DATABASES entries are
+        db.engines[site_bind_key('NORTH')] = engine
+        try:
+            added = upgrade_schema(engine, 'NORTH')
+        finally:
+            del db.engines[site_bind_key('NORTH')]
+        assert 'doctor_examination.site_code' in added
+        assert 'prescription.version' in added
+        assert 'disposition.bed_id' in added
+
+        with engine.connect() as connection:
+            patients, uids, sites = connection.execute(text(
+                "SELECT count(*), count(DISTINCT uid), min(site_code) FROM patient"
+            )).one()
+            assert patients == uids
+            assert sites == 'NORTH'
+            assert connection.execute(text("SELECT count(*) FROM patient WHERE updated_at IS NULL")).scalar() == 0
+            # Clinician names were linked to the staff account
+            assert connection.execute(text(
+                "SELECT count(*) FROM doctor_examination WHERE doctor_id IS NULL"
+            )).scalar() == 0
+        indexes = {index['name'] for index in inspect(engine).get_indexes('patient')}
+        assert {'ix_patient_site_created_at', 'uq_patient_uid'} <= indexes
+
+        # A second run finds nothing to do
+        assert upgrade_schema(engine, 'NORTH') == []
+    engine.dispose()
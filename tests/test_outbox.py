@@ -0,0 +1,92 @@
+import json
+import threading
+from datetime import timedelta
+from http.server import ThreadingHTTPServer
+
+import pytest
+
+from app import app, db
+from models import OutboxEvent, new_uid
+from outbox_sink_standin import SinkHandler
+from services.outbox import OutboxRelay, parse_destinations
+
+
+@pytest.fixture
+def sink(tmp_path):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SinkHandler)
+    server.output = str(tmp_path / 'received.jsonl')
+    server.failure_rate = 0.0
+    server.quiet = True
+    server.lock = threading.Lock()
+    server.seen = set()
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def _received(sink):
+    with open(sink.output, encoding='utf-8') as f:
+        return [json.loads(line)['sequence'] for line in f]
+
+
+def _relay(sink, name, batch_size=2):
+    url = f"http://127.0.0.1:{sink.server_address[1]}/events"
+    return OutboxRelay(parse_destinations(json.dumps({name: {'url': url, 'batch_size': batch_size}})))
+
+
+def _queue_events(name, count):
+    for sequence in range(count):
+        event_id = new_uid()
+        db.session.add(OutboxEvent(event_id=event_id, destination=name, event_type='test.event',
+                                   payload={'event_id': event_id, 'sequence': sequence}))
+    db.session.commit()
+
+
+def _pending(name):
+    return OutboxEvent.query.filter_by(destination=name, delivered_at=None).order_by(OutboxEvent.id).all()
+
+
+def test_events_are_delivered_in_order_in_batches(sink):
+    with app.app_context():
+        _queue_events('in-order', 5)
+        relay = _relay(sink, 'in-order')
+        assert [relay.deliver_batch('in-order') for _ in range(4)] == [2, 2, 1, 0]
+        assert _received(sink) == [0, 1, 2, 3, 4]
+        assert _pending('in-order') == []
+
+
+def test_failed_batch_backs_off_and_holds_back_later_events(sink):
+    with app.app_context():
+        _queue_events('backoff', 3)
+        relay = _relay(sink, 'backoff')
+        sink.failure_rate = 1.0
+        assert relay.deliver_batch('backoff') == 0
+        head = _pending('backoff')[0]
+        assert head.attempts == 1 and head.next_attempt_at is not None
+        retry_at = head.next_attempt_at
+
+        # Before the retry time nothing is sent, not even the events behind the head
+        sink.failure_rate = 0.0
+        assert relay.deliver_batch('backoff', now=retry_at - timedelta(seconds=0.1)) == 0
+        assert _pending('backoff')[0].attempts == 1
+
+        assert relay.deliver_batch('backoff', now=retry_at) == 2
+        assert relay.deliver_batch('backoff', now=retry_at) == 1
+        assert _received(sink) == [0, 1, 2]
+        assert relay.stats['failures'] == 1
+
+
+def test_batch_sent_but_not_marked_is_delivered_again_and_deduplicated(sink):
+    with app.app_context():
+        _queue_events('redelivery', 2)
+        relay = _relay(sink, 'redelivery')
+        # A relay that died after sending, before marking the batch delivered
+        relay.sinks['redelivery'].send([event.payload for event in _pending('redelivery')])
+        assert _pending('redelivery')
+
+        assert relay.deliver_batch('redelivery') == 2
+        assert _pending('redelivery') == []
+        # The receiver saw the batch twice and kept each event once, by event_id
+        assert _received(sink) == [0, 1]
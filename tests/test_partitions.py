@@ -0,0 +1,82 @@
+import os
+import subprocess
+import sys
+import tempfile
+import textwrap
+
+import pytest
+
+# Partitioning only exists on Postgres; point this at a scratch database (its public schema is dropped)
+POSTGRES_URL = os.environ.get('TEST_POSTGRES_URL')
+
+pytestmark = pytest.mark.skipif(not POSTGRES_URL, reason="TEST_POSTGRES_URL is not set")
+
+# Runs in its own process: models decide on partitioning when they are imported
+SCRIPT = textwrap.dedent('''
+    import os
+    from datetime import date, datetime
+
+    from sqlalchemy import create_engine, text
+
+    with create_engine(os.environ['DATABASE_URL']).begin() as connection:
+        connection.execute(text("DROP SCHEMA public CASCADE"))
+        connection.execute(text("CREATE SCHEMA public"))
+
+    from app import app, db
+    from models import Patient, Triage, User
+    from services.partitions import _add_months, ensure_partitions, partition_name
+
+    def partitions():
+        return set(db.session.execute(text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "JOIN pg_class p ON p.oid = i.inhparent WHERE p.relname = 'triage'"
+        )).scalars())
+
+    with app.app_context():
+        now = datetime.utcnow()
+        current = datetime(now.year, now.month, 1)
+        # Created at startup: the default partition, this month and the next three
+        assert {'triage_default', partition_name('triage', current),
+                partition_name('triage', _add_months(current, 3))} <= partitions()
+
+        user = User(username='partition-check', email='partition-check@example.org', full_name='Partition Check')
+        user.set_password('secret')
+        patient = Patient(first_name='Part', last_name='Ition', date_of_birth=date(1990, 1, 1),
+                          gender='F', arrival_mode='walk-in')
+        db.session.add_all([user, patient])
+        db.session.flush()
+        old_month = _add_months(current, -14)
+        db.session.add(Triage(patient_id=patient.id, category='green', reason='back-dated',
+                              triaged_by=user.id, vital_signs={}, triaged_at=old_month.replace(day=15)))
+        db.session.commit()
+        assert db.session.execute(text("SELECT count(*) FROM triage_default")).scalar() == 1
+
+        # The month's rows sit in the default partition, so it is skipped without moving them
+        ensure_partitions(months_back=14)
+        assert partition_name('triage', old_month) not in partitions()
+
+        ensure_partitions(months_back=14, move_default_rows=True)
+        assert partition_name('triage', old_month) in partitions()
+        assert db.session.execute(text("SELECT count(*) FROM triage_default")).scalar() == 0
+        assert db.session.execute(text(
+            f'SELECT count(*) FROM "{partition_name("triage", old_month)}"'
+        )).scalar() == 1
+        # Queries on the parent table still see the row
+        assert Triage.query.filter_by(reason='back-dated').count() == 1
+''')
+
+
+def test_monthly_partitions_and_moving_default_rows():
+    scratch = tempfile.mkdtemp()
+    environment = dict(
+        os.environ,
+        DATABASE_URL=POSTGRES_URL,
+        PARTITION_TABLES='1',
+        ARCHIVE_DATABASE_URL=f"sqlite:///{scratch}/sigede_archive.db",
+        JINJA_CACHE_DIR='',
+        LABEL_PRINTER=os.path.join(scratch, 'label_spool'),
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    completed = subprocess.run([sys.executable, '-c', SCRIPT], cwd=root, env=environment,
+                               capture_output=True, text=True, timeout=120)
+    assert completed.returncode == 0, completed.stderr[-4000:]